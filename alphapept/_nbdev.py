@@ -13,6 +13,10 @@ index = {"print_settings": "00_settings.ipynb",
          "spec": "10_constants.ipynb",
          "get_average_formula": "01_chem.ipynb",
          "mass_to_dist": "01_chem.ipynb",
+         "get_averagine_m0": "01_chem.ipynb",
+         "get_averagine_table": "01_chem.ipynb",
+         "mass_to_dist_table": "01_chem.ipynb",
+         "load_averagine_table": "01_chem.ipynb",
          "calculate_mass": "01_chem.ipynb",
          "M_PROTON": "04_feature_finding.ipynb",
          "load_thermo_raw": "02_io.ipynb",
@@ -30,6 +34,7 @@ index = {"print_settings": "00_settings.ipynb",
          "centroid_data": "02_io.ipynb",
          "get_most_abundant": "02_io.ipynb",
          "list_to_numpy_f32": "02_io.ipynb",
+         "gather_csr": "02_io.ipynb",
          "HDF_File": "02_io.ipynb",
          "HDF_File.read": "02_io.ipynb",
          "HDF_File.write": "02_io.ipynb",
@@ -79,10 +84,17 @@ index = {"print_settings": "00_settings.ipynb",
          "pept_dict_from_search": "03_fasta.ipynb",
          "save_database": "03_fasta.ipynb",
          "read_database": "03_fasta.ipynb",
+         "write_search_index": "03_fasta.ipynb",
+         "add_search_index": "03_fasta.ipynb",
+         "read_search_index": "03_fasta.ipynb",
+         "SEARCH_INDEX_VERSION": "03_fasta.ipynb",
          "connect_centroids_unidirection": "04_feature_finding.ipynb",
          "find_centroid_connections": "04_feature_finding.ipynb",
          "convert_connections_to_array": "04_feature_finding.ipynb",
          "eliminate_overarching_vertex": "04_feature_finding.ipynb",
+         "get_centroid_connections": "04_feature_finding.ipynb",
+         "filter_centroid_connections": "04_feature_finding.ipynb",
+         "remove_overarching_connections": "04_feature_finding.ipynb",
          "connect_centroids": "04_feature_finding.ipynb",
          "path_finder": "04_feature_finding.ipynb",
          "find_path_start": "04_feature_finding.ipynb",
@@ -95,16 +107,25 @@ index = {"print_settings": "00_settings.ipynb",
          "split_hills": "04_feature_finding.ipynb",
          "check_large_hills": "04_feature_finding.ipynb",
          "filter_hills": "04_feature_finding.ipynb",
+         "random_index": "04_feature_finding.ipynb",
          "hill_stats": "04_feature_finding.ipynb",
          "remove_duplicates": "04_feature_finding.ipynb",
          "get_hill_data": "04_feature_finding.ipynb",
+         "SPLITMIX_GAMMA": "04_feature_finding.ipynb",
+         "SPLITMIX_MUL_1": "04_feature_finding.ipynb",
+         "SPLITMIX_MUL_2": "04_feature_finding.ipynb",
          "check_isotope_pattern": "04_feature_finding.ipynb",
          "DELTA_M": "04_feature_finding.ipynb",
          "DELTA_S": "04_feature_finding.ipynb",
          "maximum_offset": "04_feature_finding.ipynb",
          "correlate": "04_feature_finding.ipynb",
-         "extract_edge": "04_feature_finding.ipynb",
+         "check_edge": "04_feature_finding.ipynb",
+         "count_edges": "04_feature_finding.ipynb",
+         "fill_edges": "04_feature_finding.ipynb",
          "edge_correlation": "04_feature_finding.ipynb",
+         "find_root": "04_feature_finding.ipynb",
+         "label_components": "04_feature_finding.ipynb",
+         "get_connected_components": "04_feature_finding.ipynb",
          "get_pre_isotope_patterns": "04_feature_finding.ipynb",
          "check_isotope_pattern_directed": "04_feature_finding.ipynb",
          "grow": "04_feature_finding.ipynb",
@@ -121,6 +142,7 @@ index = {"print_settings": "00_settings.ipynb",
          "int_list_to_array": "04_feature_finding.ipynb",
          "mz_to_mass": "04_feature_finding.ipynb",
          "isolate_isotope_pattern": "04_feature_finding.ipynb",
+         "isolate_isotope_patterns_parallel": "04_feature_finding.ipynb",
          "get_isotope_patterns": "04_feature_finding.ipynb",
          "report_": "04_feature_finding.ipynb",
          "feature_finder_report": "04_feature_finding.ipynb",
@@ -128,31 +150,81 @@ index = {"print_settings": "00_settings.ipynb",
          "extract_bruker": "04_feature_finding.ipynb",
          "convert_bruker": "04_feature_finding.ipynb",
          "map_bruker": "04_feature_finding.ipynb",
+         "find_features_thermo": "04_feature_finding.ipynb",
          "find_features": "04_feature_finding.ipynb",
+         "get_rt_windows": "04_feature_finding.ipynb",
+         "get_feature_finding_memory": "04_feature_finding.ipynb",
+         "slice_query_data": "04_feature_finding.ipynb",
+         "stitch_features": "04_feature_finding.ipynb",
+         "get_hill_centroid_tol": "04_feature_finding.ipynb",
+         "find_features_windowed": "04_feature_finding.ipynb",
          "replace_infs": "04_feature_finding.ipynb",
          "map_ms2": "04_feature_finding.ipynb",
          "compare_frags": "05_search.ipynb",
          "ppm_to_dalton": "05_search.ipynb",
+         "get_precursor_bins": "05_search.ipynb",
+         "searchsorted_binned": "05_search.ipynb",
          "get_idxs": "05_search.ipynb",
          "compare_spectrum_parallel": "05_search.ipynb",
+         "get_fragment_index": "05_search.ipynb",
+         "get_frag_tol_dalton": "05_search.ipynb",
+         "score_frags": "05_search.ipynb",
+         "add_to_top_n": "05_search.ipynb",
+         "get_ion_stats": "05_search.ipynb",
+         "compare_spectrum_index_parallel": "05_search.ipynb",
+         "score_frags_bounded": "05_search.ipynb",
+         "compare_spectrum_pruned_parallel": "05_search.ipynb",
+         "get_query_tiles": "05_search.ipynb",
+         "compare_spectrum_tile_parallel": "05_search.ipynb",
          "query_data_to_features": "05_search.ipynb",
+         "get_query_spectra": "05_search.ipynb",
+         "get_local_prec_tol": "05_search.ipynb",
          "get_psms": "05_search.ipynb",
+         "get_search_stats": "05_search.ipynb",
+         "add_search_rates": "05_search.ipynb",
+         "merge_search_stats": "05_search.ipynb",
+         "spectrum_cosine": "05_search.ipynb",
+         "cluster_ms2": "05_search.ipynb",
+         "fan_out_clusters": "05_search.ipynb",
+         "cluster_hdf": "05_search.ipynb",
+         "score_frags_shifted": "05_search.ipynb",
+         "compare_spectrum_open_parallel": "05_search.ipynb",
+         "get_delta_mass_histogram": "05_search.ipynb",
          "frag_delta": "05_search.ipynb",
          "intensity_fraction": "05_search.ipynb",
          "add_column": "05_search.ipynb",
          "remove_column": "05_search.ipynb",
+         "PSMContainer": "05_search.ipynb",
          "get_hits": "05_search.ipynb",
+         "count_hits": "05_search.ipynb",
+         "fill_hits": "05_search.ipynb",
+         "count_ions": "05_search.ipynb",
+         "fill_score_columns": "05_search.ipynb",
          "score": "11_interface.ipynb",
          "LOSS_DICT": "05_search.ipynb",
          "LOSSES": "05_search.ipynb",
          "get_sequences": "05_search.ipynb",
          "get_score_columns": "05_search.ipynb",
          "plot_psms": "05_search.ipynb",
+         "load_database": "05_search.ipynb",
+         "share_database": "05_search.ipynb",
+         "attach_database": "05_search.ipynb",
+         "SHARED_DATABASE_ARRAYS": "05_search.ipynb",
          "store_hdf": "05_search.ipynb",
+         "write_search_stats": "05_search.ipynb",
          "search_db": "05_search.ipynb",
+         "init_query_data_cache": "05_search.ipynb",
+         "get_query_data": "05_search.ipynb",
+         "QUERY_DATA_CACHE": "05_search.ipynb",
+         "QUERY_DATA_CACHE_MAX_MEMORY": "05_search.ipynb",
          "search_fasta_block": "05_search.ipynb",
-         "filter_top_n": "05_search.ipynb",
-         "ion_extractor": "05_search.ipynb",
+         "merge_top_n": "05_search.ipynb",
+         "select_ions": "05_search.ipynb",
+         "TopNAccumulator": "05_search.ipynb",
+         "get_search_fingerprint": "05_search.ipynb",
+         "write_search_checkpoint": "05_search.ipynb",
+         "read_search_checkpoints": "05_search.ipynb",
+         "remove_search_checkpoints": "05_search.ipynb",
          "search_parallel": "05_search.ipynb",
          "filter_score": "06_score.ipynb",
          "filter_precursor": "06_score.ipynb",
@@ -223,6 +295,8 @@ index = {"print_settings": "00_settings.ipynb",
          "create_database": "11_interface.ipynb",
          "import_raw_data": "11_interface.ipynb",
          "feature_finding": "11_interface.ipynb",
+         "cluster_spectra": "11_interface.ipynb",
+         "parallel_search_db": "11_interface.ipynb",
          "search_data": "11_interface.ipynb",
          "recalibrate_data": "11_interface.ipynb",
          "protein_grouping": "11_interface.ipynb",
@@ -260,6 +334,9 @@ index = {"print_settings": "00_settings.ipynb",
          "DYNAMIC_COMPILATION_ENABLED": "12_performance.ipynb",
          "performance_function": "12_performance.ipynb",
          "AlphaPool": "12_performance.ipynb",
+         "create_shared_arrays": "12_performance.ipynb",
+         "attach_shared_arrays": "12_performance.ipynb",
+         "release_shared_arrays": "12_performance.ipynb",
          "mq_ouput_files": "13_export.ipynb",
          "mod_translation": "13_export.ipynb",
          "remove_mods": "13_export.ipynb",
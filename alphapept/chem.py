@@ -5,10 +5,12 @@ from __future__ import annotations
 
 
 __all__ = ['IsotopeDistribution', 'fast_add', 'numba_bin', 'dict_to_dist', 'spec', 'get_average_formula',
-           'mass_to_dist', 'calculate_mass', 'M_PROTON']
+           'mass_to_dist', 'get_averagine_m0', 'get_averagine_table', 'mass_to_dist_table', 'load_averagine_table',
+           'calculate_mass', 'M_PROTON']
 
 # Cell
 
+import os
 import numpy as np
 from numba import int32, float32, float64, njit, types
 from numba.experimental import jitclass
@@ -238,6 +240,166 @@ def mass_to_dist(molecule_mass: float, averagine_aa:Dict, isotopes:Dict)-> (np.n
 
     return masses, ints
 
+# Cell
+@njit
+def get_averagine_m0(molecule_mass:float, averagine_aa:Dict, isotopes:Dict)->float:
+    """Function to calculate the mono-isotopic mass of the averagine formula for a molecule mass without calculating its isotope distribution.
+
+    Args:
+        molecule_mass (float): Input molecule mass.
+        averagine_aa (Dict): Numba-typed dictionary with averagine masses.
+        isotopes (Dict): Numba-typed lookup dict with isotopes.
+
+    Returns:
+        float: The mono-isotopic mass of the averagine formula.
+    """
+    # Same composition as get_average_formula, kept in arrays instead of a Dict
+    n_AA = len(averagine_aa)
+    counts = np.empty(n_AA, dtype=np.int64)
+    AA_masses = np.empty(n_AA, dtype=np.float64)
+
+    averagine_units = molecule_mass / averagine_avg
+    final_mass = 0
+    h_idx = 0
+    for i, AA in enumerate(averagine_aa.keys()):
+        counts[i] = int(np.round(averagine_units * averagine_aa[AA]))
+        AA_masses[i] = isotopes[AA].m0
+        final_mass += counts[i] * AA_masses[i]
+        if AA == "H":
+            h_idx = i
+
+    counts[h_idx] += int(np.round((molecule_mass - final_mass) / isotopes["H"].m0))
+
+    # Follows the float32 additions of IsotopeDistribution.add and IsotopeDistribution.mult, walking the bits like numba_bin
+    m0 = np.float32(0)
+    for i in range(n_AA):
+        n = counts[i]
+        multiples = np.float32(AA_masses[i])
+        m0_AA = np.float32(0)
+        while n != 0:
+            if n % 2 == 1:
+                m0_AA = np.float32(m0_AA + multiples)
+            multiples = np.float32(multiples + multiples)
+            n = int(n / 2)
+        m0 = np.float32(m0 + m0_AA)
+
+    return m0
+
+@njit
+def get_averagine_table(mass_max:int, averagine_aa:Dict, isotopes:Dict)-> (np.ndarray, np.ndarray):
+    """Function to calculate averagine isotope distributions on a grid with a spacing of 1 Da.
+
+    Args:
+        mass_max (int): Maximum molecule mass of the grid.
+        averagine_aa (Dict): Numba-typed dictionary with averagine masses.
+        isotopes (Dict): Numba-typed lookup dict with isotopes.
+
+    Returns:
+        np.ndarray: Molecule masses of the grid.
+        np.ndarray: 2D array with the isotope intensities for each molecule mass, padded with zeros.
+    """
+    table_masses = np.arange(mass_max + 1).astype(np.float64)
+
+    n_isotopes = len(mass_to_dist(mass_max, averagine_aa, isotopes)[1])
+    table_ints = np.zeros((len(table_masses), n_isotopes))
+
+    for i in range(len(table_masses)):
+        masses, ints = mass_to_dist(table_masses[i], averagine_aa, isotopes)
+        n = min(len(ints), n_isotopes)
+        table_ints[i, :n] = ints[:n]
+
+    return table_masses, table_ints
+
+@njit
+def mass_to_dist_table(molecule_mass:float, averagine_aa:Dict, isotopes:Dict, table_masses:np.ndarray, table_ints:np.ndarray)-> (np.ndarray, np.ndarray):
+    """Function to look up the averagine isotope distribution of a molecule mass in a precomputed table.
+
+    The intensities are linearly interpolated between the two neighbouring grid masses. Masses outside the grid are calculated with `mass_to_dist`.
+
+    Args:
+        molecule_mass (float): Input molecule mass.
+        averagine_aa (Dict): Numba-typed dictionary with averagine masses.
+        isotopes (Dict): Numba-typed lookup dict with isotopes.
+        table_masses (np.ndarray): Molecule masses of the grid.
+        table_ints (np.ndarray): Isotope intensities for each molecule mass of the grid.
+
+    Returns:
+        np.ndarray: isotope masses.
+        np.ndarray: isotope intensity.
+    """
+    if (molecule_mass < table_masses[0]) or (molecule_mass >= table_masses[-1]):
+        return mass_to_dist(molecule_mass, averagine_aa, isotopes)
+
+    idx = int(molecule_mass - table_masses[0])
+    weight = molecule_mass - table_masses[idx]
+
+    ints = (1 - weight) * table_ints[idx] + weight * table_ints[idx + 1]
+
+    n_isotopes = len(ints)
+    while (n_isotopes > 1) and (ints[n_isotopes - 1] == 0):
+        n_isotopes -= 1
+    ints = ints[:n_isotopes]
+
+    m0 = get_averagine_m0(molecule_mass, averagine_aa, isotopes)
+    masses = np.array([m0 + i for i in range(n_isotopes)])
+
+    return masses, ints
+
+_AVERAGINE_TABLE_CACHE = {}
+
+def load_averagine_table(averagine_aa:Dict, isotopes:Dict, mass_max:int = 20000, cache_path:str = None)-> (np.ndarray, np.ndarray):
+    """Function to get a table of averagine isotope distributions.
+
+    The table is calculated once and cached on disk and in memory. A cached table is only used if it was calculated with the same averagine model, isotopes and mass range.
+
+    Args:
+        averagine_aa (Dict): Numba-typed dictionary with averagine masses.
+        isotopes (Dict): Numba-typed lookup dict with isotopes.
+        mass_max (int, optional): Maximum molecule mass of the table. Defaults to 20000.
+        cache_path (str, optional): Path of the cache file. Defaults to averagine_table.npz in the alphapept home folder.
+
+    Returns:
+        np.ndarray: Molecule masses of the grid.
+        np.ndarray: 2D array with the isotope intensities for each molecule mass.
+    """
+    params = [mass_max]
+    for AA in sorted(averagine_aa.keys()):
+        params.append(averagine_aa[AA])
+    for AA in sorted(isotopes.keys()):
+        params.append(isotopes[AA].m0)
+        params.extend(isotopes[AA].intensities)
+    params = np.array(params, dtype=np.float64)
+
+    key = params.tobytes()
+    if key in _AVERAGINE_TABLE_CACHE:
+        return _AVERAGINE_TABLE_CACHE[key]
+
+    if cache_path is None:
+        from .paths import AP_PATH
+        cache_path = os.path.join(AP_PATH, 'averagine_table.npz')
+
+    table = None
+    if os.path.isfile(cache_path):
+        try:
+            cached = np.load(cache_path)
+            if np.array_equal(cached['params'], params):
+                table = (cached['table_masses'], cached['table_ints'])
+        except (OSError, ValueError, KeyError):
+            pass
+
+    if table is None:
+        table = get_averagine_table(mass_max, averagine_aa, isotopes)
+        try:
+            tmp_path = f"{cache_path}.{os.getpid()}.npz"
+            np.savez(tmp_path, params=params, table_masses=table[0], table_ints=table[1])
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            pass
+
+    _AVERAGINE_TABLE_CACHE[key] = table
+
+    return table
+
 # Cell
 from .constants import mass_dict
 
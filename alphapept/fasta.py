@@ -7,7 +7,8 @@ __all__ = ['get_missed_cleavages', 'cleave_sequence', 'count_missed_cleavages',
            'get_fragmass', 'get_frag_dict', 'get_spectrum', 'get_spectra', 'read_fasta_file', 'read_fasta_file_entries',
            'check_sequence', 'add_to_pept_dict', 'merge_pept_dicts', 'generate_fasta_list', 'generate_database',
            'generate_spectra', 'block_idx', 'blocks', 'digest_fasta_block', 'generate_database_parallel', 'mass_dict',
-           'pept_dict_from_search', 'save_database', 'read_database']
+           'pept_dict_from_search', 'save_database', 'read_database', 'write_search_index', 'add_search_index',
+           'read_search_index', 'SEARCH_INDEX_VERSION']
 
 # Cell
 from alphapept import constants
@@ -1056,7 +1057,7 @@ def pept_dict_from_search(settings:dict):
 import alphapept.io
 import pandas as pd
 
-def save_database(spectra:list, pept_dict:dict, fasta_dict:dict, database_path:str, **kwargs):
+def save_database(spectra:list, pept_dict:dict, fasta_dict:dict, database_path:str, save_search_index:bool=False, frag_bin_width:float=0.05, **kwargs):
     """
     Function to save a database to the *.hdf format. Write the database into hdf.
 
@@ -1065,6 +1066,8 @@ def save_database(spectra:list, pept_dict:dict, fasta_dict:dict, database_path:s
         pept_dict (dict): peptide dict. See add_to_pept_dict().
         fasta_dict (dict): fasta_dict. See generate_fasta_list().
         database_path (str): Path to database.
+        save_search_index (bool, optional): Flag to build and store a search index. See write_search_index(). Defaults to False.
+        frag_bin_width (float, optional): Width of the fragment bins of the search index in Dalton. Defaults to 0.05.
     """
 
     precmasses, seqs, fragmasses, fragtypes = zip(*spectra)
@@ -1129,6 +1132,15 @@ def save_database(spectra:list, pept_dict:dict, fasta_dict:dict, database_path:s
         group_name="peptides"
     )
 
+    if save_search_index:
+        write_search_index(
+            db_file,
+            to_save["precursors"],
+            to_save["fragmasses"],
+            to_save["indices"],
+            frag_bin_width = frag_bin_width
+        )
+
 # Cell
 import collections
 
@@ -1148,7 +1160,8 @@ def read_database(database_path:str, array_name:str=None)->dict:
                 dataset_name=key
             ) for key in db_file.read() if key not in (
                 "proteins",
-                "peptides"
+                "peptides",
+                "search_index"
             )
         }
         db_data["fasta_dict"] = np.array(
@@ -1175,4 +1188,82 @@ def read_database(database_path:str, array_name:str=None)->dict:
         db_data["seqs"] = db_data["seqs"].astype(str)
     else:
         db_data = db_file.read(dataset_name=array_name)
-    return db_data
\ No newline at end of file
+    return db_data
+
+# Cell
+SEARCH_INDEX_VERSION = 1
+
+def write_search_index(db_file:alphapept.io.HDF_File, precursors:np.ndarray, fragmasses:np.ndarray, indices:np.ndarray, prec_bin_width:float=1.0, frag_bin_width:float=0.05):
+    """
+    Build a search index and write it to the search_index group of a database.
+    Args:
+        db_file (alphapept.io.HDF_File): The database file.
+        precursors (np.ndarray): Sorted precursor masses.
+        fragmasses (np.ndarray): Fragment masses.
+        indices (np.ndarray): Indices to the fragment masses.
+        prec_bin_width (float, optional, default 1.0): Width of the precursor bins in Dalton.
+        frag_bin_width (float, optional, default 0.05): Width of the fragment bins in Dalton.
+    """
+    from .search import get_precursor_bins, get_fragment_index
+
+    prec_bin_indptr = get_precursor_bins(precursors, prec_bin_width)
+    frag_bin_indptr, frag_bin_db_idx, frag_bin_masses = get_fragment_index(fragmasses, indices, frag_bin_width)
+
+    db_file.write("search_index", overwrite=True)
+
+    db_file.write(SEARCH_INDEX_VERSION, group_name="search_index", attr_name="version")
+    db_file.write(prec_bin_width, group_name="search_index", attr_name="prec_bin_width")
+    db_file.write(frag_bin_width, group_name="search_index", attr_name="frag_bin_width")
+
+    db_file.write(prec_bin_indptr, dataset_name="prec_bin_indptr", group_name="search_index")
+    db_file.write(frag_bin_indptr, dataset_name="frag_bin_indptr", group_name="search_index")
+    db_file.write(frag_bin_db_idx, dataset_name="frag_bin_db_idx", group_name="search_index")
+    db_file.write(frag_bin_masses, dataset_name="frag_bin_masses", group_name="search_index")
+
+
+def add_search_index(database_path:str, **kwargs):
+    """
+    Add a search index to an existing database.
+    Args:
+        database_path (str): hdf database file generate by alphapept.
+        **kwargs: Bin widths that are passed to write_search_index.
+    """
+    db_file = alphapept.io.HDF_File(database_path, is_overwritable=True)
+    write_search_index(
+        db_file,
+        db_file.read(dataset_name="precursors"),
+        db_file.read(dataset_name="fragmasses"),
+        db_file.read(dataset_name="indices"),
+        **kwargs
+    )
+
+
+def read_search_index(database_path:str, fragment_index:bool=False)->dict:
+    """
+    Read the search index of a database.
+    Args:
+        database_path (str): hdf database file generate by alphapept.
+        fragment_index (bool, optional): Flag to also read the arrays of the fragment index. These are several times larger than the fragment masses and only needed to search with the fragment index. Defaults to False.
+    Returns:
+        dict: The search index with bin widths and arrays. None if there is no index or it was created with a different SEARCH_INDEX_VERSION.
+    """
+    db_file = alphapept.io.HDF_File(database_path)
+
+    if "search_index" not in db_file.read():
+        return None
+
+    version = db_file.read(group_name="search_index", attr_name="version")
+    if version != SEARCH_INDEX_VERSION:
+        logging.info(f'Search index version {version} does not match {SEARCH_INDEX_VERSION}. Ignoring index.')
+        return None
+
+    search_index = {}
+    for key in ["prec_bin_width", "frag_bin_width"]:
+        search_index[key] = float(db_file.read(group_name="search_index", attr_name=key))
+    search_index["prec_bin_indptr"] = db_file.read(dataset_name="prec_bin_indptr", group_name="search_index")
+
+    if fragment_index:
+        for key in ["frag_bin_indptr", "frag_bin_db_idx", "frag_bin_masses"]:
+            search_index[key] = db_file.read(dataset_name=key, group_name="search_index")
+
+    return search_index
\ No newline at end of file
@@ -1,15 +1,19 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/04_feature_finding.ipynb (unless otherwise specified).
 
 __all__ = ['connect_centroids_unidirection', 'find_centroid_connections', 'convert_connections_to_array',
-           'eliminate_overarching_vertex', 'connect_centroids', 'path_finder', 'find_path_start', 'find_path_length',
+           'eliminate_overarching_vertex', 'get_centroid_connections', 'filter_centroid_connections',
+           'remove_overarching_connections', 'connect_centroids', 'path_finder', 'find_path_start', 'find_path_length',
            'fill_path_matrix', 'get_hills', 'extract_hills', 'fast_minima', 'split', 'split_hills', 'check_large_hills',
-           'filter_hills', 'hill_stats', 'remove_duplicates', 'get_hill_data', 'check_isotope_pattern', 'DELTA_M',
-           'DELTA_S', 'maximum_offset', 'correlate', 'extract_edge', 'edge_correlation', 'get_pre_isotope_patterns',
-           'check_isotope_pattern_directed', 'grow', 'grow_trail', 'get_trails', 'plot_pattern', 'get_minpos',
-           'get_local_minima', 'is_local_minima', 'truncate', 'check_averagine', 'pattern_to_mz', 'cosine_averagine',
-           'int_list_to_array', 'mz_to_mass', 'M_PROTON', 'isolate_isotope_pattern', 'get_isotope_patterns', 'report_',
+           'filter_hills', 'random_index', 'hill_stats', 'remove_duplicates', 'get_hill_data', 'SPLITMIX_GAMMA',
+           'SPLITMIX_MUL_1', 'SPLITMIX_MUL_2', 'check_isotope_pattern', 'DELTA_M', 'DELTA_S', 'maximum_offset',
+           'correlate', 'check_edge', 'count_edges', 'fill_edges', 'edge_correlation', 'find_root', 'label_components',
+           'get_connected_components', 'get_pre_isotope_patterns', 'check_isotope_pattern_directed', 'grow',
+           'grow_trail', 'get_trails', 'plot_pattern', 'get_minpos', 'get_local_minima', 'is_local_minima', 'truncate',
+           'check_averagine', 'pattern_to_mz', 'cosine_averagine', 'int_list_to_array', 'mz_to_mass', 'M_PROTON',
+           'isolate_isotope_pattern', 'isolate_isotope_patterns_parallel', 'get_isotope_patterns', 'report_',
            'feature_finder_report', 'plot_isotope_pattern', 'extract_bruker', 'convert_bruker', 'map_bruker',
-           'find_features', 'replace_infs', 'map_ms2']
+           'find_features_thermo', 'find_features', 'get_rt_windows', 'get_feature_finding_memory', 'slice_query_data',
+           'stitch_features', 'get_hill_centroid_tol', 'find_features_windowed', 'replace_infs', 'map_ms2']
 
 # Cell
 import numpy as np
@@ -155,8 +159,8 @@ def eliminate_overarching_vertex(x:np.ndarray, from_idx:np.ndarray, to_idx:np.nd
     if from_idx[x - 1] == from_idx[x]:
         to_idx[x] = -1
 
-def connect_centroids(rowwise_peaks:np.ndarray, row_borders:np.ndarray, centroids:np.ndarray, max_gap:int, centroid_tol:float)-> (np.ndarray, np.ndarray, float, float):
-    """Function to connect centroids.
+def get_centroid_connections(rowwise_peaks:np.ndarray, row_borders:np.ndarray, centroids:np.ndarray, max_gap:int, centroid_tol:float)-> (np.ndarray, np.ndarray, np.ndarray, float, float):
+    """Function to get all connections of centroids and their scores, including overarching connections.
 
     Args:
         rowwise_peaks (np.ndarray): Indexes for centroids.
@@ -167,6 +171,7 @@ def connect_centroids(rowwise_peaks:np.ndarray, row_borders:np.ndarray, centroid
     Returns:
         np.ndarray: From index.
         np.ndarray: To index.
+        np.ndarray: Score (mass difference in ppm) of each connection.
         float: Median score.
         float: Std deviation of the score.
     """
@@ -195,13 +200,94 @@ def connect_centroids(rowwise_peaks:np.ndarray, row_borders:np.ndarray, centroid
                                  from_idx,
                                  to_idx)
 
+    del from_r, from_c, to_r, to_c
+
+    mz1 = centroids[from_idx]
+    mz2 = centroids[to_idx]
+    scores = 2 * 1e6 * cupy.abs(mz1 - mz2) / (mz1 + mz2)
+
+    return from_idx, to_idx, scores, score_median, score_std
+
+def filter_centroid_connections(from_idx:np.ndarray, to_idx:np.ndarray, scores:np.ndarray, centroid_tol:float)-> (np.ndarray, np.ndarray, np.ndarray, float, float):
+    """Function to restrict connections that were found with a larger centroid tolerance to a smaller centroid tolerance.
+
+    As `connect_centroids_unidirection` only keeps the best connection for each centroid and gap, this gives the same connections as connecting the centroids with the smaller tolerance.
+
+    Args:
+        from_idx (np.ndarray): From index.
+        to_idx (np.ndarray): To index.
+        scores (np.ndarray): Score of each connection.
+        centroid_tol: Centroid tol for matching centroids.
+    Returns:
+        np.ndarray: From index.
+        np.ndarray: To index.
+        np.ndarray: Score of each connection.
+        float: Median score.
+        float: Std deviation of the score.
+    """
+    if alphapept.performance.COMPILATION_MODE == "cuda":
+        import cupy
+        cupy = cupy
+    else:
+        import numpy
+        cupy = numpy
+
+    relavent_idx = cupy.where(scores < centroid_tol)[0]
+    from_idx = cupy.take(from_idx, relavent_idx)
+    to_idx = cupy.take(to_idx, relavent_idx)
+    scores = cupy.take(scores, relavent_idx)
+
+    score_median = cupy.median(scores)
+    score_std = cupy.std(scores)
+
+    return from_idx, to_idx, scores, score_median, score_std
+
+def remove_overarching_connections(from_idx:np.ndarray, to_idx:np.ndarray)-> (np.ndarray, np.ndarray):
+    """Function to only keep the connection with the smallest gap for each centroid.
+
+    Args:
+        from_idx (np.ndarray): From index.
+        to_idx (np.ndarray): To index.
+    Returns:
+        np.ndarray: From index.
+        np.ndarray: To index.
+    """
+    if alphapept.performance.COMPILATION_MODE == "cuda":
+        import cupy
+        cupy = cupy
+    else:
+        import numpy
+        cupy = numpy
+
+    to_idx = to_idx.copy()
     eliminate_overarching_vertex(range(len(from_idx)), from_idx, to_idx)
 
     relavent_idx = cupy.where(to_idx >= 0)
     from_idx = cupy.take(from_idx, relavent_idx)[0]
     to_idx = cupy.take(to_idx, relavent_idx)[0]
 
-    del from_r, from_c, to_r, to_c, relavent_idx
+    del relavent_idx
+    return from_idx, to_idx
+
+def connect_centroids(rowwise_peaks:np.ndarray, row_borders:np.ndarray, centroids:np.ndarray, max_gap:int, centroid_tol:float)-> (np.ndarray, np.ndarray, float, float):
+    """Function to connect centroids.
+
+    Args:
+        rowwise_peaks (np.ndarray): Indexes for centroids.
+        row_borders (np.ndarray): Row borders (for indexing).
+        centroids (np.ndarray): Centroid data.
+        max_gap: Maximum gap.
+        centroid_tol: Centroid tol for matching centroids.
+    Returns:
+        np.ndarray: From index.
+        np.ndarray: To index.
+        float: Median score.
+        float: Std deviation of the score.
+    """
+    from_idx, to_idx, scores, score_median, score_std = get_centroid_connections(rowwise_peaks, row_borders, centroids, max_gap, centroid_tol)
+
+    from_idx, to_idx = remove_overarching_connections(from_idx, to_idx)
+
     return from_idx, to_idx, score_median, score_std
 
 # Cell
@@ -323,13 +409,16 @@ def get_hills(centroids:np.ndarray, from_idx:np.ndarray, to_idx:np.ndarray, hill
     return hill_ptrs, hill_data, path_node_cnt
 
 
-def extract_hills(query_data:dict, max_gap:int, centroid_tol:float)-> (np.ndarray, np.ndarray, int, float, float):
-    """[summary]
+def extract_hills(query_data:dict, max_gap:int, centroid_tol:float, connections:tuple = None, return_connections:bool = False)-> (np.ndarray, np.ndarray, int, float, float):
+    """Function to extract hills from the MS1 centroids.
 
     Args:
         query_data (dict): Data structure containing the query data.
         max_gap (int): Maximum gap when connecting centroids.
         centroid_tol (float): Centroid tolerance.
+        connections (tuple, optional): Tuple (from_idx, to_idx, scores) with the connections of a previous call with the same max_gap and a centroid tolerance that is at least as large.
+            If given, these connections are filtered instead of connecting the centroids again. Defaults to None.
+        return_connections (bool, optional): Flag to additionally return the connections to be reused. Defaults to False.
 
     Returns:
         hill_ptrs (np.ndarray): Array containing the bounds to the hill_data.
@@ -337,6 +426,7 @@ def extract_hills(query_data:dict, max_gap:int, centroid_tol:float)-> (np.ndarra
         path_node_cnt (int): Number of elements in this path.
         score_median (float): Median score.
         score_std (float): Std deviation of the score.
+        connections (tuple): Only if return_connections is set. Tuple (from_idx, to_idx, scores) with the connections.
     """
 
     if alphapept.performance.COMPILATION_MODE == "cuda":
@@ -352,8 +442,16 @@ def extract_hills(query_data:dict, max_gap:int, centroid_tol:float)-> (np.ndarra
     rowwise_peaks = indices[1:] - indices[:-1]
     row_borders = indices[1:]
 
-    from_idx, to_idx, score_median, score_std = connect_centroids(rowwise_peaks, row_borders, mass_data, max_gap, centroid_tol)
+    if connections is None:
+        from_idx, to_idx, scores, score_median, score_std = get_centroid_connections(rowwise_peaks, row_borders, mass_data, max_gap, centroid_tol)
+    else:
+        from_idx, to_idx, scores = [cupy.array(_) for _ in connections]
+        from_idx, to_idx, scores, score_median, score_std = filter_centroid_connections(from_idx, to_idx, scores, centroid_tol)
+
+    if return_connections:
+        connections = (from_idx, to_idx, scores)
 
+    from_idx, to_idx = remove_overarching_connections(from_idx, to_idx)
 
     hill_ptrs, hill_data, path_node_cnt = get_hills(mass_data, from_idx, to_idx)
 
@@ -368,6 +466,12 @@ def extract_hills(query_data:dict, max_gap:int, centroid_tol:float)-> (np.ndarra
         score_median = score_median.get()
         score_std = score_std.get()
 
+        if return_connections:
+            connections = tuple(_.get() for _ in connections)
+
+    if return_connections:
+        return hill_ptrs, hill_data, path_node_cnt, score_median, score_std, connections
+
     return hill_ptrs, hill_data, path_node_cnt, score_median, score_std
 
 # Cell
@@ -566,9 +670,34 @@ def filter_hills(hill_data:np.ndarray, hill_ptrs:np.ndarray, int_data:np.ndarray
     return hill_data_, hill_ptrs_
 
 # Cell
+SPLITMIX_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+SPLITMIX_MUL_1 = np.uint64(0xBF58476D1CE4E5B9)
+SPLITMIX_MUL_2 = np.uint64(0x94D049BB133111EB)
+
+@alphapept.performance.compile_function(compilation_mode="numba")
+def random_index(key:int, counter:int, n:int)->int:
+    """Counter-based random number generator (splitmix64) to draw a random index.
+
+    The result only depends on the key and the counter, so it does not depend on a global random state or on the order in which threads are scheduled.
+
+    Args:
+        key (int): Key of the random stream, e.g. the index of a hill.
+        counter (int): Position in the random stream.
+        n (int): Upper bound (exclusive) of the index.
+
+    Returns:
+        int: Random index between 0 and n.
+    """
+    z = (np.uint64(key) << np.uint64(32)) + np.uint64(counter) + np.uint64(1)
+    z = z * SPLITMIX_GAMMA
+    z = (z ^ (z >> np.uint64(30))) * SPLITMIX_MUL_1
+    z = (z ^ (z >> np.uint64(27))) * SPLITMIX_MUL_2
+    z = z ^ (z >> np.uint64(31))
+
+    return int(z % np.uint64(n))
 
 @alphapept.performance.performance_function(compilation_mode="numba-multithread")
-def hill_stats(idx:np.ndarray, hill_range:np.ndarray, hill_ptrs:np.ndarray, hill_data:np.ndarray, int_data:np.ndarray, mass_data:np.ndarray, rt_:np.ndarray, rt_idx:np.ndarray, stats:np.ndarray, hill_nboot_max:int, hill_nboot:int):
+def hill_stats(idx:np.ndarray, hill_range:np.ndarray, hill_ptrs:np.ndarray, hill_data:np.ndarray, int_data:np.ndarray, mass_data:np.ndarray, rt_:np.ndarray, rt_idx:np.ndarray, stats:np.ndarray, hill_nboot_max:int, hill_nboot:int, analytic:bool):
     """Function to calculate hill stats.
 
     Args:
@@ -583,9 +712,8 @@ def hill_stats(idx:np.ndarray, hill_range:np.ndarray, hill_ptrs:np.ndarray, hill
         stats (np.ndarray): Stats array that contains summary statistics of hills.
         hill_nboot_max (int): Maximum number of bootstrap comparisons.
         hill_nboot (int): Number of bootstrap comparisons
+        analytic (bool): Use the analytic estimate of the mass precision instead of the bootstrap.
     """
-    np.random.seed(42)
-
     start = hill_ptrs[idx]
     end = hill_ptrs[idx + 1]
 
@@ -605,21 +733,32 @@ def hill_stats(idx:np.ndarray, hill_range:np.ndarray, hill_ptrs:np.ndarray, hill
     else:
         bootsize = len(idx_)
 
-    averages = np.zeros(hill_nboot)
-    average = 0
-
-    for i in range(hill_nboot):
-        boot = np.random.choice(len(int_), bootsize, replace=True)
-        boot_mz = np.sum((mz_[boot] * int_[boot])) / np.sum(int_[boot])
-        averages[i] = boot_mz
-        average += boot_mz
-
-    average_mz = average/hill_nboot
-
-    delta = 0
-    for i in range(hill_nboot):
-        delta += (average_mz - averages[i]) ** 2 #maybe easier?
-    delta_m = np.sqrt(delta / (hill_nboot - 1))
+    if analytic:
+        # Linearized variance of the intensity-weighted mean for a resample of size bootsize
+        average_mz = np.sum(mz_ * int_) / int_sum
+        residuals = int_ * (mz_ - average_mz)
+        delta_m = np.sqrt(np.sum(residuals ** 2) / int_sum ** 2 * len(idx_) / bootsize)
+    else:
+        averages = np.zeros(hill_nboot)
+        average = 0
+
+        for i in range(hill_nboot):
+            boot_int = 0.0
+            boot_mz = 0.0
+            for j in range(bootsize):
+                k = random_index(idx, i * bootsize + j, len(int_))
+                boot_int += int_[k]
+                boot_mz += mz_[k] * int_[k]
+            boot_mz = boot_mz / boot_int
+            averages[i] = boot_mz
+            average += boot_mz
+
+        average_mz = average/hill_nboot
+
+        delta = 0
+        for i in range(hill_nboot):
+            delta += (average_mz - averages[i]) ** 2 #maybe easier?
+        delta_m = np.sqrt(delta / (hill_nboot - 1))
 
     stats[idx,0] = average_mz
     stats[idx,1] = delta_m
@@ -661,7 +800,7 @@ def remove_duplicates(stats:np.ndarray, hill_data:np.ndarray, hill_ptrs:np.ndarr
 
     return hill_data_, hill_ptrs_, stats[~dups]
 
-def get_hill_data(query_data:dict, hill_ptrs:np.ndarray, hill_data:np.ndarray, hill_nboot_max:int = 300, hill_nboot:int = 150) -> (np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray):
+def get_hill_data(query_data:dict, hill_ptrs:np.ndarray, hill_data:np.ndarray, hill_nboot_max:int = 300, hill_nboot:int = 150, hill_mz_precision:str = 'bootstrap') -> (np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray):
     """Wrapper function to get the hill data.
 
     Args:
@@ -670,6 +809,10 @@ def get_hill_data(query_data:dict, hill_ptrs:np.ndarray, hill_data:np.ndarray, h
         hill_data (np.ndarray): Array containing the indices to hills.
         hill_nboot_max (int): Maximum number of bootstrap comparisons.
         hill_nboot (int): Number of bootstrap comparisons
+        hill_mz_precision (str): Estimator for the mass precision of a hill, either 'bootstrap' or 'analytic'. Defaults to 'bootstrap'.
+
+    Raises:
+        NotImplementedError: Error if the estimator is not understood.
 
     Returns:
         np.ndarray: Hill stats.
@@ -679,6 +822,9 @@ def get_hill_data(query_data:dict, hill_ptrs:np.ndarray, hill_data:np.ndarray, h
         np.ndarray: Hill data.
         np.ndarray: Hill points.
     """
+    if hill_mz_precision not in ['bootstrap', 'analytic']:
+        raise NotImplementedError('Hill mz precision estimator {} not understood.'.format(hill_mz_precision))
+
     indices_ = np.array(query_data['indices_ms1'])
     rt_ = np.array(query_data['rt_list_ms1'])
     mass_data = np.array(query_data['mass_list_ms1'])
@@ -686,7 +832,7 @@ def get_hill_data(query_data:dict, hill_ptrs:np.ndarray, hill_data:np.ndarray, h
     int_data = np.array(query_data['int_list_ms1'])
 
     stats = np.zeros((len(hill_ptrs)-1, 6)) #mz, delta, rt_min, rt_max, sum_max
-    hill_stats(range(len(hill_ptrs)-1), np.arange(len(hill_ptrs)-1), hill_ptrs, hill_data, int_data, mass_data, rt_, scan_idx, stats, hill_nboot_max, hill_nboot)
+    hill_stats(range(len(hill_ptrs)-1), np.arange(len(hill_ptrs)-1), hill_ptrs, hill_data, int_data, mass_data, rt_, scan_idx, stats, hill_nboot_max, hill_nboot, hill_mz_precision == 'analytic')
 
     # sort the stats
     sortindex = np.argsort(stats[:,4]) #Sorted by rt_min
@@ -769,37 +915,73 @@ def correlate(scans_:np.ndarray, scans_2:np.ndarray, int_:np.ndarray, int_2:np.n
 
 # Cell
 @alphapept.performance.compile_function(compilation_mode="numba")
-def extract_edge(stats:np.ndarray, idxs_upper:np.ndarray, runner:int, max_index:int, maximum_offset:float,  iso_charge_min:int = 1, iso_charge_max:int = 6, iso_mass_range:int=5)->list:
-    """Extract edges.
+def check_edge(stats:np.ndarray, runner:int, j:int, maximum_offset:float, iso_charge_min:int, iso_charge_max:int, iso_mass_range:float)->bool:
+    """Checks if two hills could belong to the same isotope pattern.
 
     Args:
         stats (np.ndarray): Stats array that contains summary statistics of hills.
-        idxs_upper (np.ndarray): Upper index for comparing.
-        runner (int): Index.
-        max_index (int): Unused.
+        runner (int): Index of the first hill.
+        j (int): Index of the second hill.
         maximum_offset (float): Maximum offset when comparing edges.
-        iso_charge_min (int, optional): Minimum isotope charge. Defaults to 1.
-        iso_charge_max (int, optional): Maximum isotope charge. Defaults to 6.
-        iso_mass_range (float, optional): Mass search range. Defaults to 5.
+        iso_charge_min (int): Minimum isotope charge.
+        iso_charge_max (int): Maximum isotope charge.
+        iso_mass_range (float): Mass search range.
 
     Returns:
-        list: List of edges.
+        bool: True if the hills are connected.
     """
-    edges = []
-
     mass1 = stats[runner, 0]
-    delta_mass1 = stats[runner, 1]
+    mass2 = stats[j, 0]
+    if np.abs(mass2 - mass1) <= maximum_offset:
+        delta_mass1 = stats[runner, 1]
+        delta_mass2 = stats[j, 1]
+        for charge in range(iso_charge_min, iso_charge_max + 1):
+            if check_isotope_pattern(mass1, mass2, delta_mass1, delta_mass2, charge, iso_mass_range):
+                return True
+
+    return False
+
+@alphapept.performance.performance_function(compilation_mode="numba-multithread")
+def count_edges(runner:np.ndarray, stats:np.ndarray, idxs_upper:np.ndarray, maximum_offset:float, iso_charge_min:int, iso_charge_max:int, iso_mass_range:float, edge_counts:np.ndarray):
+    """Counts the edges of each hill to hills with a higher index.
 
+    Args:
+        runner (np.ndarray): Input index. Note that we are using the performance function so this is a range.
+        stats (np.ndarray): Stats array that contains summary statistics of hills.
+        idxs_upper (np.ndarray): Upper index for comparing.
+        maximum_offset (float): Maximum offset when comparing edges.
+        iso_charge_min (int): Minimum isotope charge.
+        iso_charge_max (int): Maximum isotope charge.
+        iso_mass_range (float): Mass search range.
+        edge_counts (np.ndarray): Reporting array with the number of edges per hill.
+    """
+    n_edges = 0
     for j in range(runner+1, idxs_upper[runner]):
-        mass2 = stats[j, 0]
-        if np.abs(mass2 - mass1) <= maximum_offset:
-            delta_mass2 = stats[j, 1]
-            for charge in range(iso_charge_min, iso_charge_max + 1):
-                if check_isotope_pattern(mass1, mass2, delta_mass1, delta_mass2, charge, iso_mass_range):
-                    edges.append((runner, j))
-                    break
+        if check_edge(stats, runner, j, maximum_offset, iso_charge_min, iso_charge_max, iso_mass_range):
+            n_edges += 1
+    edge_counts[runner] = n_edges
 
-    return edges
+@alphapept.performance.performance_function(compilation_mode="numba-multithread")
+def fill_edges(runner:np.ndarray, stats:np.ndarray, idxs_upper:np.ndarray, maximum_offset:float, iso_charge_min:int, iso_charge_max:int, iso_mass_range:float, edge_ptrs:np.ndarray, pre_edges:np.ndarray):
+    """Writes the edges of each hill to hills with a higher index.
+
+    Args:
+        runner (np.ndarray): Input index. Note that we are using the performance function so this is a range.
+        stats (np.ndarray): Stats array that contains summary statistics of hills.
+        idxs_upper (np.ndarray): Upper index for comparing.
+        maximum_offset (float): Maximum offset when comparing edges.
+        iso_charge_min (int): Minimum isotope charge.
+        iso_charge_max (int): Maximum isotope charge.
+        iso_mass_range (float): Mass search range.
+        edge_ptrs (np.ndarray): Offset of the edges of each hill in pre_edges.
+        pre_edges (np.ndarray): Reporting array of shape (n_edges, 2).
+    """
+    position = edge_ptrs[runner]
+    for j in range(runner+1, idxs_upper[runner]):
+        if check_edge(stats, runner, j, maximum_offset, iso_charge_min, iso_charge_max, iso_mass_range):
+            pre_edges[position, 0] = runner
+            pre_edges[position, 1] = j
+            position += 1
 
 @alphapept.performance.performance_function(compilation_mode="numba-multithread")
 def edge_correlation(idx:np.ndarray, to_keep:np.ndarray, sortindex_:np.ndarray, pre_edges:np.ndarray, hill_ptrs:np.ndarray, hill_data:np.ndarray, int_data:np.ndarray, scan_idx:np.ndarray, cc_cutoff:float):
@@ -836,9 +1018,88 @@ def edge_correlation(idx:np.ndarray, to_keep:np.ndarray, sortindex_:np.ndarray,
         to_keep[idx] = 1
 
 # Cell
-import networkx as nx
+@alphapept.performance.compile_function(compilation_mode="numba")
+def find_root(parents:np.ndarray, x:int)->int:
+    """Finds the root of a node in a disjoint-set forest and halves the path on the way.
+
+    Args:
+        parents (np.ndarray): Array with the parent of each node.
+        x (int): Node.
+
+    Returns:
+        int: Root of the node.
+    """
+    while parents[x] != x:
+        parents[x] = parents[parents[x]]
+        x = parents[x]
+    return x
+
+@alphapept.performance.compile_function(compilation_mode="numba")
+def label_components(edges:np.ndarray, n_nodes:int)-> (np.ndarray, np.ndarray):
+    """Labels the connected components of a graph with a union-find.
+
+    Args:
+        edges (np.ndarray): Array of shape (n, 2) with the edges of the graph.
+        n_nodes (int): Number of nodes.
+
+    Returns:
+        np.ndarray: Root of the component for each node, -1 for nodes without edges.
+        np.ndarray: First edge of the component for each root.
+    """
+    parents = np.arange(n_nodes)
+    first_edge = np.full(n_nodes, len(edges))
+
+    for i in range(len(edges)):
+        root_a = find_root(parents, edges[i, 0])
+        root_b = find_root(parents, edges[i, 1])
+        if root_a != root_b:
+            if root_a < root_b:
+                parents[root_b] = root_a
+                first_edge[root_a] = min(first_edge[root_a], first_edge[root_b])
+            else:
+                parents[root_a] = root_b
+                first_edge[root_b] = min(first_edge[root_a], first_edge[root_b])
+            root_a = min(root_a, root_b)
+        first_edge[root_a] = min(first_edge[root_a], i)
+
+    roots = np.full(n_nodes, -1)
+    for i in range(len(edges)):
+        for j in range(2):
+            node = edges[i, j]
+            roots[node] = find_root(parents, node)
+
+    return roots, first_edge
+
+def get_connected_components(edges:np.ndarray, n_nodes:int)-> (np.ndarray, np.ndarray):
+    """Extracts the connected components of a graph.
+
+    Components are sorted by size (largest first) and by the first edge that they contain, nodes within a component are sorted ascending.
+
+    Args:
+        edges (np.ndarray): Array of shape (n, 2) with the edges of the graph.
+        n_nodes (int): Number of nodes.
+
+    Returns:
+        np.ndarray: Nodes of all components.
+        np.ndarray: Index to the components in the nodes array.
+    """
+    roots, first_edge = label_components(edges, n_nodes)
+
+    nodes = np.nonzero(roots >= 0)[0]
+    labels, inverse, counts = np.unique(roots[nodes], return_inverse=True, return_counts=True)
+
+    order = np.lexsort((first_edge[labels], -counts))
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+
+    components = nodes[np.lexsort((nodes, rank[inverse]))]
+
+    component_idx = np.zeros(len(labels) + 1, dtype=np.int64)
+    component_idx[1:] = np.cumsum(counts[order])
 
-def get_pre_isotope_patterns(stats:np.ndarray, idxs_upper:np.ndarray, sortindex_:np.ndarray, hill_ptrs:np.ndarray, hill_data:np.ndarray, int_data:np.ndarray, scan_idx:np.ndarray, maximum_offset:float, iso_charge_min:int=1, iso_charge_max:int=6, iso_mass_range:float=5, cc_cutoff:float=0.6)->list:
+    return components, component_idx
+
+def get_pre_isotope_patterns(stats:np.ndarray, idxs_upper:np.ndarray, sortindex_:np.ndarray, hill_ptrs:np.ndarray, hill_data:np.ndarray, int_data:np.ndarray, scan_idx:np.ndarray, maximum_offset:float, iso_charge_min:int=1, iso_charge_max:int=6, iso_mass_range:float=5, cc_cutoff:float=0.6)-> (np.ndarray, np.ndarray):
     """Function to extract pre isotope patterns.
 
     Args:
@@ -856,29 +1117,27 @@ def get_pre_isotope_patterns(stats:np.ndarray, idxs_upper:np.ndarray, sortindex_
         cc_cutoff (float, optional): Correlation cutoff. Defaults to 0.6.
 
     Returns:
-        list: List of pre isotope patterns.
+        np.ndarray: Pre isotope patterns (indices to hills).
+        np.ndarray: Index to the pre isotope patterns.
     """
-    pre_edges = []
+    # Step 1: count the edges per hill and write them to a preallocated array
+    edge_counts = np.zeros(len(stats), dtype=np.int64)
+    count_edges(range(len(stats)), stats, idxs_upper, maximum_offset, iso_charge_min, iso_charge_max, iso_mass_range, edge_counts)
+
+    edge_ptrs = np.zeros(len(stats) + 1, dtype=np.int64)
+    edge_ptrs[1:] = np.cumsum(edge_counts)
 
-    # Step 1
-    for runner in range(len(stats)):
-        pre_edges.extend(extract_edge(stats, idxs_upper, runner, idxs_upper[runner], maximum_offset, iso_charge_min, iso_charge_max, iso_mass_range))
+    pre_edges = np.zeros((edge_ptrs[-1], 2), dtype=np.int64)
+    fill_edges(range(len(stats)), stats, idxs_upper, maximum_offset, iso_charge_min, iso_charge_max, iso_mass_range, edge_ptrs, pre_edges)
 
+    # Step 2: keep the edges of correlating hills
     to_keep = np.zeros(len(pre_edges), dtype='int')
-    pre_edges = np.array(pre_edges)
     edge_correlation(range(len(to_keep)), to_keep, sortindex_, pre_edges, hill_ptrs, hill_data, int_data, scan_idx, cc_cutoff)
     edges = pre_edges[to_keep.nonzero()]
 
-    G2 = nx.Graph()
-    for i in range(len(edges)):
-        G2.add_edge(edges[i][0], edges[i][1])
+    pre_isotope_patterns, pre_iso_idx = get_connected_components(edges, len(stats))
 
-    pre_isotope_patterns = [
-        sorted(list(c))
-        for c in sorted(nx.connected_components(G2), key=len, reverse=True)
-    ]
-
-    return pre_isotope_patterns
+    return pre_isotope_patterns, pre_iso_idx
 
 # Cell
 from numba.typed import List
@@ -1174,12 +1433,12 @@ def truncate(array:np.ndarray, intensity_profile:np.ndarray, seedpos:int, iso_sp
     return array
 
 # Cell
-from .chem import mass_to_dist
+from .chem import mass_to_dist_table
 from .constants import averagine_aa, isotopes, Isotope
 from numba.typed import Dict
 
 @alphapept.performance.compile_function(compilation_mode="numba")
-def check_averagine(stats:np.ndarray, pattern:np.ndarray, charge:int, averagine_aa:Dict, isotopes:Dict)->float:
+def check_averagine(stats:np.ndarray, pattern:np.ndarray, charge:int, averagine_aa:Dict, isotopes:Dict, table_masses:np.ndarray, table_ints:np.ndarray)->float:
     """Function to compare a pattern to an averagine model.
 
     Args:
@@ -1188,6 +1447,8 @@ def check_averagine(stats:np.ndarray, pattern:np.ndarray, charge:int, averagine_
         charge (int): Charge.
         averagine_aa (Dict): Dict containing averagine masses.
         isotopes (Dict): Dict containing isotopes.
+        table_masses (np.ndarray): Molecule masses of the averagine table.
+        table_ints (np.ndarray): Isotope intensities of the averagine table.
 
     Returns:
         float: Averagine correlation.
@@ -1197,7 +1458,7 @@ def check_averagine(stats:np.ndarray, pattern:np.ndarray, charge:int, averagine_
     spec_one = np.floor(masses).astype(np.int64)
     int_one = intensity
 
-    spec_two, int_two = mass_to_dist(np.min(masses), averagine_aa, isotopes) # maybe change to no rounded version
+    spec_two, int_two = mass_to_dist_table(np.min(masses), averagine_aa, isotopes, table_masses, table_ints) # maybe change to no rounded version
 
     spec_two = np.floor(spec_two).astype(np.int64)
 
@@ -1309,7 +1570,7 @@ def mz_to_mass(mz:float, charge:int)->float:
 
 # Cell
 @alphapept.performance.compile_function(compilation_mode="numba")
-def isolate_isotope_pattern(pre_pattern:np.ndarray, hill_ptrs:np.ndarray, hill_data:np.ndarray, int_data:np.ndarray, scan_idx:np.ndarray, stats:np.ndarray, sortindex_:np.ndarray, iso_mass_range:float, charge_range:List, averagine_aa:Dict, isotopes:Dict, iso_n_seeds:int, cc_cutoff:float, iso_split_level:float)->(np.ndarray, int):
+def isolate_isotope_pattern(pre_pattern:np.ndarray, hill_ptrs:np.ndarray, hill_data:np.ndarray, int_data:np.ndarray, scan_idx:np.ndarray, stats:np.ndarray, sortindex_:np.ndarray, iso_mass_range:float, charge_range:List, averagine_aa:Dict, isotopes:Dict, table_masses:np.ndarray, table_ints:np.ndarray, iso_n_seeds:int, cc_cutoff:float, iso_split_level:float)->(np.ndarray, int):
     """Isolate isotope patterns.
 
     Args:
@@ -1324,6 +1585,8 @@ def isolate_isotope_pattern(pre_pattern:np.ndarray, hill_ptrs:np.ndarray, hill_d
         charge_range (List): Charge range.
         averagine_aa (Dict): Dict containing averagine masses.
         isotopes (Dict): Dict containing isotopes.
+        table_masses (np.ndarray): Molecule masses of the averagine table.
+        table_ints (np.ndarray): Isotope intensities of the averagine table.
         iso_n_seeds (int): Number of seeds.
         cc_cutoff (float): Cutoff value for what is considered correlating.
         iso_split_level (float): Split level when isotopes are split.
@@ -1369,7 +1632,7 @@ def isolate_isotope_pattern(pre_pattern:np.ndarray, hill_ptrs:np.ndarray, hill_d
 
                 if (len(arr) > longest_trace) | ((len(arr) == longest_trace) & (intensity_profile.sum() > champion_intensity)):
                     # Averagine check
-                    cc = check_averagine(stats, arr, charge_range[index], averagine_aa, isotopes)
+                    cc = check_averagine(stats, arr, charge_range[index], averagine_aa, isotopes, table_masses, table_ints)
                     if cc > 0.6:
                         # Update the champion
                         champion_trace = arr
@@ -1383,12 +1646,72 @@ def isolate_isotope_pattern(pre_pattern:np.ndarray, hill_ptrs:np.ndarray, hill_d
 
 from numba.typed import List
 from typing import Callable, Union
+from .chem import load_averagine_table
 
-def get_isotope_patterns(pre_isotope_patterns:list, hill_ptrs:np.ndarray, hill_data:np.ndarray, int_data:np.ndarray, scan_idx:np.ndarray, stats:np.ndarray, sortindex_:np.ndarray,  averagine_aa:Dict, isotopes:Dict, iso_charge_min:int = 1, iso_charge_max:int = 6, iso_mass_range:float = 5, iso_n_seeds:int = 100, cc_cutoff:float=0.6, iso_split_level:float = 1.3, callback:Union[Callable, None]=None) -> (np.ndarray, np.ndarray, np.ndarray):
-    """Wrapper function to iterate over pre_isotope_patterns.
+@alphapept.performance.performance_function(compilation_mode="numba-multithread")
+def isolate_isotope_patterns_parallel(idx:np.ndarray, pre_isotope_patterns:np.ndarray, pre_iso_idx:np.ndarray, hill_ptrs:np.ndarray, hill_data:np.ndarray, int_data:np.ndarray, scan_idx:np.ndarray, stats:np.ndarray, sortindex_:np.ndarray, iso_mass_range:float, charge_range:List, averagine_aa:Dict, isotopes:Dict, table_masses:np.ndarray, table_ints:np.ndarray, iso_n_seeds:int, cc_cutoff:float, iso_split_level:float, out_patterns:np.ndarray, out_lengths:np.ndarray, out_charges:np.ndarray):
+    """Repeatedly isolates isotope patterns from a pre isotope pattern until no more pattern can be extracted.
+
+    As the isotope patterns of a pre isotope pattern are disjoint subsets of it, the results are written to the range of the pre isotope pattern in the reporting arrays.
 
     Args:
-        pre_isotope_patterns (list): List of pre-isotope patterns.
+        idx (np.ndarray): Input index. Note that we are using the performance function so this is a range.
+        pre_isotope_patterns (np.ndarray): Pre isotope patterns (indices to hills).
+        pre_iso_idx (np.ndarray): Index to the pre isotope patterns.
+        hill_ptrs (np.ndarray): Array containing the bounds to the hill_data.
+        hill_data (np.ndarray): Array containing the indices to hills.
+        int_data (np.ndarray): Array containing the intensity to each centroid.
+        scan_idx (np.ndarray): Array containing the scan index for a centroid.
+        stats (np.ndarray): Stats array that contains summary statistics of hills.
+        sortindex_ (np.ndarray): Sortindex to access the hills from stats.
+        iso_mass_range (float): Mass range for checking isotope patterns.
+        charge_range (List): Charge range.
+        averagine_aa (Dict): Dict containing averagine masses.
+        isotopes (Dict): Dict containing isotopes.
+        table_masses (np.ndarray): Molecule masses of the averagine table.
+        table_ints (np.ndarray): Isotope intensities of the averagine table.
+        iso_n_seeds (int): Number of seeds.
+        cc_cutoff (float): Cutoff value for what is considered correlating.
+        iso_split_level (float): Split level when isotopes are split.
+        out_patterns (np.ndarray): Reporting array with the hills of the isotope patterns, -1 for unused positions.
+        out_lengths (np.ndarray): Reporting array with the length of each isotope pattern, 0 for unused positions.
+        out_charges (np.ndarray): Reporting array with the charge of each isotope pattern.
+    """
+    start = pre_iso_idx[idx]
+    pre_pattern = pre_isotope_patterns[start:pre_iso_idx[idx+1]]
+
+    position = start
+    n_patterns = 0
+
+    while len(pre_pattern) > 1:
+        isotope_pattern, isotope_charge = isolate_isotope_pattern(pre_pattern, hill_ptrs, hill_data, int_data, scan_idx, stats, sortindex_, iso_mass_range, charge_range, averagine_aa, isotopes, table_masses, table_ints, iso_n_seeds, cc_cutoff, iso_split_level)
+        if isotope_pattern is None:
+            break
+
+        length = len(isotope_pattern)
+        if length <= 1:
+            break
+
+        out_patterns[position:position+length] = isotope_pattern
+        out_lengths[start+n_patterns] = length
+        out_charges[start+n_patterns] = isotope_charge
+        position += length
+        n_patterns += 1
+
+        keep = np.ones(len(pre_pattern), dtype=np.bool_)
+        for i in range(len(pre_pattern)):
+            for j in range(length):
+                if pre_pattern[i] == isotope_pattern[j]:
+                    keep[i] = False
+                    break
+        pre_pattern = pre_pattern[keep]
+
+def get_isotope_patterns(pre_isotope_patterns:np.ndarray, pre_iso_idx:np.ndarray, hill_ptrs:np.ndarray, hill_data:np.ndarray, int_data:np.ndarray, scan_idx:np.ndarray, stats:np.ndarray, sortindex_:np.ndarray,  averagine_aa:Dict, isotopes:Dict, iso_charge_min:int = 1, iso_charge_max:int = 6, iso_mass_range:float = 5, iso_n_seeds:int = 100, cc_cutoff:float=0.6, iso_split_level:float = 1.3, callback:Union[Callable, None]=None) -> (np.ndarray, np.ndarray, np.ndarray):
+    """Wrapper function to extract isotope patterns from all pre_isotope_patterns in parallel.
+
+    Args:
+        pre_isotope_patterns (np.ndarray): Pre isotope patterns (indices to hills).
+        pre_iso_idx (np.ndarray): Index to the pre isotope patterns.
         hill_ptrs (np.ndarray): Array containing the bounds to the hill_data.
         hill_data (np.ndarray): Array containing the indices to hills.
         int_data (np.ndarray): Array containing the intensity to each centroid.
@@ -1403,63 +1726,37 @@ def get_isotope_patterns(pre_isotope_patterns:list, hill_ptrs:np.ndarray, hill_d
         iso_n_seeds (int, optional): Number of isotope seeds. Defaults to 100.
         cc_cutoff (float, optional): Cuttoff for correlation.. Defaults to 0.6.
         iso_split_level (float, optional): Isotope split level.. Defaults to 1.3.
-        callback (Union[Callable, None], optional): Callback function for progress. Defaults to None.
+        callback (Union[Callable, None], optional): Callback function that is called when all patterns are processed. Defaults to None.
     Returns:
-        list: List of isotope patterns.
+        np.ndarray: Isotope patterns (indices to hills).
         np.ndarray: Iso idx.
         np.ndarray: Array containing isotope charges.
     """
 
-    isotope_patterns = []
-    isotope_charges = []
-
     charge_range = List()
 
     for i in range(iso_charge_min, iso_charge_max + 1):
         charge_range.append(i)
 
-    isotope_patterns = []
-    isotope_charges = []
-
-    for idx, pre_pattern in enumerate(pre_isotope_patterns):
-        extract = True
-        while extract:
-            isotope_pattern, isotope_charge = isolate_isotope_pattern(np.array(pre_pattern), hill_ptrs, hill_data, int_data, scan_idx, stats, sortindex_, iso_mass_range, charge_range, averagine_aa, isotopes, iso_n_seeds, cc_cutoff, iso_split_level)
-            if isotope_pattern is None:
-                length = 0
-            else:
-                length = len(isotope_pattern)
-
-            if length > 1:
-                isotope_charges.append(isotope_charge)
-                isotope_patterns.append(isotope_pattern)
-
-                pre_pattern = [_ for _ in pre_pattern if _ not in isotope_pattern]
-
-                if len(pre_pattern) <= 1:
-                    extract = False
-            else:
-                extract = False
-
+    table_masses, table_ints = load_averagine_table(averagine_aa, isotopes)
 
-        if callback:
-            callback((idx+1)/len(pre_isotope_patterns))
+    out_patterns = np.full(len(pre_isotope_patterns), -1, dtype=np.int64)
+    out_lengths = np.zeros(len(pre_isotope_patterns), dtype=np.int64)
+    out_charges = np.zeros(len(pre_isotope_patterns), dtype=np.int64)
 
+    isolate_isotope_patterns_parallel(range(len(pre_iso_idx) - 1), pre_isotope_patterns, pre_iso_idx, hill_ptrs, hill_data, int_data, scan_idx, stats, sortindex_, iso_mass_range, charge_range, averagine_aa, isotopes, table_masses, table_ints, iso_n_seeds, cc_cutoff, iso_split_level, out_patterns, out_lengths, out_charges)
 
-    iso_patterns = np.zeros(sum([len(_) for _ in isotope_patterns]), dtype=np.int64)
+    if callback:
+        callback(1)
 
-    iso_idx = np.zeros(len(isotope_patterns)+1, dtype='int')
-
-
-    start = 0
-    for idx, _ in enumerate(isotope_patterns):
-        iso_patterns[start:start+len(_)] = _
-        start += len(_)
-        iso_idx[idx+1] = start
+    found = out_lengths > 0
 
+    iso_patterns = out_patterns[out_patterns >= 0]
 
+    iso_idx = np.zeros(np.sum(found)+1, dtype='int')
+    iso_idx[1:] = np.cumsum(out_lengths[found])
 
-    return iso_patterns, iso_idx, np.array(isotope_charges)
+    return iso_patterns, iso_idx, out_charges[found]
 
 # Cell
 @alphapept.performance.performance_function(compilation_mode="numba-multithread")
@@ -1810,46 +2107,25 @@ def map_bruker(feature_path:str, feature_table:pd.DataFrame, query_data:dict)->p
     """
     engine_featurefile = db.create_engine('sqlite:///{}'.format(feature_path))
 
-    mapping = pd.read_sql_table('FeaturePrecursorMapping', engine_featurefile)
-    mapping = mapping.set_index('PrecursorId')
-    feature_table= feature_table.set_index('Id')
-
+    mapping = pd.read_sql_table('FeaturePrecursorMapping', engine_featurefile, columns=['PrecursorId', 'FeatureId'])
+    mapping['mapping_idx'] = np.arange(len(mapping))
 
     query_prec_id = query_data['prec_id']
 
-    #Now look up the feature for each precursor
-
-    mass_matched = []
-    mz_matched = []
-    rt_matched = []
-    query_idx = []
-    f_idx = []
-
-    for idx, prec_id in tqdm(enumerate(query_prec_id)):
-        try:
-            f_id = mapping.loc[prec_id]['FeatureId']
-            all_matches = feature_table.loc[f_id]
-            if type(f_id) == np.int64:
-                match = all_matches
-                mz_matched.append(match['mz'])
-                rt_matched.append(match['rt_apex'])
-                mass_matched.append(match['mass'])
-                query_idx.append(idx)
-                f_idx.append(match['FeatureId'])
+    #Now look up the features for all precursors
+    queries = pd.DataFrame({'PrecursorId': query_prec_id, 'query_idx': np.arange(len(query_prec_id))})
+    matches = queries.merge(mapping, on='PrecursorId', how='inner')
 
-            else:
-                for k in range(len(all_matches)):
-                    match = all_matches.iloc[k]
-                    mz_matched.append(match['mz'])
-                    rt_matched.append(match['rt_apex'])
-                    mass_matched.append(match['mass'])
-                    query_idx.append(idx)
-                    f_idx.append(match['FeatureId'])
+    # A precursor is only mapped if all of its features are in the feature table
+    found = matches['FeatureId'].isin(feature_table['Id'])
+    matches = matches[~matches['query_idx'].isin(matches.loc[~found, 'query_idx'])]
 
-        except KeyError:
-            pass
+    # As in map_ms2, feature_idx is the row of the feature in the feature table
+    feature_rows = pd.DataFrame({'Id': feature_table['Id'].values, 'feature_idx': np.arange(len(feature_table))})
+    matches = matches.merge(feature_rows, left_on='FeatureId', right_on='Id', how='inner')
+    matches = matches.sort_values(['query_idx', 'mapping_idx'])
 
-    features = pd.DataFrame(np.array([mass_matched, mz_matched, rt_matched, query_idx, f_idx]).T, columns = ['mass_matched', 'mz_matched', 'rt_matched', 'query_idx', 'feature_idx'])
+    features = pd.DataFrame(np.array([feature_table['mass'].values[matches['feature_idx']], feature_table['mz'].values[matches['feature_idx']], feature_table['rt_apex'].values[matches['feature_idx']], matches['query_idx'].values, matches['feature_idx'].values]).T, columns = ['mass_matched', 'mz_matched', 'rt_matched', 'query_idx', 'feature_idx'])
 
     features['query_idx'] = features['query_idx'].astype('int')
 
@@ -1865,6 +2141,84 @@ import alphapept.io
 import functools
 
 
+def find_features_thermo(query_data:dict, f_settings:dict, hill_centroid_tol:float = None)->pd.DataFrame:
+    """Runs the feature finder for Thermo and mzML data on the MS1 scans of a query data structure.
+
+    Args:
+        query_data (dict): Data structure containing the query data.
+        f_settings (dict): The features settings.
+        hill_centroid_tol (float, optional): Centroid tolerance of the second hill extraction. If None, it is estimated from the scores of the first extraction. Defaults to None.
+
+    Returns:
+        pd.DataFrame: DataFrame with isotope pattern summary statistics.
+    """
+    from .constants import averagine_aa, isotopes
+
+    max_gap = f_settings['max_gap']
+    centroid_tol = f_settings['centroid_tol']
+    hill_split_level = f_settings['hill_split_level']
+    iso_split_level = f_settings['iso_split_level']
+
+    window = f_settings['hill_smoothing']
+    hill_check_large = f_settings['hill_check_large']
+
+    iso_charge_min = f_settings['iso_charge_min']
+    iso_charge_max = f_settings['iso_charge_max']
+    iso_n_seeds = f_settings['iso_n_seeds']
+
+    hill_nboot_max = f_settings['hill_nboot_max']
+    hill_nboot = f_settings['hill_nboot']
+    hill_mz_precision = f_settings['hill_mz_precision']
+
+    iso_mass_range = f_settings['iso_mass_range']
+
+    iso_corr_min = f_settings['iso_corr_min']
+
+    if hill_centroid_tol is None:
+        logging.info(f'Hill extraction with centroid_tol {centroid_tol} and max_gap {max_gap}')
+
+        hill_ptrs, hill_data, path_node_cnt, score_median, score_std, connections = extract_hills(query_data, max_gap, centroid_tol, return_connections=True)
+        logging.info(f'Number of hills {len(hill_ptrs):,}, len = {np.mean(path_node_cnt):.2f}')
+
+        hill_centroid_tol = score_median+score_std*3
+        logging.info(f'Repeating hill extraction with centroid_tol {hill_centroid_tol:.2f}')
+
+        # A tighter tolerance only removes connections, so the connections of the first pass can be filtered
+        if hill_centroid_tol > centroid_tol:
+            connections = None
+    else:
+        logging.info(f'Hill extraction with centroid_tol {hill_centroid_tol:.2f} and max_gap {max_gap}')
+        connections = None
+
+    hill_ptrs, hill_data, path_node_cnt, score_median, score_std = extract_hills(query_data, max_gap, hill_centroid_tol, connections=connections)
+    del connections
+    logging.info(f'Number of hills {len(hill_ptrs):,}, len = {np.mean(path_node_cnt):.2f}')
+
+    int_data = np.array(query_data['int_list_ms1'])
+
+    hill_ptrs = split_hills(hill_ptrs, hill_data, int_data, hill_split_level=hill_split_level, window = window) #hill lenght is inthere already
+    logging.info(f'After split hill_ptrs {len(hill_ptrs):,}')
+
+    hill_data, hill_ptrs = filter_hills(hill_data, hill_ptrs, int_data, hill_check_large =hill_check_large, window=window)
+
+    logging.info(f'After filter hill_ptrs {len(hill_ptrs):,}')
+
+    stats, sortindex_, idxs_upper, scan_idx, hill_data, hill_ptrs = get_hill_data(query_data, hill_ptrs, hill_data, hill_nboot_max = hill_nboot_max, hill_nboot = hill_nboot, hill_mz_precision = hill_mz_precision)
+    logging.info('Extracting hill stats complete')
+
+    pre_isotope_patterns, pre_iso_idx = get_pre_isotope_patterns(stats, idxs_upper, sortindex_, hill_ptrs, hill_data, int_data, scan_idx, maximum_offset, iso_charge_min=iso_charge_min, iso_charge_max=iso_charge_max, iso_mass_range=iso_mass_range, cc_cutoff=iso_corr_min)
+    logging.info('Found {:,} pre isotope patterns.'.format(len(pre_iso_idx)-1))
+
+    isotope_patterns, iso_idx, isotope_charges = get_isotope_patterns(pre_isotope_patterns, pre_iso_idx, hill_ptrs, hill_data, int_data, scan_idx, stats, sortindex_, averagine_aa, isotopes, iso_charge_min = iso_charge_min, iso_charge_max = iso_charge_max, iso_mass_range = iso_mass_range, iso_n_seeds = iso_n_seeds, cc_cutoff = iso_corr_min, iso_split_level=iso_split_level, callback=None)
+    logging.info('Extracted {:,} isotope patterns.'.format(len(isotope_charges)))
+
+    feature_table = feature_finder_report(query_data, isotope_patterns, isotope_charges, iso_idx, stats, sortindex_, hill_ptrs, hill_data)
+
+    logging.info('Report complete.')
+
+    return feature_table
+
+
 def find_features(to_process:tuple, callback:Union[Callable, None] = None, parallel:bool = False)-> Union[str, bool]:
     """Wrapper for feature finding.
 
@@ -1920,63 +2274,13 @@ def find_features(to_process:tuple, callback:Union[Callable, None] = None, paral
                 features = query_data_to_features(query_data)
             else:
                 if datatype in ['thermo','mzml']:
-
-                    from .constants import averagine_aa, isotopes
-
                     f_settings = settings['features']
-                    max_gap = f_settings['max_gap']
-                    centroid_tol = f_settings['centroid_tol']
-                    hill_split_level = f_settings['hill_split_level']
-                    iso_split_level = f_settings['iso_split_level']
-
-
-                    window = f_settings['hill_smoothing']
-                    hill_check_large = f_settings['hill_check_large']
-
-                    iso_charge_min = f_settings['iso_charge_min']
-                    iso_charge_max = f_settings['iso_charge_max']
-                    iso_n_seeds = f_settings['iso_n_seeds']
-
-                    hill_nboot_max = f_settings['hill_nboot_max']
-                    hill_nboot = f_settings['hill_nboot']
-
-                    iso_mass_range = f_settings['iso_mass_range']
-
-                    iso_corr_min = f_settings['iso_corr_min']
-
                     logging.info('Feature finding on {}'.format(file_name))
 
-                    logging.info(f'Hill extraction with centroid_tol {centroid_tol} and max_gap {max_gap}')
-
-                    hill_ptrs, hill_data, path_node_cnt, score_median, score_std = extract_hills(query_data, max_gap, centroid_tol)
-                    logging.info(f'Number of hills {len(hill_ptrs):,}, len = {np.mean(path_node_cnt):.2f}')
-
-                    logging.info(f'Repeating hill extraction with centroid_tol {score_median+score_std*3:.2f}')
-
-                    hill_ptrs, hill_data, path_node_cnt, score_median, score_std = extract_hills(query_data, max_gap, score_median+score_std*3)
-                    logging.info(f'Number of hills {len(hill_ptrs):,}, len = {np.mean(path_node_cnt):.2f}')
-
-                    int_data = np.array(query_data['int_list_ms1'])
-
-                    hill_ptrs = split_hills(hill_ptrs, hill_data, int_data, hill_split_level=hill_split_level, window = window) #hill lenght is inthere already
-                    logging.info(f'After split hill_ptrs {len(hill_ptrs):,}')
-
-                    hill_data, hill_ptrs = filter_hills(hill_data, hill_ptrs, int_data, hill_check_large =hill_check_large, window=window)
-
-                    logging.info(f'After filter hill_ptrs {len(hill_ptrs):,}')
-
-                    stats, sortindex_, idxs_upper, scan_idx, hill_data, hill_ptrs = get_hill_data(query_data, hill_ptrs, hill_data, hill_nboot_max = hill_nboot_max, hill_nboot = hill_nboot)
-                    logging.info('Extracting hill stats complete')
-
-                    pre_isotope_patterns = get_pre_isotope_patterns(stats, idxs_upper, sortindex_, hill_ptrs, hill_data, int_data, scan_idx, maximum_offset, iso_charge_min=iso_charge_min, iso_charge_max=iso_charge_max, iso_mass_range=iso_mass_range, cc_cutoff=iso_corr_min)
-                    logging.info('Found {:,} pre isotope patterns.'.format(len(pre_isotope_patterns)))
-
-                    isotope_patterns, iso_idx, isotope_charges = get_isotope_patterns(pre_isotope_patterns, hill_ptrs, hill_data, int_data, scan_idx, stats, sortindex_, averagine_aa, isotopes, iso_charge_min = iso_charge_min, iso_charge_max = iso_charge_max, iso_mass_range = iso_mass_range, iso_n_seeds = iso_n_seeds, cc_cutoff = iso_corr_min, iso_split_level=iso_split_level, callback=None)
-                    logging.info('Extracted {:,} isotope patterns.'.format(len(isotope_charges)))
-
-                    feature_table = feature_finder_report(query_data, isotope_patterns, isotope_charges, iso_idx, stats, sortindex_, hill_ptrs, hill_data)
-
-                    logging.info('Report complete.')
+                    if f_settings['rt_window'] > 0:
+                        feature_table = find_features_windowed(query_data, f_settings)
+                    else:
+                        feature_table = find_features_thermo(query_data, f_settings)
 
                 elif datatype == 'bruker':
                     logging.info('Feature finding on {}'.format(file_name))
@@ -2006,6 +2310,238 @@ def find_features(to_process:tuple, callback:Union[Callable, None] = None, paral
         logging.error(f'Feature finding of file {file_name} failed. Exception {e}')
         return f"{e}" #Can't return exception object, cast as string
 
+# Cell
+def get_rt_windows(rt_:np.ndarray, rt_window:float, rt_window_overlap:float)->list:
+    """Splits the MS1 scans of a run into overlapping retention time windows.
+
+    Each window owns a core range of `rt_window` minutes. The core ranges tile the gradient, and every window is extended by `rt_window_overlap` on both sides.
+
+    Args:
+        rt_ (np.ndarray): Sorted array with retention time information for each MS1 scan.
+        rt_window (float): Size of the core range of a window.
+        rt_window_overlap (float): Overlap that is added on both sides of the core range.
+
+    Returns:
+        list: List of tuples (scan_start, scan_end, core_start, core_end).
+    """
+    n_windows = max(int(np.ceil((rt_[-1] - rt_[0]) / rt_window)), 1)
+
+    seams = rt_[0] + np.arange(n_windows + 1) * rt_window
+    seams[0] = -np.inf
+    seams[-1] = np.inf
+
+    windows = []
+    for core_start, core_end in zip(seams[:-1], seams[1:]):
+        scan_start = np.searchsorted(rt_, core_start - rt_window_overlap, side='left')
+        scan_end = np.searchsorted(rt_, core_end + rt_window_overlap, side='right')
+        windows.append((scan_start, scan_end, core_start, core_end))
+
+    return windows
+
+
+def get_feature_finding_memory(f_settings:dict, rt_:np.ndarray, memory_full:float=8)->float:
+    """Estimates the memory in GB that feature finding needs for one file.
+
+    The query data is always loaded completely, but the hills are only built for the scans of the current window.
+    The hill working set is about seven times the size of the centroids it is built from, so it accounts for 7/8 of `memory_full` and is scaled with the fraction of the gradient that a window covers.
+
+    Args:
+        f_settings (dict): Settings for feature finding.
+        rt_ (np.ndarray): Sorted array with retention time information for each MS1 scan.
+        memory_full (float, optional): Memory in GB that feature finding on the full run needs. Defaults to 8.
+
+    Returns:
+        float: The estimated memory in GB.
+    """
+    window_fraction = 1
+    if (f_settings['rt_window'] > 0) and (len(rt_) > 1) and (rt_[-1] > rt_[0]):
+        window_length = f_settings['rt_window'] + 2 * f_settings['rt_window_overlap']
+        window_fraction = min(window_length / (rt_[-1] - rt_[0]), 1)
+
+    return memory_full * (1 + 7 * window_fraction) / 8
+
+
+def slice_query_data(query_data:dict, scan_start:int, scan_end:int)->dict:
+    """Extracts the MS1 data of a range of scans from a query data structure.
+
+    Args:
+        query_data (dict): Data structure containing the query data.
+        scan_start (int): First MS1 scan of the range.
+        scan_end (int): MS1 scan after the last scan of the range.
+
+    Returns:
+        dict: Query data structure with the MS1 scans of the range.
+    """
+    indices_ = np.asarray(query_data['indices_ms1'])
+    start, end = indices_[scan_start], indices_[scan_end]
+
+    query_slice = {}
+    query_slice['indices_ms1'] = indices_[scan_start:scan_end + 1] - start
+    query_slice['mass_list_ms1'] = np.asarray(query_data['mass_list_ms1'])[start:end]
+    query_slice['int_list_ms1'] = np.asarray(query_data['int_list_ms1'])[start:end]
+    query_slice['rt_list_ms1'] = np.asarray(query_data['rt_list_ms1'])[scan_start:scan_end]
+
+    return query_slice
+
+
+def stitch_features(feature_table:pd.DataFrame, windows:list, centroid_tol:float)->pd.DataFrame:
+    """Removes features that were found twice in two neighbouring windows.
+
+    A feature that crosses the seam between two windows can be reported by both windows, one of them seeing only a truncated elution profile.
+    Features crossing the same seam with the same charge and a mz within `centroid_tol` are merged by keeping the one with the higher summed intensity.
+
+    Args:
+        feature_table (pd.DataFrame): Concatenated feature tables of all windows with a column `window`.
+        windows (list): List of windows as returned by `get_rt_windows`.
+        centroid_tol (float): Mass tolerance in ppm.
+
+    Returns:
+        pd.DataFrame: Feature table without duplicates.
+    """
+    mz = feature_table['mz'].values
+    charge = feature_table['charge'].values
+    int_sum = feature_table['int_sum'].values
+    rt_start = feature_table['rt_start'].values
+    rt_end = feature_table['rt_end'].values
+    window = feature_table['window'].values
+
+    keep = np.ones(len(feature_table), dtype=np.bool_)
+
+    for idx in range(len(windows) - 1):
+        seam = windows[idx][3]
+        at_seam = (rt_start <= seam) & (rt_end >= seam)
+
+        left = np.where(at_seam & (window == idx))[0]
+        right = np.where(at_seam & (window == idx + 1))[0]
+        right = right[np.argsort(mz[right])]
+
+        for i in left:
+            tol = mz[i] * centroid_tol * 1e-6
+            lower = np.searchsorted(mz[right], mz[i] - tol, side='left')
+            upper = np.searchsorted(mz[right], mz[i] + tol, side='right')
+            for j in right[lower:upper]:
+                if keep[j] and (charge[j] == charge[i]):
+                    if int_sum[j] > int_sum[i]:
+                        keep[i] = False
+                    else:
+                        keep[j] = False
+                    break
+
+    return feature_table[keep]
+
+
+def get_hill_centroid_tol(query_data:dict, windows:list, max_gap:int, centroid_tol:float, n_bins:int = 4096)->float:
+    """Estimates the centroid tolerance of the second hill extraction of `find_features_thermo` for a whole run, one window at a time.
+
+    The centroids of the core range of each window are connected to the following `max_gap + 1` scans.
+    This finds every connection of the run exactly once, so the median and standard deviation of the scores are the ones of the whole run.
+    The scores are not kept for the whole run: The standard deviation is combined from the windows, and the median is found with a histogram of the scores and a second pass that only keeps the scores of the bins at the median.
+
+    Args:
+        query_data (dict): Data structure containing the query data.
+        windows (list): List of windows as returned by `get_rt_windows`.
+        max_gap (int): Maximum gap when connecting centroids.
+        centroid_tol (float): Centroid tolerance of the first hill extraction.
+        n_bins (int, optional): Number of bins of the score histogram. Defaults to 4096.
+
+    Returns:
+        float: The centroid tolerance, median plus three times the standard deviation of the scores.
+    """
+    rt_ = np.asarray(query_data['rt_list_ms1'])
+
+    def window_scores():
+        for scan_start, scan_end, core_start, core_end in windows:
+            core_scan_start = np.searchsorted(rt_, core_start, side='left')
+            core_scan_end = np.searchsorted(rt_, core_end, side='left')
+            if core_scan_end <= core_scan_start:
+                continue
+
+            query_slice = slice_query_data(query_data, core_scan_start, min(core_scan_end + max_gap + 1, len(rt_)))
+            indices = query_slice['indices_ms1']
+            from_idx, to_idx, scores, score_median, score_std = get_centroid_connections(indices[1:] - indices[:-1], indices[1:], query_slice['mass_list_ms1'], max_gap, centroid_tol)
+
+            yield scores[from_idx < indices[core_scan_end - core_scan_start]]
+
+    def score_bins(scores):
+        return np.minimum((scores * (n_bins / centroid_tol)).astype(np.int64), n_bins - 1)
+
+    counts = np.zeros(n_bins, dtype=np.int64)
+    n_scores, score_mean, score_m2 = 0, 0.0, 0.0
+
+    for scores in window_scores():
+        if len(scores) == 0:
+            continue
+        counts += np.bincount(score_bins(scores), minlength=n_bins)
+
+        # Combine the mean and the sum of squared deviations of the windows
+        n_window, mean_window = len(scores), np.mean(scores)
+        delta = mean_window - score_mean
+        score_m2 += np.sum((scores - mean_window)**2) + delta**2 * n_scores * n_window / (n_scores + n_window)
+        score_mean += delta * n_window / (n_scores + n_window)
+        n_scores += n_window
+
+    if n_scores == 0:
+        raise ValueError("No centroid connections in the core range of any retention time window.")
+
+    # The median is the mean of the scores at these ranks
+    ranks = np.array([(n_scores - 1) // 2, n_scores // 2])
+    cum_counts = np.cumsum(counts)
+    bin_lower, bin_upper = np.searchsorted(cum_counts, ranks, side='right')
+
+    selected = []
+    for scores in window_scores():
+        bins = score_bins(scores)
+        selected.append(scores[(bins >= bin_lower) & (bins <= bin_upper)])
+    selected = np.sort(np.concatenate(selected))
+
+    score_median = np.mean(selected[ranks - (cum_counts[bin_lower] - counts[bin_lower])])
+    score_std = np.sqrt(score_m2 / n_scores)
+
+    return score_median + score_std*3
+
+
+def find_features_windowed(query_data:dict, f_settings:dict)->pd.DataFrame:
+    """Runs the feature finder on overlapping retention time windows and stitches the results.
+
+    Only the MS1 data of one window is processed at a time, so the size of the hill and isotope pattern arrays depends on the window size and not on the length of the run.
+    The centroid tolerance of the hill extraction is estimated once for the whole run with `get_hill_centroid_tol`.
+    Features are assigned to the window whose core range contains their apex.
+
+    Args:
+        query_data (dict): Data structure containing the query data.
+        f_settings (dict): The features settings.
+
+    Returns:
+        pd.DataFrame: DataFrame with isotope pattern summary statistics.
+    """
+    rt_ = np.asarray(query_data['rt_list_ms1'])
+    windows = get_rt_windows(rt_, f_settings['rt_window'], f_settings['rt_window_overlap'])
+
+    hill_centroid_tol = get_hill_centroid_tol(query_data, windows, f_settings['max_gap'], f_settings['centroid_tol'])
+    logging.info(f'Hill extraction in windows with centroid_tol {hill_centroid_tol:.2f}')
+
+    feature_tables = []
+    for idx, (scan_start, scan_end, core_start, core_end) in enumerate(windows):
+        if scan_end - scan_start < f_settings['hill_length_min']:
+            continue
+
+        logging.info(f'Feature finding in window {idx+1} of {len(windows)} with scans {scan_start:,} to {scan_end:,}')
+        feature_table = find_features_thermo(slice_query_data(query_data, scan_start, scan_end), f_settings, hill_centroid_tol)
+
+        in_core = (feature_table['rt_apex'] >= core_start) & (feature_table['rt_apex'] < core_end)
+        feature_table = feature_table[in_core].copy()
+        feature_table['window'] = idx
+        feature_tables.append(feature_table)
+
+    if len(feature_tables) == 0:
+        raise ValueError(f"No retention time window has at least {f_settings['hill_length_min']} MS1 scans.")
+
+    feature_table = pd.concat(feature_tables, ignore_index=True)
+    feature_table = stitch_features(feature_table, windows, f_settings['centroid_tol'])
+    logging.info(f'Stitched {len(feature_table):,} features from {len(windows)} windows.')
+
+    return feature_table.drop(columns='window').reset_index(drop=True)
+
 # Cell
 
 from sklearn.neighbors import KDTree
@@ -2074,40 +2610,45 @@ def map_ms2(feature_table:pd.DataFrame, query_data:dict, map_mz_range:float = 1,
     ref_points = replace_infs(ref_points)
 
     dist, idx = matching_tree.query(ref_points, k=map_n_neighbors)
-    ref_matched = np.zeros(ref_points.shape[0], dtype=np.bool_)
 
-    all_df = []
-    for neighbor in range(map_n_neighbors):
+    # 2D checks over all (query, neighbor) pairs; only accepted pairs are gathered
+    query_values = np.array([query_data[query_dict[_]] for _ in query_dict]).T
+    query_rt = query_values[:, list(query_dict).index('rt')][:, None]
+    query_mz = query_values[:, list(query_dict).index('mz')][:, None]
 
-        ref_df = pd.DataFrame(np.array([query_data[query_dict[_]] for _ in query_dict]).T, columns = query_dict.keys())
+    rt_check = (feature_table['rt_start'].values[idx] <= query_rt) & (query_rt <= feature_table['rt_end'].values[idx])
 
-        for _ in query_dict:
-            ref_df[_+'_matched'] = feature_table.iloc[idx[:,neighbor]][_].values
-            ref_df[_+'_offset'] = ref_df[_+'_matched'] - ref_df[_]
+    # check isolation window (win=3)
+    mass_check = np.abs(feature_table['mz'].values[idx] - query_mz) <= 3
 
-        ref_df['query_idx'] = ref_df.index
-        ref_df['feature_idx'] = idx[:,neighbor]
+    _check = rt_check & mass_check
+    if use_mob:
+        query_mob = query_values[:, list(query_dict).index('mobility')][:, None]
+        mob_check = (feature_table['mobility_lower'].values[idx] <= query_mob) & (query_mob <= feature_table['mobility_upper'].values[idx])
+        _check &= mob_check
 
-        for field in ['int_sum','int_apex','rt_start','rt_apex','rt_end','fwhm','mobility_lower','mobility_upper']:
-            if field in feature_table.keys():
-                ref_df[field] = feature_table.iloc[idx[:,neighbor]][field].values
+    ref_matched = _check.any(axis=1)
 
-        rt_check = (ref_df['rt_start'] <= ref_df['rt']) & (ref_df['rt'] <= ref_df['rt_end'])
+    # Transposed to keep the neighbor-major order of the matches
+    neighbor, query_idx = np.nonzero(_check.T)
+    feature_idx = idx[query_idx, neighbor]
 
-        # check isolation window (win=3)
-        mass_check = np.abs(ref_df['mz_offset'].values) <= 3
+    ref_df = pd.DataFrame(query_values[query_idx], columns = query_dict.keys(), index = query_idx)
 
-        _check = rt_check & mass_check
-        if use_mob:
-            mob_check = (ref_df['mobility_lower'] <= ref_df['mobility']) & (ref_df['mobility'] <= ref_df['mobility_upper'])
-            _check &= mob_check
+    for _ in query_dict:
+        ref_df[_+'_matched'] = feature_table[_].values[feature_idx]
+        ref_df[_+'_offset'] = ref_df[_+'_matched'] - ref_df[_]
+
+    ref_df['query_idx'] = query_idx
+    ref_df['feature_idx'] = feature_idx
 
-        ref_matched |= _check
-        ref_df['dist'] = dist[:,neighbor]
-        ref_df = ref_df[_check]
+    for field in ['int_sum','int_apex','rt_start','rt_apex','rt_end','fwhm','mobility_lower','mobility_upper']:
+        if field in feature_table.keys():
+            ref_df[field] = feature_table[field].values[feature_idx]
 
-        all_df.append(ref_df)
+    ref_df['dist'] = dist[query_idx, neighbor]
 
+    all_df = [ref_df]
 
     if search_unidentified:
         if use_mob:
@@ -2126,8 +2667,8 @@ def map_ms2(feature_table:pd.DataFrame, query_data:dict, map_mz_range:float = 1,
         unmatched_ref['feature_idx'] = np.nan
 
         if use_mob:
-            ref_df['mobility_matched'] = unmatched_ref['mobility']
-            ref_df['mobility_offset'] = np.nan
+            unmatched_ref['mobility_matched'] = unmatched_ref['mobility']
+            unmatched_ref['mobility_offset'] = np.nan
 
         for field in ['int_sum','int_apex','rt_start','rt_apex','rt_end','fwhm']:
             if field in feature_table.keys():
@@ -1,11 +1,12 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/11_interface.ipynb (unless otherwise specified).
 
 __all__ = ['tqdm_wrapper', 'check_version_and_hardware', 'wrapped_partial', 'create_database', 'import_raw_data',
-           'feature_finding', 'search_data', 'recalibrate_data', 'score', 'protein_grouping', 'align', 'match',
-           'quantification', 'export', 'run_complete_workflow', 'extract_median_unique', 'get_file_summary',
-           'get_summary', 'parallel_execute', 'run_cli', 'cli_overview', 'cli_database', 'cli_import',
-           'cli_feature_finding', 'cli_search', 'cli_recalibrate', 'cli_score', 'cli_align', 'cli_match',
-           'cli_quantify', 'cli_export', 'cli_workflow', 'cli_gui', 'CONTEXT_SETTINGS', 'CLICK_SETTINGS_OPTION']
+           'feature_finding', 'cluster_spectra', 'parallel_search_db', 'search_data', 'recalibrate_data', 'score',
+           'protein_grouping', 'align', 'match', 'quantification', 'export', 'run_complete_workflow',
+           'extract_median_unique', 'get_file_summary', 'get_summary', 'parallel_execute', 'run_cli', 'cli_overview',
+           'cli_database', 'cli_import', 'cli_feature_finding', 'cli_search', 'cli_recalibrate', 'cli_score',
+           'cli_align', 'cli_match', 'cli_quantify', 'cli_export', 'cli_workflow', 'cli_gui', 'CONTEXT_SETTINGS',
+           'CLICK_SETTINGS_OPTION']
 
 # Cell
 
@@ -128,6 +129,11 @@ def create_database(
                 database_path
             )
         )
+
+        if settings['fasta']['save_search_index']:
+            if alphapept.fasta.read_search_index(database_path) is None:
+                logging.info('Adding search index to database.')
+                alphapept.fasta.add_search_index(database_path, frag_bin_width = settings['fasta']['frag_bin_width'])
     else:
         logging.info(
             'Database path {} is not a file.'.format(database_path)
@@ -277,8 +283,83 @@ def feature_finding(
 
     return settings
 
+
+def cluster_spectra(
+    settings: dict,
+    logger_set: bool = False,
+    settings_parsed: bool = False,
+    callback: callable = None
+) -> dict:
+    """Cluster repeated MS2 spectra of the same precursor so that only one spectrum per cluster is searched.
+
+    Args:
+        settings (dict): A dictionary with settings how to process the data.
+        logger_set (bool): If False, reset the default logger. Defaults to False.
+        settings_parsed (bool): If True, reparse the settings. Defaults to False.
+        callback (callable): A function that accepts a float between 0 and 1 as progress. Defaults to None.
+
+    Returns:
+        dict: the parsed settings.
+
+    """
+    if not logger_set:
+        set_logger()
+    if not settings_parsed:
+        settings = check_version_and_hardware(settings)
+
+    import alphapept.search
+
+    if not callback:
+        cb = functools.partial(tqdm_wrapper, tqdm.tqdm(total=1))
+    else:
+        cb = callback
+
+    settings = parallel_execute(settings, alphapept.search.cluster_hdf, callback = cb)
+
+    return settings
+
 # Cell
 
+def parallel_search_db(
+    settings: dict,
+    first_search: bool = True,
+    callback: callable = None
+) -> dict:
+    """Search all files against the database in parallel.
+
+    If `shared_memory_db` is enabled in the search settings and multiple files are searched,
+    the database is loaded once into shared memory instead of by every process.
+
+    Args:
+        settings (dict): A dictionary with settings how to process the data.
+        first_search (bool): If True, save the intermediary results as `first search`.
+            Otherwise, results are saved as `second search`. Defaults to True.
+        callback (callable): A function that accepts a float between 0 and 1 as progress. Defaults to None.
+
+    Returns:
+        dict: The settings after processing.
+
+    """
+    import alphapept.search
+
+    shared_db = None
+    shm_handles = []
+
+    if settings['search']['shared_memory_db'] and len(settings['experiment']['file_paths']) > 1:
+        logging.info('Loading database into shared memory.')
+        shared_db, shm_handles = alphapept.search.share_database(settings['experiment']['database_path'], fragment_index = settings['search']['fragment_index'] or settings['search']['open_search'])
+
+    try:
+        settings = parallel_execute(
+            settings,
+            wrapped_partial(alphapept.search.search_db, first_search = first_search, shared_db = shared_db),
+            callback = callback
+        )
+    finally:
+        alphapept.performance.release_shared_arrays(shm_handles, unlink=True)
+
+    return settings
+
 def search_data(
     settings: dict,
     first_search: bool = True,
@@ -320,7 +401,7 @@ def search_data(
     if first_search:
         logging.info('Starting first search.')
         if settings['experiment']['database_path'] is not None:
-            settings = parallel_execute(settings, wrapped_partial(alphapept.search.search_db, first_search = first_search), callback = cb)
+            settings = parallel_search_db(settings, first_search = first_search, callback = cb)
 
             db_data = alphapept.fasta.read_database(settings['experiment']['database_path'])
 
@@ -345,7 +426,7 @@ def search_data(
         logging.info('Starting second search with DB.')
 
         if settings['experiment']['database_path'] is not None:
-            settings = parallel_execute(settings, wrapped_partial(alphapept.search.search_db, first_search = first_search), callback = cb)
+            settings = parallel_search_db(settings, first_search = first_search, callback = cb)
 
             db_data = alphapept.fasta.read_database(settings['experiment']['database_path'])
 
@@ -828,6 +909,8 @@ def run_complete_workflow(
     if workflow["find_features"]:
         steps.append(feature_finding)
     if workflow["search_data"]:
+        if settings['search']['cluster_spectra']:
+            steps.append(cluster_spectra)
         steps.append(search_data)
     if workflow["recalibrate_data"]:
         steps.append(recalibrate_data)
@@ -1104,14 +1187,25 @@ def parallel_execute(
                 logging.info(f'Using Bruker Feature Finder. Setting Process limit to {n_processes}.')
             elif ext.lower() == '.raw':
                 memory_available = psutil.virtual_memory().available/1024**3
-                n_processes = max((int(memory_available //8 ), 1))
+                memory_per_process = 8
+                ms_file = f"{base}.ms_data.hdf"
+                if settings['features']['rt_window'] > 0 and os.path.isfile(ms_file):
+                    from .io import MS_Data_File
+                    from .feature_finding import get_feature_finding_memory
+                    rt_ = MS_Data_File(ms_file).read(dataset_name='rt_list_ms1', group_name='Raw/MS1_scans')
+                    memory_per_process = get_feature_finding_memory(settings['features'], rt_)
+                n_processes = max((int(memory_available //memory_per_process ), 1))
                 logging.info(f'Setting Process limit to {n_processes}')
             else:
                 raise NotImplementedError('File extension {} not understood.'.format(ext))
 
         if step.__name__ == 'search_db':
             memory_available = psutil.virtual_memory().available/1024**3
-            n_processes = max((int(memory_available //8 ), 1)) # 8 gb per file: Todo: make this better
+            if settings['search']['shared_memory_db']:
+                # The database is already in shared memory, only the query data is loaded per file.
+                n_processes = max((int(memory_available //2 ), 1))
+            else:
+                n_processes = max((int(memory_available //8 ), 1)) # 8 gb per file: Todo: make this better
             logging.info(f'Searching. Setting Process limit to {n_processes}.')
 
 
@@ -1259,8 +1353,19 @@ def cli_feature_finding(settings_file):
     default=False,
     show_default=True,
 )
-def cli_search(settings_file, recalibrated):
+@click.option(
+    '--open_search',
+    '-o',
+    'open_search',
+    help="Search with a wide precursor window to screen for unexpected modifications",
+    is_flag=True,
+    default=False,
+    show_default=True,
+)
+def cli_search(settings_file, recalibrated, open_search):
     settings = alphapept.settings.load_settings(settings_file)
+    if open_search:
+        settings['search']['open_search'] = True
     search_data(settings, recalibrated)
 
 
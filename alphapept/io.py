@@ -2,8 +2,8 @@
 
 __all__ = ['load_thermo_raw', 'load_bruker_raw', 'one_over_k0_to_CCS', 'check_sanity', 'extract_mzml_info',
            'load_mzml_data', '__extract_nested', 'extract_mq_settings', 'parse_mq_seq', 'get_peaks', 'get_centroid',
-           'gaussian_estimator', 'centroid_data', 'get_most_abundant', 'list_to_numpy_f32', 'HDF_File', 'MS_Data_File',
-           'raw_conversion']
+           'gaussian_estimator', 'centroid_data', 'get_most_abundant', 'list_to_numpy_f32', 'gather_csr', 'HDF_File',
+           'MS_Data_File', 'raw_conversion']
 
 # Cell
 def load_thermo_raw(
@@ -695,6 +695,37 @@ def list_to_numpy_f32(
 
 # Cell
 
+@njit
+def gather_csr(
+    values: np.ndarray,
+    indptr: np.ndarray,
+    selection: np.ndarray
+) -> tuple:
+    """Select rows of an array in CSR format.
+
+    Args:
+        values (np.ndarray): The concatenated values of all rows.
+        indptr (np.ndarray): The start and end positions of each row in values.
+        selection (np.ndarray): The indices of the rows to select. Rows can be selected multiple times.
+
+    Returns:
+        tuple: An np.ndarray with the values of the selected rows and an np.ndarray with their start and end positions.
+
+    """
+    new_indptr = np.zeros(len(selection) + 1, dtype=np.int64)
+    for i in range(len(selection)):
+        new_indptr[i + 1] = new_indptr[i] + indptr[selection[i] + 1] - indptr[selection[i]]
+
+    new_values = np.empty(new_indptr[-1], dtype=values.dtype)
+    for i in range(len(selection)):
+        start = indptr[selection[i]]
+        for j in range(new_indptr[i + 1] - new_indptr[i]):
+            new_values[new_indptr[i] + j] = values[start + j]
+
+    return new_values, new_indptr
+
+# Cell
+
 import h5py
 import os
 import time
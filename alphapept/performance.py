@@ -2,7 +2,7 @@
 
 __all__ = ['COMPILATION_MODE_OPTIONS', 'is_valid_compilation_mode', 'set_worker_count', 'MAX_WORKER_COUNT',
            'set_compilation_mode', 'compile_function', '__copy_func', 'DYNAMIC_COMPILATION_ENABLED',
-           'performance_function', 'AlphaPool']
+           'performance_function', 'AlphaPool', 'create_shared_arrays', 'attach_shared_arrays', 'release_shared_arrays']
 
 # Cell
 
@@ -379,12 +379,14 @@ def performance_function(
 # Cell
 from multiprocessing import Pool
 
-def AlphaPool(process_count: int) -> multiprocessing.Pool:
+def AlphaPool(process_count: int, initializer: callable = None, initargs: tuple = ()) -> multiprocessing.Pool:
     """Create a multiprocessing.Pool object.
 
     Args:
         process_count (int): The number of processes.
             If larger than available cores, it is trimmed to the available maximum.
+        initializer (callable): A function that is called once by each worker process when it starts. Defaults to None.
+        initargs (tuple): The arguments for the initializer. Defaults to ().
 
 
     Returns:
@@ -398,4 +400,91 @@ def AlphaPool(process_count: int) -> multiprocessing.Pool:
         new_max = 1
     logging.info(f"AlphaPool was set to {process_count} processes. Setting max to {new_max}.")
 
-    return Pool(new_max)
\ No newline at end of file
+    return Pool(new_max, initializer=initializer, initargs=initargs)
+
+# Cell
+
+def create_shared_arrays(arrays: dict) -> (dict, list):
+    """Copy numpy arrays to shared memory so that they can be accessed by other processes without copying.
+
+    Args:
+        arrays (dict): A dictionary with np.ndarrays. Arrays with an object dtype are not supported.
+
+    Returns:
+        dict: A dictionary with the name, shape and dtype of the shared memory for each array. This can be passed to other processes to attach the arrays with `attach_shared_arrays`.
+        list: A list with the SharedMemory objects. These need to be released with `release_shared_arrays` when the arrays are not needed anymore.
+
+    Raises:
+        ValueError: When an array has an object dtype.
+
+    """
+    from multiprocessing import shared_memory
+
+    shared_info = {}
+    handles = []
+
+    try:
+        for key, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            if array.dtype.hasobject:
+                raise ValueError(f"Array {key} with dtype {array.dtype} can not be shared.")
+
+            shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            handles.append(shm)
+
+            shared_array = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+            shared_array[:] = array
+            del shared_array
+
+            shared_info[key] = (shm.name, array.shape, array.dtype.str)
+    except Exception:
+        release_shared_arrays(handles, unlink=True)
+        raise
+
+    return shared_info, handles
+
+
+def attach_shared_arrays(shared_info: dict) -> (dict, list):
+    """Attach numpy arrays that were created with `create_shared_arrays` in another process.
+
+    Args:
+        shared_info (dict): The description of the shared arrays as returned by `create_shared_arrays`.
+
+    Returns:
+        dict: A dictionary with read-only np.ndarrays that share their memory with the creating process.
+        list: A list with the SharedMemory objects. These need to be released with `release_shared_arrays` when the arrays are not needed anymore.
+
+    """
+    from multiprocessing import shared_memory
+
+    arrays = {}
+    handles = []
+
+    for key, (name, shape, dtype) in shared_info.items():
+        shm = shared_memory.SharedMemory(name=name)
+        handles.append(shm)
+
+        array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        array.flags.writeable = False
+        arrays[key] = array
+
+    return arrays, handles
+
+
+def release_shared_arrays(handles: list, unlink: bool = False):
+    """Release shared memory created by `create_shared_arrays` or attached by `attach_shared_arrays`.
+
+    All arrays that use the shared memory should be deleted before calling this function.
+
+    Args:
+        handles (list): A list with SharedMemory objects.
+        unlink (bool): If True, the shared memory is freed. This should only be done by the process that created the arrays. Defaults to False.
+
+    """
+    for shm in handles:
+        try:
+            shm.close()
+        except BufferError:
+            logging.info(f"Shared memory {shm.name} is still in use and can not be closed.")
+        if unlink:
+            shm.unlink()
\ No newline at end of file
@@ -86,7 +86,7 @@ def transform(
 from sklearn.neighbors import KNeighborsRegressor
 
 
-def kneighbors_calibration(df: pd.DataFrame, features: pd.DataFrame, cols: list, target: str, scaling_dict: dict, calib_n_neighbors: int) -> np.ndarray:
+def kneighbors_calibration(df: pd.DataFrame, features: pd.DataFrame, cols: list, target: str, scaling_dict: dict, calib_n_neighbors: int, return_std: bool = False) -> np.ndarray:
     """Calibration using a KNeighborsRegressor.
     Input arrays from are transformed to be used with a nearest-neighbor approach.
     Based on neighboring points a calibration is calculated for each input point.
@@ -98,9 +98,11 @@ def kneighbors_calibration(df: pd.DataFrame, features: pd.DataFrame, cols: list,
         target (str): Target column on which offset is calculated.
         scaling_dict (dict): A dictionary that contains how scaling operations are applied.
         calib_n_neighbors (int): Number of neighbors for calibration.
+        return_std (bool, optional): Flag to additionally return the local standard deviation of the target around the calibration. Defaults to False.
 
     Returns:
         np.ndarray: A numpy array with calibrated masses.
+        np.ndarray: A numpy array with the local standard deviation of the target for each point. Only returned if return_std is True.
     """
 
     data = df[cols]
@@ -119,6 +121,13 @@ def kneighbors_calibration(df: pd.DataFrame, features: pd.DataFrame, cols: list,
 
     y_hat = neigh.predict(target_points)
 
+    if return_std:
+        neighbors = neigh.kneighbors(target_points, return_distance=False)
+        residuals = df[target].values[neighbors] - y_hat[:, np.newaxis]
+        y_std = np.sqrt(np.mean(residuals**2, axis=1))
+
+        return y_hat, y_std
+
     return y_hat
 
 # Cell
@@ -132,7 +141,7 @@ def get_calibration(
     calib_mz_range: int = 20,
     calib_rt_range: float = 0.5,
     calib_mob_range: float = 0.3,
-    **kwargs) -> (np.ndarray, float):
+    **kwargs) -> (np.ndarray, float, float, np.ndarray):
     """Wrapper function to get calibrated values for the precursor mass.
 
     Args:
@@ -149,6 +158,8 @@ def get_calibration(
     Returns:
         corrected_mass (np.ndarray): The calibrated mass
         y_hat_std (float): The standard deviation of the precursor offset after calibration
+        mad_offset (float): The median absolute deviation of the precursor offset after calibration
+        local_std (np.ndarray): The standard deviation of the precursor offset in ppm within the neighborhood of each feature
 
     """
 
@@ -166,7 +177,7 @@ def get_calibration(
         scaling_dict['mobility'] = ('relative', calib_mob_range)
 
         df_sub = remove_outliers(df, outlier_std)
-        y_hat = kneighbors_calibration(df, features, cols, target, scaling_dict, calib_n_neighbors)
+        y_hat, local_std = kneighbors_calibration(df, features, cols, target, scaling_dict, calib_n_neighbors, return_std=True)
 
         corrected_mass = (1-y_hat/1e6) * features['mass_matched']
 
@@ -174,7 +185,7 @@ def get_calibration(
 
         mad_offset = np.median(np.absolute(y_hat - np.median(y_hat)))
 
-        return corrected_mass, y_hat_std, mad_offset
+        return corrected_mass, y_hat_std, mad_offset, local_std
 
 
     else:
@@ -182,7 +193,10 @@ def get_calibration(
 
         mad_offset = np.median(np.absolute(df['prec_offset_ppm'].values - np.median(df['prec_offset_ppm'].values)))
 
-        return features['mass_matched'], np.abs(df['prec_offset_ppm'].std()), mad_offset
+        y_hat_std = np.abs(df['prec_offset_ppm'].std())
+        local_std = np.full(len(features), y_hat_std)
+
+        return features['mass_matched'], y_hat_std, mad_offset, local_std
 
 # Cell
 
@@ -228,7 +242,7 @@ def calibrate_hdf(
                 verbose=False,
                 **settings["search"]
             )
-            corrected_mass, prec_offset_ppm_std, prec_offset_ppm_mad = get_calibration(
+            corrected_mass, prec_offset_ppm_std, prec_offset_ppm_mad, prec_offset_ppm_local_std = get_calibration(
                 df,
                 features,
                 **settings["calibration"]
@@ -238,6 +252,11 @@ def calibrate_hdf(
                 dataset_name="corrected_mass",
                 group_name="features"
             )
+            ms_file_.write(
+                prec_offset_ppm_local_std,
+                dataset_name="corrected_mass_std",
+                group_name="features"
+            )
         else:
 
             ms_file_.write(
@@ -246,6 +265,12 @@ def calibrate_hdf(
                 group_name="features"
             )
 
+            ms_file_.write(
+                np.zeros(len(features)),
+                dataset_name="corrected_mass_std",
+                group_name="features"
+            )
+
             prec_offset_ppm_std = 0
 
         ms_file_.write(
@@ -1,9 +1,19 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/05_search.ipynb (unless otherwise specified).
 
-__all__ = ['compare_frags', 'ppm_to_dalton', 'get_idxs', 'compare_spectrum_parallel', 'query_data_to_features',
-           'get_psms', 'frag_delta', 'intensity_fraction', 'add_column', 'remove_column', 'get_hits', 'score',
-           'LOSS_DICT', 'LOSSES', 'get_sequences', 'get_score_columns', 'plot_psms', 'store_hdf', 'search_db',
-           'search_fasta_block', 'mass_dict', 'filter_top_n', 'ion_extractor', 'search_parallel']
+__all__ = ['compare_frags', 'ppm_to_dalton', 'get_precursor_bins', 'searchsorted_binned', 'get_idxs',
+           'compare_spectrum_parallel', 'get_fragment_index', 'get_frag_tol_dalton', 'score_frags', 'add_to_top_n',
+           'get_ion_stats', 'compare_spectrum_index_parallel', 'score_frags_bounded',
+           'compare_spectrum_pruned_parallel', 'get_query_tiles', 'compare_spectrum_tile_parallel',
+           'query_data_to_features', 'get_query_spectra', 'get_local_prec_tol', 'get_psms', 'get_search_stats',
+           'add_search_rates', 'merge_search_stats', 'spectrum_cosine', 'cluster_ms2', 'fan_out_clusters',
+           'cluster_hdf', 'score_frags_shifted', 'compare_spectrum_open_parallel', 'get_delta_mass_histogram',
+           'frag_delta', 'intensity_fraction', 'add_column', 'remove_column', 'PSMContainer', 'get_hits', 'count_hits',
+           'fill_hits', 'count_ions', 'fill_score_columns', 'score', 'LOSS_DICT', 'LOSSES', 'get_sequences',
+           'get_score_columns', 'plot_psms', 'load_database', 'share_database', 'attach_database',
+           'SHARED_DATABASE_ARRAYS', 'store_hdf', 'write_search_stats', 'search_db', 'init_query_data_cache',
+           'get_query_data', 'QUERY_DATA_CACHE', 'QUERY_DATA_CACHE_MAX_MEMORY', 'search_fasta_block', 'mass_dict',
+           'merge_top_n', 'select_ions', 'TopNAccumulator', 'get_search_fingerprint', 'write_search_checkpoint',
+           'read_search_checkpoints', 'remove_search_checkpoints', 'search_parallel']
 
 # Cell
 import logging
@@ -66,14 +76,72 @@ def ppm_to_dalton(mass:float, prec_tol:int)->float:
 
 # Cell
 
-def get_idxs(db_masses:np.ndarray, query_masses:np.ndarray, prec_tol:float, ppm:bool)-> (np.ndarray, np.ndarray):
+@njit
+def get_precursor_bins(db_masses:np.ndarray, prec_bin_width:float)->np.ndarray:
+    """Get a pointer array that splits sorted database masses into bins of equal width.
+
+    Args:
+        db_masses (np.ndarray): Array containing sorted database masses.
+        prec_bin_width (float): Width of a precursor bin in Dalton.
+
+    Returns:
+        np.ndarray: Pointer array so that the masses of bin b are stored at prec_bin_indptr[b]:prec_bin_indptr[b+1].
+    """
+    n_bins = 1
+    if len(db_masses) > 0:
+        n_bins = int(db_masses[-1] / prec_bin_width) + 1
+
+    prec_bin_indptr = np.zeros(n_bins + 1, dtype=np.int64)
+    for mass in db_masses:
+        prec_bin_indptr[int(mass / prec_bin_width) + 1] += 1
+
+    return np.cumsum(prec_bin_indptr)
+
+
+@njit
+def searchsorted_binned(db_masses:np.ndarray, prec_bin_indptr:np.ndarray, prec_bin_width:float, values:np.ndarray, right:bool)->np.ndarray:
+    """Equivalent of `np.searchsorted` that only searches within the bin of each value.
+
+    Args:
+        db_masses (np.ndarray): Array containing sorted database masses.
+        prec_bin_indptr (np.ndarray): Pointer array of the precursor bins. See `get_precursor_bins`.
+        prec_bin_width (float): Width of a precursor bin in Dalton.
+        values (np.ndarray): Values to insert.
+        right (bool): Flag to return the last suitable index instead of the first.
+
+    Returns:
+        np.ndarray: Insertion indices.
+    """
+    n_bins = len(prec_bin_indptr) - 1
+    idxs = np.zeros(len(values), dtype=np.int64)
+
+    for i in range(len(values)):
+        mass_bin = int(values[i] / prec_bin_width)
+        if values[i] < 0:
+            mass_bin = 0
+        if mass_bin >= n_bins:
+            idxs[i] = len(db_masses)
+        else:
+            start = prec_bin_indptr[mass_bin]
+            end = prec_bin_indptr[mass_bin + 1]
+            if right:
+                idxs[i] = start + np.searchsorted(db_masses[start:end], values[i], side='right')
+            else:
+                idxs[i] = start + np.searchsorted(db_masses[start:end], values[i], side='left')
+
+    return idxs
+
+
+def get_idxs(db_masses:np.ndarray, query_masses:np.ndarray, prec_tol:float, ppm:bool, prec_bin_indptr:np.ndarray=None, prec_bin_width:float=None)-> (np.ndarray, np.ndarray):
     """Function to get upper and lower limits to define search range for a given precursor tolerance.
 
     Args:
         db_masses (np.ndarray): Array containing database masses.
         query_masses (np.ndarray): Array containing query masses.
-        prec_tol (float): Precursor tolerance for search.
+        prec_tol (Union[float, np.ndarray]): Precursor tolerance for search. Either one tolerance for all queries or an array with one tolerance per query.
         ppm: Flag to use ppm instead of Dalton.
+        prec_bin_indptr (np.ndarray, optional): Precomputed precursor bins to narrow down the search. Defaults to None.
+        prec_bin_width (float, optional): Width of the precursor bins in Dalton. Defaults to None.
 
     Returns:
         (np.ndarray, np.ndarray): Indices to lower and upper bounds.
@@ -84,8 +152,12 @@ def get_idxs(db_masses:np.ndarray, query_masses:np.ndarray, prec_tol:float, ppm:
     else:
         dalton_offset = prec_tol
 
-    idxs_lower = db_masses.searchsorted(query_masses - dalton_offset, side="left")
-    idxs_higher = db_masses.searchsorted(query_masses + dalton_offset, side="right")
+    if prec_bin_indptr is not None:
+        idxs_lower = searchsorted_binned(db_masses, prec_bin_indptr, prec_bin_width, query_masses - dalton_offset, False)
+        idxs_higher = searchsorted_binned(db_masses, prec_bin_indptr, prec_bin_width, query_masses + dalton_offset, True)
+    else:
+        idxs_lower = db_masses.searchsorted(query_masses - dalton_offset, side="left")
+        idxs_higher = db_masses.searchsorted(query_masses + dalton_offset, side="right")
 
     return idxs_lower, idxs_higher
 
@@ -94,7 +166,7 @@ def get_idxs(db_masses:np.ndarray, query_masses:np.ndarray, prec_tol:float, ppm:
 import alphapept.performance
 
 @alphapept.performance.performance_function
-def compare_spectrum_parallel(query_idx:int, query_masses:np.ndarray, idxs_lower:np.ndarray, idxs_higher:np.ndarray, query_indices:np.ndarray, query_frags:np.ndarray, query_ints:np.ndarray, db_indices:np.ndarray, db_frags:np.ndarray, best_hits:np.ndarray, score:np.ndarray, frag_tol:float, ppm:bool):
+def compare_spectrum_parallel(query_idx:int, query_masses:np.ndarray, idxs_lower:np.ndarray, idxs_higher:np.ndarray, query_indices:np.ndarray, query_frags:np.ndarray, query_ints:np.ndarray, db_indices:np.ndarray, db_frags:np.ndarray, best_hits:np.ndarray, score:np.ndarray, frag_tol:float, ppm:bool, counters:np.ndarray):
     """Compares a spectrum and writes to the best_hits and score.
 
     Args:
@@ -111,6 +183,7 @@ def compare_spectrum_parallel(query_idx:int, query_masses:np.ndarray, idxs_lower
         score (np.ndarray): Reporting array that stores the scores of the best hits.
         frag_tol (float): Fragment tolerance for search.
         ppm (bool): Flag to use ppm instead of Dalton.
+        counters (np.ndarray): Reporting array (n_queries x 3) that stores the number of candidates, compared candidates and fragment comparisons of each query. Use an empty array to skip counting.
     """
 
     idx_low = idxs_lower[query_idx]
@@ -125,6 +198,8 @@ def compare_spectrum_parallel(query_idx:int, query_masses:np.ndarray, idxs_lower
     for qi in query_int:
         query_int_sum += qi
 
+    n_comparisons = 0
+
     for db_idx in range(idx_low, idx_high):
         db_idx_start = db_indices[db_idx]
         db_idx_next = db_idx +1
@@ -139,6 +214,7 @@ def compare_spectrum_parallel(query_idx:int, query_masses:np.ndarray, idxs_lower
 
         q, d = 0, 0  # q > query, d > database
         while q < q_max and d < d_max:
+            n_comparisons += 1
             mass1 = query_frag[q]
             mass2 = db_frag[d]
             delta_mass = mass1 - mass2
@@ -185,241 +261,1460 @@ def compare_spectrum_parallel(query_idx:int, query_masses:np.ndarray, idxs_lower
                 best_hits[query_idx, i] = db_idx
                 break
 
-# Cell
+    if len(counters) > 0:
+        counters[query_idx, 0] = idx_high - idx_low
+        counters[query_idx, 1] = idx_high - idx_low
+        counters[query_idx, 2] = n_comparisons
 
-import pandas as pd
-import logging
-from .fasta import read_database
+# Cell
 
-def query_data_to_features(query_data: dict)->pd.DataFrame:
-    """Helper function to extract features from query data.
-    This is used when the feature finder will not be used.
+@njit
+def get_fragment_index(db_frags:np.ndarray, db_indices:np.ndarray, frag_bin_width:float)->(np.ndarray, np.ndarray, np.ndarray):
+    """Build an inverted index from binned fragment masses to database entries.
 
     Args:
-        query_data (dict): Data structure containing the query data.
+        db_frags (np.ndarray): Array with fragment masses of the db data.
+        db_indices (np.ndarray): Array with indices to the database data.
+        frag_bin_width (float): Width of a fragment bin in Dalton.
 
     Returns:
-        pd.DataFrame: Pandas dataframe so that it can be used for subsequent processing.
+        np.ndarray: Pointer array so that the fragments of bin b are stored at frag_bin_indptr[b]:frag_bin_indptr[b+1].
+        np.ndarray: Database index for each fragment, sorted by bin and database index.
+        np.ndarray: Fragment mass for each fragment, sorted by bin and database index.
     """
-    query_masses = query_data['prec_mass_list2']
-    query_mz = query_data['mono_mzs2']
-    query_rt = query_data['rt_list_ms2']
+    n_frags = len(db_frags)
 
-    features = pd.DataFrame(np.array([query_masses, query_mz, query_rt]).T, columns = ['mass_matched', 'mz_matched', 'rt_matched'])
+    frag_db_idx = np.zeros(n_frags, dtype=np.int64)
+    for db_idx in range(len(db_indices) - 1):
+        frag_db_idx[db_indices[db_idx]:db_indices[db_idx + 1]] = db_idx
 
-    features['feature_idx'] = features.index #Index to query_data
-    features['query_idx']  = np.arange(len(query_masses))
+    frag_bins = np.zeros(n_frags, dtype=np.int64)
+    for i in range(n_frags):
+        frag_bins[i] = int(db_frags[i] / frag_bin_width)
 
-    features = features.sort_values('mass_matched', ascending=True)
+    n_bins = 1
+    if n_frags > 0:
+        n_bins = frag_bins.max() + 1
 
-    return features
+    frag_bin_indptr = np.zeros(n_bins + 1, dtype=np.int64)
+    for i in range(n_frags):
+        frag_bin_indptr[frag_bins[i] + 1] += 1
+    frag_bin_indptr = np.cumsum(frag_bin_indptr)
+
+    # Stable sorting keeps the database indices ascending within each bin
+    order = np.argsort(frag_bins, kind='mergesort')
+
+    return frag_bin_indptr, frag_db_idx[order], db_frags[order]
 
 # Cell
-from typing import Callable
 
-#this wrapper function is covered by the quick_test
-def get_psms(
-    query_data: dict,
-    db_data: dict,
-    features: pd.DataFrame,
-    parallel: bool,
-    frag_tol: float,
-    prec_tol: float,
-    ppm: bool,
-    min_frag_hits: int,
-    callback: Callable = None,
-    prec_tol_calibrated:float = None,
-    frag_tol_calibrated:float = None,
-    **kwargs
-)->(np.ndarray, int):
-    """[summary]
+@njit
+def get_frag_tol_dalton(mass:float, frag_tol:float, ppm:bool)->float:
+    """Get the largest Dalton offset that can still match a fragment of a given mass.
 
     Args:
-        query_data (dict): Data structure containing the query data.
-        db_data (dict): Data structure containing the database data.
-        features (pd.DataFrame): Pandas dataframe containing feature data.
-        parallel (bool): Flag to use parallel processing.
+        mass (float): Fragment mass.
         frag_tol (float): Fragment tolerance for search.
-        prec_tol (float): Precursor tolerance for search.
         ppm (bool): Flag to use ppm instead of Dalton.
-        min_frag_hits (int): Minimum number of frag hits to report a PSMs.
-        callback (Callable, optional): Optional callback. Defaults to None.
-        prec_tol_calibrated (float, optional): Precursor tolerance if calibration exists. Defaults to None.
-        frag_tol_calibrated (float, optional): Fragment tolerance if calibration exists. Defaults to None.
 
     Returns:
-        np.ndarray: Numpy recordarray storing the PSMs.
-        int: 0
+        float: Tolerance in Dalton.
     """
-
-    if isinstance(db_data, str):
-        db_masses = read_database(db_data, array_name = 'precursors')
-        db_frags = read_database(db_data, array_name = 'fragmasses')
-        db_indices = read_database(db_data, array_name = 'indices')
-    else:
-        db_masses = db_data['precursors']
-        db_frags = db_data['fragmasses']
-        db_indices = db_data['indices']
-
-    query_indices = query_data["indices_ms2"]
-    query_frags = query_data['mass_list_ms2']
-    query_ints = query_data['int_list_ms2']
-
-    if frag_tol_calibrated:
-        frag_tol = frag_tol_calibrated
-
-    if features is not None:
-        if prec_tol_calibrated:
-            prec_tol = prec_tol_calibrated
-            query_masses = features['corrected_mass'].values
-        else:
-            query_masses = features['mass_matched'].values
-        query_mz = features['mz_matched'].values
-        query_rt = features['rt_matched'].values
-        query_selection = features['query_idx'].values
-        indices = np.zeros(len(query_selection) + 1, np.int64)
-        indices[1:] = np.diff(query_indices)[query_selection]
-        indices = np.cumsum(indices)
-        query_frags = np.concatenate(
-            [
-                query_frags[s: e] for s, e in zip(
-                    query_indices[query_selection], query_indices[query_selection + 1]
-                )
-            ]
-        )
-
-        query_ints = np.concatenate(
-            [
-                query_ints[s: e] for s, e in zip(
-                    query_indices[query_selection], query_indices[query_selection + 1]
-                )
-            ]
-        )
-        query_indices = indices
+    if ppm:
+        # The ppm error in compare_frags is relative to the mean of both masses
+        rel_tol = frag_tol * 1e-6
+        return mass * rel_tol / (1 - rel_tol / 2)
     else:
-        if prec_tol_calibrated:
-            prec_tol = prec_tol_calibrated
-
-        query_masses = query_data['prec_mass_list2']
-        query_mz = query_data['mono_mzs2']
-        query_rt = query_data['rt_list_ms2']
-
-    idxs_lower, idxs_higher = get_idxs(
-        db_masses,
-        query_masses,
-        prec_tol,
-        ppm
-    )
-
-    n_queries = len(query_masses)
-    n_db = len(db_masses)
-    top_n = 5
+        return frag_tol
 
-    if alphapept.performance.COMPILATION_MODE == "cuda":
-        import cupy
-        cupy = cupy
-
-        idxs_lower = cupy.array(idxs_lower)
-        idxs_higher = cupy.array(idxs_higher)
-        query_indices = cupy.array(query_indices)
-        query_ints = cupy.array(query_ints)
-        query_frags = cupy.array(query_frags)
-        db_indices = cupy.array(db_indices)
-        db_frags = cupy.array(db_frags)
-        db_frags = cupy.array(db_frags)
 
-    else:
-        import numpy
-        cupy = numpy
+@njit
+def score_frags(query_frag:np.ndarray, query_int:np.ndarray, query_int_sum:float, db_frag:np.ndarray, frag_tol:float, ppm:bool)->(float, int):
+    """Count the number of hits plus the matched intensity fraction as in `compare_spectrum_parallel`.
 
-    best_hits = cupy.zeros((n_queries, top_n), dtype=cupy.int_)-1
-    score = cupy.zeros((n_queries, top_n), dtype=cupy.float_)
+    Args:
+        query_frag (np.ndarray): Array with query fragments.
+        query_int (np.ndarray): Array with query intensities.
+        query_int_sum (float): Summed query intensity.
+        db_frag (np.ndarray): Array with database fragments.
+        frag_tol (float): Fragment tolerance for search.
+        ppm (bool): Flag to use ppm instead of Dalton.
 
-    logging.info(f'Performing search on {n_queries:,} query and {n_db:,} db entries with frag_tol = {frag_tol:.2f} and prec_tol = {prec_tol:.2f}.')
+    Returns:
+        float: The score of the comparison.
+        int: The number of fragment comparisons.
+    """
+    q_max = len(query_frag)
+    d_max = len(db_frag)
 
-    compare_spectrum_parallel(cupy.arange(n_queries), cupy.arange(n_queries), idxs_lower, idxs_higher, query_indices, query_frags, query_ints, db_indices, db_frags, best_hits, score, frag_tol, ppm)
+    hits = 0
+    n_comparisons = 0
 
-    query_idx, db_idx_ = cupy.where(score > min_frag_hits)
-    db_idx = best_hits[query_idx, db_idx_]
-    score_ = score[query_idx, db_idx_]
+    q, d = 0, 0  # q > query, d > database
+    while q < q_max and d < d_max:
+        n_comparisons += 1
+        mass1 = query_frag[q]
+        mass2 = db_frag[d]
+        delta_mass = mass1 - mass2
 
-    if cupy.__name__ != 'numpy':
-        query_idx = query_idx.get()
-        db_idx = db_idx.get()
-        score_ = score_.get()
+        if ppm:
+            sum_mass = mass1 + mass2
+            mass_difference = 2 * delta_mass / sum_mass * 1e6
+        else:
+            mass_difference = delta_mass
 
-    psms = np.array(
-        list(zip(query_idx, db_idx, score_)), dtype=[("query_idx", int), ("db_idx", int), ("hits", float)]
-    )
+        if abs(mass_difference) <= frag_tol:
+            hits += 1
+            hits += query_int[q]/query_int_sum
+            d += 1
+            q += 1  # Only one query for each db element
+        elif delta_mass < 0:
+            q += 1
+        elif delta_mass > 0:
+            d += 1
 
-    logging.info('Found {:,} psms.'.format(len(psms)))
+    return hits, n_comparisons
 
-    return psms, 0
 
-# Cell
 @njit
-def frag_delta(query_frag:np.ndarray, db_frag:np.ndarray, hits:np.ndarray)-> (float, float):
-    """Calculates the mass difference for a given array of hits in Dalton and ppm.
+def add_to_top_n(query_idx:int, db_idx:int, hits:float, best_hits:np.ndarray, score:np.ndarray, ion_stats:np.ndarray)->int:
+    """Insert a hit into the sorted top-n arrays of a query.
 
     Args:
-        query_frag (np.ndarray): Array with query fragments.
-        db_frag (np.ndarray): Array with database fragments.
-        hits (np.ndarray): Array with reported hits.
+        query_idx (int): Integer to the query_spectrum.
+        db_idx (int): Integer to the database entry.
+        hits (float): Score of the comparison.
+        best_hits (np.ndarray): Reporting array which stores indices to the best hits.
+        score (np.ndarray): Reporting array that stores the scores of the best hits.
+        ion_stats (np.ndarray): Reporting array that stores the ion statistics of the best hits, see `get_ion_stats`. Its rows are moved with the hits. Use an empty array to skip.
 
     Returns:
-        float: Fragment deltas in Dalton.
-        float: Fragment deltas in ppm.
+        int: Position of the hit in the top-n or -1 if it was not inserted.
     """
-    delta_m = db_frag[hits > 0] - query_frag[hits[hits > 0] - 1]
-    delta_m_ppm = (
-        2 * delta_m / (db_frag[hits > 0] + query_frag[hits[hits > 0] - 1]) * 1e6
-    )
+    len_ = best_hits.shape[1]
+    for i in range(len_):
+        if score[query_idx, i] < hits:
+            for k in range(len_ - 1, i, -1):
+                score[query_idx, k] = score[query_idx, k-1]
+                best_hits[query_idx, k] = best_hits[query_idx, k-1]
+                if len(ion_stats) > 0:
+                    ion_stats[query_idx, k] = ion_stats[query_idx, k-1]
+
+            score[query_idx, i] = hits
+            best_hits[query_idx, i] = db_idx
+            return i
+
+    return -1
 
-    return delta_m, delta_m_ppm
 
-# Cell
 @njit
-def intensity_fraction(query_int:np.ndarray, hits:np.ndarray)->float:
-    """Calculate the fraction of matched intensity
+def get_ion_stats(query_frag:np.ndarray, query_int:np.ndarray, db_frag:np.ndarray, frag_type:np.ndarray, frag_tol:float, ppm:bool, losses:np.ndarray, ion_stats:np.ndarray):
+    """Record the ion statistics of a candidate that are needed for the score columns, so that `score` does not need to count the ions again.
+    The values are summed in the order of the ions of `fill_hits` and are identical to the ones that `fill_score_columns` computes from the ions.
+
+    The columns of ion_stats are: number of ions, matched query intensity, summed mass offset and the b and y hits for each loss.
 
     Args:
+        query_frag (np.ndarray): Array with query fragments.
         query_int (np.ndarray): Array with query intensities.
-        hits (np.ndarray): Array with reported hits.
-
-    Returns:
-        float: Fraction of the matched intensity to the total intensity.
+        db_frag (np.ndarray): Array with database fragments.
+        frag_type (np.ndarray): Array with fragment types.
+        frag_tol (float): Fragment tolerance for search.
+        ppm (bool): Flag to use ppm instead of Dalton.
+        losses (np.ndarray): Array with the masses of the losses.
+        ion_stats (np.ndarray): Array with 3 + 2 * len(losses) elements to store the statistics.
     """
+    ion_stats[:] = 0
 
-    total_intensity = np.sum(query_int)
-    if total_intensity != 0:
-        matched_intensity = np.sum(query_int[hits[hits > 0] - 1])
-        i_frac = matched_intensity / total_intensity
-    else:
-        i_frac = 0
+    q_max = len(query_frag)
+    d_max = len(db_frag)
 
-    return i_frac
+    for loss_idx in range(len(losses)):
+        off = losses[loss_idx]
+        q, d = 0, 0
+        while q < q_max and d < d_max:
+            mass1 = query_frag[q]
+            mass2 = db_frag[d] - off
+            delta_mass = mass1 - mass2
 
-# Cell
-from numpy.lib.recfunctions import append_fields, drop_fields
+            if ppm:
+                sum_mass = mass1 + mass2
+                mass_difference = 2 * delta_mass / sum_mass * 1e6
+            else:
+                mass_difference = delta_mass
+
+            if abs(mass_difference) <= frag_tol:
+                ion_stats[0] += 1
+                ion_stats[1] += query_int[q]
+                ion_stats[2] += delta_mass
+                if frag_type[d] > 0:
+                    ion_stats[3 + 2 * loss_idx] += 1
+                elif frag_type[d] < 0:
+                    ion_stats[4 + 2 * loss_idx] += 1
+                d += 1
+                q += 1
+            elif delta_mass < 0:
+                q += 1
+            elif delta_mass > 0:
+                d += 1
 
 
-def add_column(recarray:np.ndarray, column:np.ndarray, name:str)->np.ndarray:
-    """Function to add a column with given name to recarray
+@alphapept.performance.performance_function(compilation_mode="numba-multithread")
+def compare_spectrum_index_parallel(query_idx:int, idxs_lower:np.ndarray, idxs_higher:np.ndarray, query_indices:np.ndarray, query_frags:np.ndarray, query_ints:np.ndarray, db_indices:np.ndarray, db_frags:np.ndarray, frag_bin_indptr:np.ndarray, frag_bin_db_idx:np.ndarray, frag_bin_masses:np.ndarray, frag_bin_width:float, best_hits:np.ndarray, score:np.ndarray, frag_tol:float, ppm:bool, min_score:float, counters:np.ndarray, frag_types:np.ndarray, losses:np.ndarray, ion_stats:np.ndarray):
+    """Compares a spectrum using a fragment index and writes to the best_hits and score.
 
     Args:
-        recarray (np.ndarray): NumPy record array.
-        column (np.ndarray): Data column that should be added to the record array.
-        name (str): Name of the column in the new recordarray.
-
-    Returns:
-        np.ndarray: NumPy recordarray with new field.
+        query_idx (int): Integer to the query_spectrum that should be compared.
+        idxs_lower (np.ndarray): Array with indices for lower search boundary.
+        idxs_higher (np.ndarray): Array with indices for upper search boundary.
+        query_indices (np.ndarray): Array with indices to the query data.
+        query_frags (np.ndarray): Array with frag types of the query data.
+        query_ints (np.ndarray): Array with fragment intensities from the query.
+        db_indices (np.ndarray):  Array with indices to the database data.
+        db_frags (np.ndarray): Array with frag types of the db data.
+        frag_bin_indptr (np.ndarray): Pointer array of the fragment index. See `get_fragment_index`.
+        frag_bin_db_idx (np.ndarray): Database indices of the fragment index. See `get_fragment_index`.
+        frag_bin_masses (np.ndarray): Fragment masses of the fragment index. See `get_fragment_index`.
+        frag_bin_width (float): Width of a fragment bin in Dalton.
+        best_hits (np.ndarray): Reporting array which stores indices to the best hits.
+        score (np.ndarray): Reporting array that stores the scores of the best hits.
+        frag_tol (float): Fragment tolerance for search.
+        ppm (bool): Flag to use ppm instead of Dalton.
+        min_score (float): Candidates that can not exceed this score are skipped. Use 0 to keep all candidates.
+        counters (np.ndarray): Reporting array (n_queries x 3) that stores the number of candidates, compared candidates and fragment comparisons of each query. Use an empty array to skip counting.
+        frag_types (np.ndarray): Array with fragment types of the db data. Only used with ion_stats.
+        losses (np.ndarray): Array with the masses of the losses. Only used with ion_stats.
+        ion_stats (np.ndarray): Reporting array (n_queries x top_n x (3 + 2 * len(losses))) that stores the ion statistics of the best hits when they enter the top-n, see `get_ion_stats`. Use an empty array to skip recording.
     """
-    if hasattr(recarray, name):
-        recarray = drop_fields(recarray, name, usemask=False, asrecarray=True)
-    recarray = append_fields(
-        recarray, name, column, dtypes=column.dtype, usemask=False, asrecarray=True
-    )
-    return recarray
+    idx_low = idxs_lower[query_idx]
+    idx_high = idxs_higher[query_idx]
+    n_candidates = idx_high - idx_low
+
+    if n_candidates <= 0:
+        if len(counters) > 0:
+            counters[query_idx, 0] = 0
+        return
+
+    query_idx_start = query_indices[query_idx]
+    query_idx_end = query_indices[query_idx + 1]
+    query_frag = query_frags[query_idx_start:query_idx_end]
+    query_int = query_ints[query_idx_start:query_idx_end]
+
+    query_int_sum = 0
+    for qi in query_int:
+        query_int_sum += qi
+
+    frag_counts = np.zeros(n_candidates, dtype=np.int64)
+    frag_ints = np.zeros(n_candidates, dtype=np.float64)
+    last_peak = np.zeros(n_candidates, dtype=np.int64) - 1
+
+    max_bin = len(frag_bin_indptr) - 2
+    n_compared = 0
+    n_comparisons = 0
+
+    for q in range(len(query_frag)):
+        mass1 = query_frag[q]
+        dalton_offset = get_frag_tol_dalton(mass1, frag_tol, ppm)
+
+        bin_lower = max(int((mass1 - dalton_offset) / frag_bin_width), 0)
+        bin_upper = min(int((mass1 + dalton_offset) / frag_bin_width), max_bin)
+
+        for frag_bin in range(bin_lower, bin_upper + 1):
+            bin_start = frag_bin_indptr[frag_bin]
+            bin_end = frag_bin_indptr[frag_bin + 1]
+            pos = bin_start + np.searchsorted(frag_bin_db_idx[bin_start:bin_end], idx_low)
+
+            while pos < bin_end:
+                db_idx = frag_bin_db_idx[pos]
+                if db_idx >= idx_high:
+                    break
+                mass2 = frag_bin_masses[pos]
+                delta_mass = mass1 - mass2
+                n_comparisons += 1
+
+                if ppm:
+                    mass_difference = 2 * delta_mass / (mass1 + mass2) * 1e6
+                else:
+                    mass_difference = delta_mass
+
+                candidate = db_idx - idx_low
+                if (abs(mass_difference) <= frag_tol) and (last_peak[candidate] != q):
+                    # Every query peak can be matched at most once per candidate
+                    last_peak[candidate] = q
+                    frag_counts[candidate] += 1
+                    frag_ints[candidate] += query_int[q]
+                pos += 1
+
+    last = best_hits.shape[1] - 1
+
+    for candidate in range(n_candidates):
+        if frag_counts[candidate] == 0:
+            continue
+
+        upper_bound = frag_counts[candidate] + frag_ints[candidate] / query_int_sum
+
+        # Small offset to be robust against differences in floating point summation
+        if upper_bound + 1e-6 <= max(score[query_idx, last], min_score):
+            continue
+
+        db_idx = idx_low + candidate
+        db_frag = db_frags[db_indices[db_idx]:db_indices[db_idx + 1]]
+        hits, n_comparisons_ = score_frags(query_frag, query_int, query_int_sum, db_frag, frag_tol, ppm)
+        n_compared += 1
+        n_comparisons += n_comparisons_
+
+        pos = add_to_top_n(query_idx, db_idx, hits, best_hits, score, ion_stats)
+        if (pos >= 0) and (len(ion_stats) > 0):
+            get_ion_stats(query_frag, query_int, db_frag, frag_types[db_indices[db_idx]:db_indices[db_idx + 1]], frag_tol, ppm, losses, ion_stats[query_idx, pos])
+
+    if len(counters) > 0:
+        counters[query_idx, 0] = n_candidates
+        counters[query_idx, 1] = n_compared
+        counters[query_idx, 2] = n_comparisons
+
+# Cell
+
+@njit
+def score_frags_bounded(query_frag:np.ndarray, query_int:np.ndarray, query_int_sum:float, db_frag:np.ndarray, frag_tol:float, ppm:bool, min_score:float)->(float, int):
+    """Score as in `score_frags` but stop as soon as the score can not exceed min_score.
+
+    Args:
+        query_frag (np.ndarray): Array with query fragments.
+        query_int (np.ndarray): Array with query intensities.
+        query_int_sum (float): Summed query intensity.
+        db_frag (np.ndarray): Array with database fragments.
+        frag_tol (float): Fragment tolerance for search.
+        ppm (bool): Flag to use ppm instead of Dalton.
+        min_score (float): Score that needs to be exceeded.
+
+    Returns:
+        float: The score of the comparison or -1 if it can not exceed min_score.
+        int: The number of fragment comparisons.
+    """
+    q_max = len(query_frag)
+    d_max = len(db_frag)
+
+    hits = 0
+    n_hits = 0
+    n_comparisons = 0
+
+    q, d = 0, 0  # q > query, d > database
+    while q < q_max and d < d_max:
+        n_comparisons += 1
+        mass1 = query_frag[q]
+        mass2 = db_frag[d]
+        delta_mass = mass1 - mass2
+
+        if ppm:
+            sum_mass = mass1 + mass2
+            mass_difference = 2 * delta_mass / sum_mass * 1e6
+        else:
+            mass_difference = delta_mass
+
+        if abs(mass_difference) <= frag_tol:
+            hits += 1
+            hits += query_int[q]/query_int_sum
+            n_hits += 1
+            d += 1
+            q += 1  # Only one query for each db element
+        else:
+            if delta_mass < 0:
+                q += 1
+            elif delta_mass > 0:
+                d += 1
+
+            # Small offset to be robust against differences in floating point summation
+            if n_hits + min(q_max - q, d_max - d) + 1 + 1e-6 <= min_score:
+                return -1, n_comparisons
+
+    return hits, n_comparisons
+
+
+@alphapept.performance.performance_function(compilation_mode="numba-multithread")
+def compare_spectrum_pruned_parallel(query_idx:int, idxs_lower:np.ndarray, idxs_higher:np.ndarray, query_indices:np.ndarray, query_frags:np.ndarray, query_ints:np.ndarray, db_indices:np.ndarray, db_frags:np.ndarray, best_hits:np.ndarray, score:np.ndarray, frag_tol:float, ppm:bool, min_score:float, counters:np.ndarray, frag_types:np.ndarray, losses:np.ndarray, ion_stats:np.ndarray):
+    """Compares a spectrum and writes to the best_hits and score, skipping candidates that can not enter the top-n.
+
+    Args:
+        query_idx (int): Integer to the query_spectrum that should be compared.
+        idxs_lower (np.ndarray): Array with indices for lower search boundary.
+        idxs_higher (np.ndarray): Array with indices for upper search boundary.
+        query_indices (np.ndarray): Array with indices to the query data.
+        query_frags (np.ndarray): Array with frag types of the query data.
+        query_ints (np.ndarray): Array with fragment intensities from the query.
+        db_indices (np.ndarray):  Array with indices to the database data.
+        db_frags (np.ndarray): Array with frag types of the db data.
+        best_hits (np.ndarray): Reporting array which stores indices to the best hits.
+        score (np.ndarray): Reporting array that stores the scores of the best hits.
+        frag_tol (float): Fragment tolerance for search.
+        ppm (bool): Flag to use ppm instead of Dalton.
+        min_score (float): Candidates that can not exceed this score are skipped. Use 0 to keep all candidates.
+        counters (np.ndarray): Reporting array (n_queries x 3) that stores the number of candidates, compared candidates and fragment comparisons of each query. Use an empty array to skip counting.
+        frag_types (np.ndarray): Array with fragment types of the db data. Only used with ion_stats.
+        losses (np.ndarray): Array with the masses of the losses. Only used with ion_stats.
+        ion_stats (np.ndarray): Reporting array (n_queries x top_n x (3 + 2 * len(losses))) that stores the ion statistics of the best hits when they enter the top-n, see `get_ion_stats`. Use an empty array to skip recording.
+    """
+    idx_low = idxs_lower[query_idx]
+    idx_high = idxs_higher[query_idx]
+
+    query_idx_start = query_indices[query_idx]
+    query_idx_end = query_indices[query_idx + 1]
+    query_frag = query_frags[query_idx_start:query_idx_end]
+    query_int = query_ints[query_idx_start:query_idx_end]
+
+    query_int_sum = 0
+    for qi in query_int:
+        query_int_sum += qi
+
+    q_max = len(query_frag)
+    last = best_hits.shape[1] - 1
+    n_compared = 0
+    n_comparisons = 0
+
+    for db_idx in range(idx_low, idx_high):
+        db_idx_start = db_indices[db_idx]
+        db_idx_end = db_indices[db_idx + 1]
+
+        limit = max(score[query_idx, last], min_score)
+
+        # Small offset to be robust against differences in floating point summation
+        if min(q_max, db_idx_end - db_idx_start) + 1 + 1e-6 <= limit:
+            continue
+
+        db_frag = db_frags[db_idx_start:db_idx_end]
+        hits, n_comparisons_ = score_frags_bounded(query_frag, query_int, query_int_sum, db_frag, frag_tol, ppm, limit)
+        n_compared += 1
+        n_comparisons += n_comparisons_
+
+        if hits > 0:
+            pos = add_to_top_n(query_idx, db_idx, hits, best_hits, score, ion_stats)
+            if (pos >= 0) and (len(ion_stats) > 0):
+                get_ion_stats(query_frag, query_int, db_frag, frag_types[db_indices[db_idx]:db_indices[db_idx + 1]], frag_tol, ppm, losses, ion_stats[query_idx, pos])
+
+    if len(counters) > 0:
+        counters[query_idx, 0] = idx_high - idx_low
+        counters[query_idx, 1] = n_compared
+        counters[query_idx, 2] = n_comparisons
+
+# Cell
+
+def get_query_tiles(idxs_lower:np.ndarray, tile_size:int)->(np.ndarray, np.ndarray):
+    """Sort queries by the lower bound of their precursor window and split them into tiles.
+
+    Args:
+        idxs_lower (np.ndarray): Array with indices for lower search boundary.
+        tile_size (int): Number of queries per tile.
+
+    Returns:
+        np.ndarray: Query indices sorted by the lower search boundary.
+        np.ndarray: Pointer array so that the queries of tile t are query_order[tile_indptr[t]:tile_indptr[t+1]].
+    """
+    query_order = np.argsort(idxs_lower, kind='mergesort')
+
+    tile_size = max(int(tile_size), 1)
+    tile_indptr = np.arange(0, len(query_order) + tile_size, tile_size, dtype=np.int64)
+    tile_indptr[-1] = len(query_order)
+
+    return query_order, tile_indptr
+
+
+@alphapept.performance.performance_function(compilation_mode="numba-multithread")
+def compare_spectrum_tile_parallel(tile_idx:int, tile_indptr:np.ndarray, query_order:np.ndarray, idxs_lower:np.ndarray, idxs_higher:np.ndarray, query_indices:np.ndarray, query_frags:np.ndarray, query_ints:np.ndarray, db_indices:np.ndarray, db_frags:np.ndarray, best_hits:np.ndarray, score:np.ndarray, frag_tol:float, ppm:bool, min_score:float, counters:np.ndarray, frag_types:np.ndarray, losses:np.ndarray, ion_stats:np.ndarray):
+    """Compares a tile of spectra against their shared database slice and writes to the best_hits and score.
+
+    Args:
+        tile_idx (int): Integer to the tile that should be compared.
+        tile_indptr (np.ndarray): Pointer array of the tiles. See `get_query_tiles`.
+        query_order (np.ndarray): Query indices sorted by the lower search boundary. See `get_query_tiles`.
+        idxs_lower (np.ndarray): Array with indices for lower search boundary.
+        idxs_higher (np.ndarray): Array with indices for upper search boundary.
+        query_indices (np.ndarray): Array with indices to the query data.
+        query_frags (np.ndarray): Array with frag types of the query data.
+        query_ints (np.ndarray): Array with fragment intensities from the query.
+        db_indices (np.ndarray):  Array with indices to the database data.
+        db_frags (np.ndarray): Array with frag types of the db data.
+        best_hits (np.ndarray): Reporting array which stores indices to the best hits.
+        score (np.ndarray): Reporting array that stores the scores of the best hits.
+        frag_tol (float): Fragment tolerance for search.
+        ppm (bool): Flag to use ppm instead of Dalton.
+        min_score (float): Candidates that can not exceed this score are skipped. Use 0 to keep all candidates.
+        counters (np.ndarray): Reporting array (n_queries x 3) that stores the number of candidates, compared candidates and fragment comparisons of each query. Use an empty array to skip counting.
+        frag_types (np.ndarray): Array with fragment types of the db data. Only used with ion_stats.
+        losses (np.ndarray): Array with the masses of the losses. Only used with ion_stats.
+        ion_stats (np.ndarray): Reporting array (n_queries x top_n x (3 + 2 * len(losses))) that stores the ion statistics of the best hits when they enter the top-n, see `get_ion_stats`. Use an empty array to skip recording.
+    """
+    tile_start = tile_indptr[tile_idx]
+    n_tile = tile_indptr[tile_idx + 1] - tile_start
+
+    if n_tile <= 0:
+        return
+
+    tile_queries = query_order[tile_start:tile_start + n_tile]
+
+    query_int_sums = np.zeros(n_tile, dtype=np.float64)
+    db_low = idxs_lower[tile_queries[0]]
+    db_high = db_low
+
+    for i in range(n_tile):
+        query_idx = tile_queries[i]
+        query_int_sum = 0
+        for qi in query_ints[query_indices[query_idx]:query_indices[query_idx + 1]]:
+            query_int_sum += qi
+        query_int_sums[i] = query_int_sum
+        db_high = max(db_high, idxs_higher[query_idx])
+
+        if len(counters) > 0:
+            counters[query_idx, 0] = max(idxs_higher[query_idx] - idxs_lower[query_idx], 0)
+            counters[query_idx, 1] = 0
+            counters[query_idx, 2] = 0
+
+    last = best_hits.shape[1] - 1
+
+    for db_idx in range(db_low, db_high):
+        db_idx_start = db_indices[db_idx]
+        db_idx_end = db_indices[db_idx + 1]
+        db_frag = db_frags[db_idx_start:db_idx_end]
+
+        for i in range(n_tile):
+            query_idx = tile_queries[i]
+
+            # Queries are sorted by the lower boundary, so no later query contains this entry
+            if db_idx < idxs_lower[query_idx]:
+                break
+
+            if db_idx >= idxs_higher[query_idx]:
+                continue
+
+            query_idx_start = query_indices[query_idx]
+            query_idx_end = query_indices[query_idx + 1]
+
+            limit = max(score[query_idx, last], min_score)
+
+            # Small offset to be robust against differences in floating point summation
+            if min(query_idx_end - query_idx_start, db_idx_end - db_idx_start) + 1 + 1e-6 <= limit:
+                continue
+
+            query_frag = query_frags[query_idx_start:query_idx_end]
+            query_int = query_ints[query_idx_start:query_idx_end]
+            hits, n_comparisons = score_frags_bounded(query_frag, query_int, query_int_sums[i], db_frag, frag_tol, ppm, limit)
+
+            if len(counters) > 0:
+                counters[query_idx, 1] += 1
+                counters[query_idx, 2] += n_comparisons
+
+            if hits > 0:
+                pos = add_to_top_n(query_idx, db_idx, hits, best_hits, score, ion_stats)
+                if (pos >= 0) and (len(ion_stats) > 0):
+                    get_ion_stats(query_frag, query_int, db_frag, frag_types[db_indices[db_idx]:db_indices[db_idx + 1]], frag_tol, ppm, losses, ion_stats[query_idx, pos])
+
+# Cell
+
+import pandas as pd
+import logging
+from .fasta import read_database, read_search_index
+from .io import gather_csr
+
+def query_data_to_features(query_data: dict)->pd.DataFrame:
+    """Helper function to extract features from query data.
+    This is used when the feature finder will not be used.
+
+    Args:
+        query_data (dict): Data structure containing the query data.
+
+    Returns:
+        pd.DataFrame: Pandas dataframe so that it can be used for subsequent processing.
+    """
+    query_masses = query_data['prec_mass_list2']
+    query_mz = query_data['mono_mzs2']
+    query_rt = query_data['rt_list_ms2']
+
+    features = pd.DataFrame(np.array([query_masses, query_mz, query_rt]).T, columns = ['mass_matched', 'mz_matched', 'rt_matched'])
+
+    features['feature_idx'] = features.index #Index to query_data
+    features['query_idx']  = np.arange(len(query_masses))
+
+    features = features.sort_values('mass_matched', ascending=True)
+
+    return features
+
+
+def get_query_spectra(query_data: dict, features: pd.DataFrame)->tuple:
+    """Helper function to get the MS2 spectra of the features.
+    The spectra are in the order of the features, so that a spectrum can be selected multiple times if it belongs to several features.
+
+    Args:
+        query_data (dict): Data structure containing the query data.
+        features (pd.DataFrame): Pandas dataframe containing feature data. If None, all spectra of the query data are returned.
+
+    Returns:
+        np.ndarray: Start and end positions of each spectrum.
+        np.ndarray: Fragment masses of the spectra.
+        np.ndarray: Fragment intensities of the spectra.
+    """
+    query_indices = query_data["indices_ms2"]
+    query_frags = query_data['mass_list_ms2']
+    query_ints = query_data['int_list_ms2']
+
+    if features is not None:
+        query_selection = features['query_idx'].values
+        query_frags, indices = gather_csr(query_frags, query_indices, query_selection)
+        query_ints, indices = gather_csr(query_ints, query_indices, query_selection)
+        query_indices = indices
+
+    return query_indices, query_frags, query_ints
+
+
+def get_local_prec_tol(local_std:np.ndarray, calibration_std:float, min_prec_tol:float, max_prec_tol:float)->np.ndarray:
+    """Get a precursor tolerance per query from the local uncertainty of the mass calibration.
+
+    Args:
+        local_std (np.ndarray): Standard deviation of the precursor offset within the neighborhood of each query, see `corrected_mass_std` in `alphapept.recalibration.calibrate_hdf`.
+        calibration_std (float): Number of standard deviations that are accepted.
+        min_prec_tol (float): Lower limit for the tolerance.
+        max_prec_tol (float): Upper limit for the tolerance, e.g. the global calibrated tolerance.
+
+    Returns:
+        np.ndarray: Precursor tolerance for each query.
+    """
+    return np.clip(local_std * calibration_std, min_prec_tol, max_prec_tol)
+
+# Cell
+from typing import Callable
+import time
+
+#this wrapper function is covered by the quick_test
+def get_psms(
+    query_data: dict,
+    db_data: dict,
+    features: pd.DataFrame,
+    parallel: bool,
+    frag_tol: float,
+    prec_tol: float,
+    ppm: bool,
+    min_frag_hits: int,
+    callback: Callable = None,
+    prec_tol_calibrated:float = None,
+    frag_tol_calibrated:float = None,
+    fragment_index:bool = False,
+    frag_bin_width:float = 0.05,
+    query_spectra:tuple = None,
+    top_n:int = 5,
+    prune:bool = True,
+    query_tiling:bool = False,
+    query_tile_size:int = 64,
+    calibration_std:float = 3,
+    local_prec_tol:bool = False,
+    local_prec_tol_min:float = 1,
+    cluster_spectra:bool = False,
+    open_search:bool = False,
+    open_search_prec_tol:float = 500,
+    open_search_candidates:int = 50,
+    search_stats:bool = False,
+    fused_search:bool = False,
+    **kwargs
+)->(np.ndarray, int):
+    """[summary]
+
+    Args:
+        query_data (dict): Data structure containing the query data.
+        db_data (dict): Data structure containing the database data.
+        features (pd.DataFrame): Pandas dataframe containing feature data.
+        parallel (bool): Flag to use parallel processing.
+        frag_tol (float): Fragment tolerance for search.
+        prec_tol (float): Precursor tolerance for search.
+        ppm (bool): Flag to use ppm instead of Dalton.
+        min_frag_hits (int): Minimum number of frag hits to report a PSMs.
+        callback (Callable, optional): Optional callback. Defaults to None.
+        prec_tol_calibrated (float, optional): Precursor tolerance if calibration exists. Defaults to None.
+        frag_tol_calibrated (float, optional): Fragment tolerance if calibration exists. Defaults to None.
+        fragment_index (bool, optional): Flag to search with a fragment index instead of comparing all candidates. Defaults to False.
+        frag_bin_width (float, optional): Width of the fragment index bins in Dalton. Ignored if the fragment index is read from the database. Defaults to 0.05.
+        query_spectra (tuple, optional): The spectra of the features as returned by `get_query_spectra`. If None, they are extracted from the query data. Defaults to None.
+        top_n (int, optional): Number of best candidates that are kept per query. Defaults to 5.
+        prune (bool, optional): Flag to skip candidates that can not be reported. Not used on GPU. Defaults to True.
+        query_tiling (bool, optional): Flag to compare queries in tiles of similar precursor mass against the database when pruning, see `compare_spectrum_tile_parallel`. Defaults to False.
+        query_tile_size (int, optional): Number of queries that are compared together against the database with query_tiling. See `get_query_tiles`. Defaults to 64.
+        calibration_std (float, optional): Std range for the local precursor tolerance. Defaults to 3.
+        local_prec_tol (bool, optional): Flag to use a precursor tolerance per feature from the local calibration uncertainty (`corrected_mass_std`) if calibration exists. Only used with ppm. Defaults to False.
+        local_prec_tol_min (float, optional): Lower limit of the local precursor tolerance. Defaults to 1.
+        cluster_spectra (bool, optional): Flag to only compare the leader of each cluster (`cluster_idx` of the features) against the database and to score the members against the best hits of their leader. Not used on GPU. Defaults to False.
+        open_search (bool, optional): Flag to search with a wide precursor window, see `compare_spectrum_open_parallel`. Not used on GPU. Defaults to False.
+        open_search_prec_tol (float, optional): Precursor tolerance of the open search in Dalton. Defaults to 500.
+        open_search_candidates (int, optional): Number of candidates from the fragment index that are scored per query in the open search. Defaults to 50.
+        search_stats (bool, optional): Flag to count the candidates and fragment comparisons of each query. Defaults to False.
+        fused_search (bool, optional): Flag to record the ion statistics of the best hits during the search, so that `get_score_columns` only needs to recompute the ions of the PSMs. Not used with the CUDA compatible `compare_spectrum_parallel`, i.e. without prune or on GPU. Defaults to False.
+
+    Returns:
+        np.ndarray: Numpy recordarray storing the PSMs. With fused_search, the field ion_stats stores the ion statistics of each PSM, see `get_ion_stats`.
+        dict: Statistics of the search as returned by `get_search_stats`. None if search_stats is not set.
+    """
+
+    if isinstance(db_data, str):
+        db_masses = read_database(db_data, array_name = 'precursors')
+        db_frags = read_database(db_data, array_name = 'fragmasses')
+        db_indices = read_database(db_data, array_name = 'indices')
+        search_index = read_search_index(db_data, fragment_index = fragment_index or open_search)
+        if fused_search:
+            frag_types = read_database(db_data, array_name = 'fragtypes')
+    else:
+        db_masses = db_data['precursors']
+        db_frags = db_data['fragmasses']
+        db_indices = db_data['indices']
+        if fused_search:
+            frag_types = db_data['fragtypes']
+        if 'search_index' in db_data.keys():
+            search_index = db_data['search_index']
+        else:
+            search_index = None
+
+    if query_spectra is None:
+        query_spectra = get_query_spectra(query_data, features)
+    query_indices, query_frags, query_ints = query_spectra
+
+    if frag_tol_calibrated:
+        frag_tol = frag_tol_calibrated
+
+    if features is not None:
+        if prec_tol_calibrated:
+            prec_tol = prec_tol_calibrated
+            query_masses = features['corrected_mass'].values
+
+            if local_prec_tol and ppm and ('corrected_mass_std' in features.columns):
+                prec_tol = get_local_prec_tol(features['corrected_mass_std'].values, calibration_std, local_prec_tol_min, prec_tol_calibrated)
+                logging.info(f'Using local precursor tolerances with a median of {np.median(prec_tol):.2f} ppm.')
+        else:
+            query_masses = features['mass_matched'].values
+        query_mz = features['mz_matched'].values
+        query_rt = features['rt_matched'].values
+    else:
+        if prec_tol_calibrated:
+            prec_tol = prec_tol_calibrated
+
+        query_masses = query_data['prec_mass_list2']
+        query_mz = query_data['mono_mzs2']
+        query_rt = query_data['rt_list_ms2']
+
+    if open_search:
+        prec_tol = open_search_prec_tol
+        ppm_prec = False
+    else:
+        ppm_prec = ppm
+
+    if search_index is not None:
+        idxs_lower, idxs_higher = get_idxs(
+            db_masses,
+            query_masses,
+            prec_tol,
+            ppm_prec,
+            search_index['prec_bin_indptr'],
+            search_index['prec_bin_width']
+        )
+    else:
+        idxs_lower, idxs_higher = get_idxs(
+            db_masses,
+            query_masses,
+            prec_tol,
+            ppm_prec
+        )
+
+    n_queries = len(query_masses)
+    n_db = len(db_masses)
+
+    query_clusters = None
+    if cluster_spectra and (not open_search) and (features is not None) and ('cluster_idx' in features.columns) and alphapept.performance.COMPILATION_MODE != "cuda":
+        query_clusters = features['cluster_idx'].values
+        is_member = query_clusters != np.arange(n_queries)
+        idxs_higher_search = np.where(is_member, idxs_lower, idxs_higher)
+        logging.info(f'Searching {n_queries-np.sum(is_member):,} cluster leaders of {n_queries:,} queries.')
+    else:
+        idxs_higher_search = idxs_higher
+
+    if alphapept.performance.COMPILATION_MODE == "cuda" and not (fragment_index or open_search):
+        prune = False
+        import cupy
+        cupy = cupy
+
+        idxs_lower = cupy.array(idxs_lower)
+        idxs_higher = cupy.array(idxs_higher)
+        idxs_higher_search = idxs_higher
+        query_indices = cupy.array(query_indices)
+        query_ints = cupy.array(query_ints)
+        query_frags = cupy.array(query_frags)
+        db_indices = cupy.array(db_indices)
+        db_frags = cupy.array(db_frags)
+        db_frags = cupy.array(db_frags)
+
+    else:
+        import numpy
+        cupy = numpy
+
+    best_hits = cupy.zeros((n_queries, top_n), dtype=cupy.int_)-1
+    score = cupy.zeros((n_queries, top_n), dtype=cupy.float_)
+    if search_stats:
+        counters = cupy.zeros((n_queries, 3), dtype=cupy.int64)
+    else:
+        counters = cupy.zeros((0, 3), dtype=cupy.int64)
+
+    if fused_search and not (open_search or fragment_index or prune):
+        logging.info('Ion statistics are only recorded with prune on CPU, fused_search is not used.')
+        fused_search = False
+
+    if fused_search:
+        ion_stats = np.zeros((n_queries, top_n, 3 + 2 * len(LOSSES)), dtype=np.float64)
+    else:
+        frag_types = np.zeros(0, dtype=np.int8)
+        ion_stats = np.zeros((0, 0, 0), dtype=np.float64)
+
+    logging.info(f'Performing search on {n_queries:,} query and {n_db:,} db entries with frag_tol = {frag_tol:.2f} and prec_tol = {np.max(prec_tol):.2f}.')
+
+    if fragment_index or open_search:
+        if (search_index is not None) and ('frag_bin_indptr' in search_index):
+            frag_bin_indptr = search_index['frag_bin_indptr']
+            frag_bin_db_idx = search_index['frag_bin_db_idx']
+            frag_bin_masses = search_index['frag_bin_masses']
+            frag_bin_width = search_index['frag_bin_width']
+            logging.info(f'Using fragment index from database with {len(frag_bin_indptr)-1:,} bins.')
+        else:
+            frag_bin_indptr, frag_bin_db_idx, frag_bin_masses = get_fragment_index(db_frags, db_indices, frag_bin_width)
+            logging.info(f'Using fragment index with {len(frag_bin_indptr)-1:,} bins.')
+
+    start = time.time()
+
+    if open_search:
+        logging.info(f'Open search with a precursor window of {open_search_prec_tol:.2f} Da, scoring the best {open_search_candidates:,} candidates per query.')
+        compare_spectrum_open_parallel(cupy.arange(n_queries), query_masses, db_masses, idxs_lower, idxs_higher, query_indices, query_frags, query_ints, db_indices, db_frags, frag_bin_indptr, frag_bin_db_idx, frag_bin_masses, frag_bin_width, best_hits, score, frag_tol, ppm, max(open_search_candidates, top_n), counters, frag_types, LOSSES, ion_stats)
+    elif fragment_index:
+        compare_spectrum_index_parallel(cupy.arange(n_queries), idxs_lower, idxs_higher_search, query_indices, query_frags, query_ints, db_indices, db_frags, frag_bin_indptr, frag_bin_db_idx, frag_bin_masses, frag_bin_width, best_hits, score, frag_tol, ppm, min_frag_hits, counters, frag_types, LOSSES, ion_stats)
+    elif prune and query_tiling:
+        query_order, tile_indptr = get_query_tiles(idxs_lower, query_tile_size)
+        compare_spectrum_tile_parallel(cupy.arange(len(tile_indptr) - 1), tile_indptr, query_order, idxs_lower, idxs_higher_search, query_indices, query_frags, query_ints, db_indices, db_frags, best_hits, score, frag_tol, ppm, min_frag_hits, counters, frag_types, LOSSES, ion_stats)
+    elif prune:
+        compare_spectrum_pruned_parallel(cupy.arange(n_queries), idxs_lower, idxs_higher_search, query_indices, query_frags, query_ints, db_indices, db_frags, best_hits, score, frag_tol, ppm, min_frag_hits, counters, frag_types, LOSSES, ion_stats)
+    else:
+        compare_spectrum_parallel(cupy.arange(n_queries), cupy.arange(n_queries), idxs_lower, idxs_higher_search, query_indices, query_frags, query_ints, db_indices, db_frags, best_hits, score, frag_tol, ppm, counters)
+
+    if query_clusters is not None:
+        fan_out_clusters(np.arange(n_queries), query_clusters, idxs_lower, idxs_higher, query_indices, query_frags, query_ints, db_indices, db_frags, best_hits, score, frag_tol, ppm, counters, frag_types, LOSSES, ion_stats)
+
+    search_time = time.time() - start
+
+    query_idx, db_idx_ = cupy.where(score > min_frag_hits)
+    db_idx = best_hits[query_idx, db_idx_]
+    score_ = score[query_idx, db_idx_]
+
+    if cupy.__name__ != 'numpy':
+        query_idx = query_idx.get()
+        db_idx = db_idx.get()
+        score_ = score_.get()
+        counters = counters.get()
+
+    psms = np.array(
+        list(zip(query_idx, db_idx, score_)), dtype=[("query_idx", int), ("db_idx", int), ("hits", float)]
+    )
+
+    if fused_search:
+        psms_ = psms
+        psms = np.zeros(len(psms_), dtype=psms_.dtype.descr + [("ion_stats", float, (ion_stats.shape[2],))])
+        for _ in psms_.dtype.names:
+            psms[_] = psms_[_]
+        psms['ion_stats'] = ion_stats[query_idx, db_idx_]
+
+    logging.info('Found {:,} psms.'.format(len(psms)))
+
+    if search_stats:
+        stats = get_search_stats(counters, search_time)
+        logging.info(f"Compared {stats['n_compared']:,} of {stats['n_candidates']:,} candidates with {stats['n_frag_comparisons']:,} fragment comparisons in {search_time:.2f} s ({stats['comparisons_per_second']:,.0f} comparisons per second).")
+    else:
+        stats = None
+
+    return psms, stats
+
+# Cell
+
+def get_search_stats(counters:np.ndarray, search_time:float)->dict:
+    """Reduce the per-query counters of a search to summary statistics.
+
+    Args:
+        counters (np.ndarray): Array (n_queries x 3) with the number of candidates, compared candidates and fragment comparisons of each query.
+        search_time (float): Time of the comparison in seconds.
+
+    Returns:
+        dict: Search statistics.
+    """
+    search_stats = {}
+    search_stats['n_queries'] = len(counters)
+    search_stats['n_candidates'] = int(counters[:, 0].sum())
+    search_stats['max_candidates'] = int(counters[:, 0].max()) if len(counters) > 0 else 0
+    search_stats['n_compared'] = int(counters[:, 1].sum())
+    search_stats['n_frag_comparisons'] = int(counters[:, 2].sum())
+    search_stats['search_time'] = float(search_time)
+
+    return add_search_rates(search_stats)
+
+
+def add_search_rates(search_stats:dict)->dict:
+    """Add the candidates per query and the comparisons per second to search statistics.
+
+    Args:
+        search_stats (dict): Search statistics as returned by `get_search_stats`.
+
+    Returns:
+        dict: Search statistics with rates.
+    """
+    search_stats['candidates_per_query'] = search_stats['n_candidates'] / max(search_stats['n_queries'], 1)
+
+    if search_stats['search_time'] > 0:
+        comparisons_per_second = search_stats['n_frag_comparisons'] / search_stats['search_time']
+    else:
+        comparisons_per_second = 0.0
+
+    search_stats['comparisons_per_second'] = comparisons_per_second
+
+    return search_stats
+
+
+def merge_search_stats(search_stats_list:list)->dict:
+    """Merge the statistics of several searches of the same queries, e.g. of multiple FASTA blocks.
+
+    Args:
+        search_stats_list (list): List of search statistics as returned by `get_search_stats`.
+
+    Returns:
+        dict: Merged search statistics. None if the list is empty.
+    """
+    if len(search_stats_list) == 0:
+        return None
+
+    merged = {'n_queries':0, 'n_candidates':0, 'max_candidates':0, 'n_compared':0, 'n_frag_comparisons':0, 'search_time':0.0}
+
+    for search_stats in search_stats_list:
+        for key in ['n_queries', 'max_candidates']:
+            merged[key] = max(merged[key], search_stats[key])
+        for key in ['n_candidates', 'n_compared', 'n_frag_comparisons', 'search_time']:
+            merged[key] += search_stats[key]
+
+    return add_search_rates(merged)
+
+# Cell
+
+@njit
+def spectrum_cosine(frag1:np.ndarray, int1:np.ndarray, frag2:np.ndarray, int2:np.ndarray, frag_tol:float, ppm:bool)->float:
+    """Cosine similarity of two centroided spectra. Peaks are matched as in `compare_frags`.
+
+    Args:
+        frag1 (np.ndarray): Sorted fragment masses of the first spectrum.
+        int1 (np.ndarray): Intensities of the first spectrum.
+        frag2 (np.ndarray): Sorted fragment masses of the second spectrum.
+        int2 (np.ndarray): Intensities of the second spectrum.
+        frag_tol (float): Fragment tolerance for matching.
+        ppm (bool): Flag to use ppm instead of Dalton.
+
+    Returns:
+        float: Cosine similarity between 0 and 1.
+    """
+    norm1 = 0.0
+    for i in int1:
+        norm1 += i * i
+    norm2 = 0.0
+    for i in int2:
+        norm2 += i * i
+
+    if (norm1 == 0) or (norm2 == 0):
+        return 0.0
+
+    dot = 0.0
+    q, d = 0, 0
+    while q < len(frag1) and d < len(frag2):
+        mass1 = frag1[q]
+        mass2 = frag2[d]
+        delta_mass = mass1 - mass2
+
+        if ppm:
+            mass_difference = 2 * delta_mass / (mass1 + mass2) * 1e6
+        else:
+            mass_difference = delta_mass
+
+        if abs(mass_difference) <= frag_tol:
+            dot += int1[q] * int2[d]
+            q += 1
+            d += 1
+        elif delta_mass < 0:
+            q += 1
+        else:
+            d += 1
+
+    return dot / np.sqrt(norm1 * norm2)
+
+
+@njit
+def cluster_ms2(query_mz:np.ndarray, query_rt:np.ndarray, query_charge:np.ndarray, query_indices:np.ndarray, query_frags:np.ndarray, query_ints:np.ndarray, mz_tol:float, rt_tol:float, min_cosine:float, frag_tol:float, ppm:bool)->np.ndarray:
+    """Leader clustering of MS2 spectra by precursor m/z, RT, charge and fragment cosine similarity.
+
+    Args:
+        query_mz (np.ndarray): Precursor m/z of each spectrum.
+        query_rt (np.ndarray): Retention time of each spectrum.
+        query_charge (np.ndarray): Precursor charge of each spectrum.
+        query_indices (np.ndarray): Array with indices to the query data.
+        query_frags (np.ndarray): Array with fragment masses of the query data.
+        query_ints (np.ndarray): Array with fragment intensities of the query data.
+        mz_tol (float): Precursor m/z tolerance in ppm.
+        rt_tol (float): Retention time tolerance.
+        min_cosine (float): Minimum cosine similarity to the leader.
+        frag_tol (float): Fragment tolerance for the cosine similarity.
+        ppm (bool): Flag to use ppm instead of Dalton for the fragment tolerance.
+
+    Returns:
+        np.ndarray: Index of the leader of each spectrum. Leaders point to themselves.
+    """
+    n_queries = len(query_mz)
+    clusters = np.full(n_queries, -1, dtype=np.int64)
+    order = np.argsort(query_mz)
+
+    for i in range(n_queries):
+        leader = order[i]
+        if clusters[leader] != -1:
+            continue
+        clusters[leader] = leader
+
+        leader_frag = query_frags[query_indices[leader]:query_indices[leader + 1]]
+        leader_int = query_ints[query_indices[leader]:query_indices[leader + 1]]
+        mz_max = query_mz[leader] * (1 + mz_tol / 1e6)
+
+        for j in range(i + 1, n_queries):
+            member = order[j]
+            if query_mz[member] > mz_max:
+                break
+            if clusters[member] != -1:
+                continue
+            if query_charge[member] != query_charge[leader]:
+                continue
+            if abs(query_rt[member] - query_rt[leader]) > rt_tol:
+                continue
+
+            member_frag = query_frags[query_indices[member]:query_indices[member + 1]]
+            member_int = query_ints[query_indices[member]:query_indices[member + 1]]
+
+            if spectrum_cosine(leader_frag, leader_int, member_frag, member_int, frag_tol, ppm) >= min_cosine:
+                clusters[member] = leader
+
+    return clusters
+
+
+@alphapept.performance.performance_function(compilation_mode="numba-multithread")
+def fan_out_clusters(query_idx:int, query_clusters:np.ndarray, idxs_lower:np.ndarray, idxs_higher:np.ndarray, query_indices:np.ndarray, query_frags:np.ndarray, query_ints:np.ndarray, db_indices:np.ndarray, db_frags:np.ndarray, best_hits:np.ndarray, score:np.ndarray, frag_tol:float, ppm:bool, counters:np.ndarray, frag_types:np.ndarray, losses:np.ndarray, ion_stats:np.ndarray):
+    """Score the best hits of the leader of a cluster against the spectrum of a member and write to the best_hits and score of the member.
+
+    Args:
+        query_idx (int): Integer to the query_spectrum. Leaders are skipped.
+        query_clusters (np.ndarray): Index of the leader of each query as returned by `cluster_ms2`.
+        idxs_lower (np.ndarray): Array with indices for lower search boundary.
+        idxs_higher (np.ndarray): Array with indices for upper search boundary.
+        query_indices (np.ndarray): Array with indices to the query data.
+        query_frags (np.ndarray): Array with frag types of the query data.
+        query_ints (np.ndarray): Array with fragment intensities from the query.
+        db_indices (np.ndarray):  Array with indices to the database data.
+        db_frags (np.ndarray): Array with frag types of the db data.
+        best_hits (np.ndarray): Reporting array which stores indices to the best hits.
+        score (np.ndarray): Reporting array that stores the scores of the best hits.
+        frag_tol (float): Fragment tolerance for search.
+        ppm (bool): Flag to use ppm instead of Dalton.
+        counters (np.ndarray): Reporting array (n_queries x 3) that stores the number of candidates, compared candidates and fragment comparisons of each query. Use an empty array to skip counting.
+        frag_types (np.ndarray): Array with fragment types of the db data. Only used with ion_stats.
+        losses (np.ndarray): Array with the masses of the losses. Only used with ion_stats.
+        ion_stats (np.ndarray): Reporting array (n_queries x top_n x (3 + 2 * len(losses))) that stores the ion statistics of the best hits when they enter the top-n, see `get_ion_stats`. Use an empty array to skip recording.
+    """
+    leader = query_clusters[query_idx]
+
+    if (leader == query_idx) or (leader < 0):
+        return
+
+    query_idx_start = query_indices[query_idx]
+    query_idx_end = query_indices[query_idx + 1]
+    query_frag = query_frags[query_idx_start:query_idx_end]
+    query_int = query_ints[query_idx_start:query_idx_end]
+
+    query_int_sum = 0
+    for qi in query_int:
+        query_int_sum += qi
+
+    n_compared = 0
+    n_comparisons = 0
+
+    for i in range(best_hits.shape[1]):
+        db_idx = best_hits[leader, i]
+
+        if db_idx < 0:
+            break
+        if (db_idx < idxs_lower[query_idx]) or (db_idx >= idxs_higher[query_idx]):
+            continue
+
+        db_frag = db_frags[db_indices[db_idx]:db_indices[db_idx + 1]]
+        hits, n_comparisons_ = score_frags(query_frag, query_int, query_int_sum, db_frag, frag_tol, ppm)
+        n_compared += 1
+        n_comparisons += n_comparisons_
+
+        pos = add_to_top_n(query_idx, db_idx, hits, best_hits, score, ion_stats)
+        if (pos >= 0) and (len(ion_stats) > 0):
+            get_ion_stats(query_frag, query_int, db_frag, frag_types[db_indices[db_idx]:db_indices[db_idx + 1]], frag_tol, ppm, losses, ion_stats[query_idx, pos])
+
+    if len(counters) > 0:
+        counters[query_idx, 0] = idxs_higher[query_idx] - idxs_lower[query_idx]
+        counters[query_idx, 1] = n_compared
+        counters[query_idx, 2] = n_comparisons
+
+# Cell
+import os
+import logging
+import alphapept.io
+from typing import Callable, Union
+
+def cluster_hdf(to_process:tuple, callback:Callable = None, parallel:bool = False) -> Union[bool, str]:
+    """Wrapper function to cluster the MS2 spectra of the features of a file to be used by a parallel pool.
+    The position of the leader of each feature is stored as `cluster_idx` in the features.
+    If the fragments of the file were calibrated, the calibrated fragment masses and tolerance are used for the cosine similarity.
+
+    Args:
+        to_process (tuple): Tuple containing an index to the file and the experiment settings.
+        callback (Callable, optional): Placeholder for callback (unused).
+        parallel (bool, optional): Placeholder for parallel usage (unused).
+
+    Returns:
+        Union[bool, str]: Returns True if the clustering was successfull, otherwise returns a string containing the Exception.
+    """
+    try:
+        index, settings = to_process
+        file_name = settings['experiment']['file_paths'][index]
+        base_file_name, ext = os.path.splitext(file_name)
+        ms_file = base_file_name+".ms_data.hdf"
+
+        ms_file_ = alphapept.io.MS_Data_File(ms_file, is_overwritable=True)
+
+        frag_tol = settings['search']['frag_tol']
+        calibrated_fragments = False
+        try:
+            fragment_std = float(ms_file_.read(dataset_name="estimated_max_fragment_ppm")[0])
+            frag_tol = fragment_std*settings['search']['calibration_std']
+            calibrated_fragments = True
+            logging.info(f"Found calibrated frag_tol with value {frag_tol:.2f}")
+        except KeyError as e:
+            logging.info(f'{e}')
+
+        query_data = ms_file_.read_DDA_query_data(
+            calibrated_fragments=calibrated_fragments,
+            database_file_name=settings['experiment']['database_path']
+        )
+        features = ms_file_.read(dataset_name="features")
+
+        query_indices, query_frags, query_ints = get_query_spectra(query_data, features)
+
+        clusters = cluster_ms2(
+            features['mz_matched'].values,
+            features['rt_matched'].values,
+            features['charge_matched'].values,
+            query_indices,
+            query_frags,
+            query_ints,
+            settings['search']['cluster_mz_tol'],
+            settings['search']['cluster_rt_tol'],
+            settings['search']['cluster_min_cosine'],
+            frag_tol,
+            settings['search']['ppm']
+        )
+
+        ms_file_.write(clusters, dataset_name="cluster_idx", group_name="features")
+
+        n_clusters = len(np.unique(clusters))
+        logging.info(f'Clustered {len(clusters):,} features of file {file_name} into {n_clusters:,} clusters.')
+
+        return True
+    except Exception as e:
+        logging.error(f'Clustering of file {file_name} failed. Exception {e}.')
+        return f"{e}" #Can't return exception object, cast as string
+
+# Cell
+
+@njit
+def score_frags_shifted(query_frag:np.ndarray, query_int:np.ndarray, query_int_sum:float, db_frag:np.ndarray, frag_tol:float, ppm:bool, delta_mass:float)->(float, int):
+    """Count the number of hits plus the matched intensity fraction where database fragments can either match unshifted or shifted by delta_mass.
+
+    Args:
+        query_frag (np.ndarray): Array with query fragments.
+        query_int (np.ndarray): Array with query intensities.
+        query_int_sum (float): Summed query intensity.
+        db_frag (np.ndarray): Array with database fragments.
+        frag_tol (float): Fragment tolerance for search.
+        ppm (bool): Flag to use ppm instead of Dalton.
+        delta_mass (float): Mass difference between query and database precursor in Dalton.
+
+    Returns:
+        float: The score of the comparison.
+        int: The number of fragment comparisons.
+    """
+    q_max = len(query_frag)
+    d_max = len(db_frag)
+
+    query_matched = np.zeros(q_max, dtype=np.bool_)
+    db_matched = np.zeros(d_max, dtype=np.bool_)
+
+    hits = 0
+    n_comparisons = 0
+
+    for shift in np.array([0.0, delta_mass]):
+        q, d = 0, 0  # q > query, d > database
+        while q < q_max and d < d_max:
+            if query_matched[q]:
+                q += 1
+                continue
+            if db_matched[d]:
+                d += 1
+                continue
+
+            n_comparisons += 1
+            mass1 = query_frag[q]
+            mass2 = db_frag[d] + shift
+            delta_mass_ = mass1 - mass2
+
+            if ppm:
+                mass_difference = 2 * delta_mass_ / (mass1 + mass2) * 1e6
+            else:
+                mass_difference = delta_mass_
+
+            if abs(mass_difference) <= frag_tol:
+                hits += 1
+                hits += query_int[q]/query_int_sum
+                query_matched[q] = True
+                db_matched[d] = True
+                d += 1
+                q += 1
+            elif delta_mass_ < 0:
+                q += 1
+            else:
+                d += 1
+
+    return hits, n_comparisons
+
+
+@alphapept.performance.performance_function(compilation_mode="numba-multithread")
+def compare_spectrum_open_parallel(query_idx:int, query_masses:np.ndarray, db_masses:np.ndarray, idxs_lower:np.ndarray, idxs_higher:np.ndarray, query_indices:np.ndarray, query_frags:np.ndarray, query_ints:np.ndarray, db_indices:np.ndarray, db_frags:np.ndarray, frag_bin_indptr:np.ndarray, frag_bin_db_idx:np.ndarray, frag_bin_masses:np.ndarray, frag_bin_width:float, best_hits:np.ndarray, score:np.ndarray, frag_tol:float, ppm:bool, n_candidates:int, counters:np.ndarray, frag_types:np.ndarray, losses:np.ndarray, ion_stats:np.ndarray):
+    """Compares a spectrum against a wide precursor window and writes to the best_hits and score.
+    Candidates are prefiltered by their number of unshifted fragment matches in the fragment index and only the best n_candidates are scored with `score_frags_shifted`.
+
+    Args:
+        query_idx (int): Integer to the query_spectrum that should be compared.
+        query_masses (np.ndarray): Array with query masses.
+        db_masses (np.ndarray): Array with database masses.
+        idxs_lower (np.ndarray): Array with indices for lower search boundary.
+        idxs_higher (np.ndarray): Array with indices for upper search boundary.
+        query_indices (np.ndarray): Array with indices to the query data.
+        query_frags (np.ndarray): Array with frag types of the query data.
+        query_ints (np.ndarray): Array with fragment intensities from the query.
+        db_indices (np.ndarray):  Array with indices to the database data.
+        db_frags (np.ndarray): Array with frag types of the db data.
+        frag_bin_indptr (np.ndarray): Pointer array of the fragment index. See `get_fragment_index`.
+        frag_bin_db_idx (np.ndarray): Database indices of the fragment index. See `get_fragment_index`.
+        frag_bin_masses (np.ndarray): Fragment masses of the fragment index. See `get_fragment_index`.
+        frag_bin_width (float): Width of a fragment bin in Dalton.
+        best_hits (np.ndarray): Reporting array which stores indices to the best hits.
+        score (np.ndarray): Reporting array that stores the scores of the best hits.
+        frag_tol (float): Fragment tolerance for search.
+        ppm (bool): Flag to use ppm instead of Dalton.
+        n_candidates (int): Number of candidates from the prefilter that are scored.
+        counters (np.ndarray): Reporting array (n_queries x 3) that stores the number of candidates, compared candidates and fragment comparisons of each query. Use an empty array to skip counting.
+        frag_types (np.ndarray): Array with fragment types of the db data. Only used with ion_stats.
+        losses (np.ndarray): Array with the masses of the losses. Only used with ion_stats.
+        ion_stats (np.ndarray): Reporting array (n_queries x top_n x (3 + 2 * len(losses))) that stores the ion statistics of the best hits when they enter the top-n, see `get_ion_stats`. Use an empty array to skip recording.
+    """
+    idx_low = idxs_lower[query_idx]
+    idx_high = idxs_higher[query_idx]
+
+    if idx_high <= idx_low:
+        if len(counters) > 0:
+            counters[query_idx, 0] = 0
+        return
+
+    query_idx_start = query_indices[query_idx]
+    query_idx_end = query_indices[query_idx + 1]
+    query_frag = query_frags[query_idx_start:query_idx_end]
+    query_int = query_ints[query_idx_start:query_idx_end]
+
+    query_int_sum = 0
+    for qi in query_int:
+        query_int_sum += qi
+
+    max_bin = len(frag_bin_indptr) - 2
+    n_comparisons = 0
+
+    # The window can contain a large part of the database, so matches are collected sparsely
+    # in two passes instead of keeping one counter per candidate.
+    n_matches = 0
+    match_db_idx = np.zeros(0, dtype=np.int64)
+    match_peak = np.zeros(0, dtype=np.int64)
+
+    for fill in (False, True):
+        if fill:
+            match_db_idx = np.zeros(n_matches, dtype=np.int64)
+            match_peak = np.zeros(n_matches, dtype=np.int64)
+            n_matches = 0
+
+        for q in range(len(query_frag)):
+            mass1 = query_frag[q]
+            dalton_offset = get_frag_tol_dalton(mass1, frag_tol, ppm)
+
+            bin_lower = max(int((mass1 - dalton_offset) / frag_bin_width), 0)
+            bin_upper = min(int((mass1 + dalton_offset) / frag_bin_width), max_bin)
+
+            for frag_bin in range(bin_lower, bin_upper + 1):
+                bin_start = frag_bin_indptr[frag_bin]
+                bin_end = frag_bin_indptr[frag_bin + 1]
+                pos = bin_start + np.searchsorted(frag_bin_db_idx[bin_start:bin_end], idx_low)
+
+                while pos < bin_end:
+                    db_idx = frag_bin_db_idx[pos]
+                    if db_idx >= idx_high:
+                        break
+                    mass2 = frag_bin_masses[pos]
+                    delta_mass = mass1 - mass2
+                    if not fill:
+                        n_comparisons += 1
+
+                    if ppm:
+                        mass_difference = 2 * delta_mass / (mass1 + mass2) * 1e6
+                    else:
+                        mass_difference = delta_mass
+
+                    if abs(mass_difference) <= frag_tol:
+                        if fill:
+                            match_db_idx[n_matches] = db_idx
+                            match_peak[n_matches] = q
+                        n_matches += 1
+                    pos += 1
+
+    # Stable sorting keeps the query peaks ascending for each candidate
+    order = np.argsort(match_db_idx, kind='mergesort')
+
+    candidate_hits = np.zeros((1, n_candidates), dtype=np.int64) - 1
+    candidate_score = np.zeros((1, n_candidates), dtype=np.float64)
+    candidate_ion_stats = np.zeros((0, 0, 0), dtype=np.float64)
+
+    i = 0
+    while i < n_matches:
+        db_idx = match_db_idx[order[i]]
+        last_peak = -1
+        prefilter_score = 0.0
+        while (i < n_matches) and (match_db_idx[order[i]] == db_idx):
+            q = match_peak[order[i]]
+            if q != last_peak:
+                # Every query peak can be matched at most once per candidate
+                prefilter_score += 1 + query_int[q] / query_int_sum
+                last_peak = q
+            i += 1
+        add_to_top_n(0, db_idx, prefilter_score, candidate_hits, candidate_score, candidate_ion_stats)
+
+    n_compared = 0
+    for i in range(n_candidates):
+        db_idx = candidate_hits[0, i]
+        if db_idx < 0:
+            break
+
+        db_frag = db_frags[db_indices[db_idx]:db_indices[db_idx + 1]]
+        delta_mass = query_masses[query_idx] - db_masses[db_idx]
+        hits, n_comparisons_ = score_frags_shifted(query_frag, query_int, query_int_sum, db_frag, frag_tol, ppm, delta_mass)
+        n_compared += 1
+        n_comparisons += n_comparisons_
+
+        pos = add_to_top_n(query_idx, db_idx, hits, best_hits, score, ion_stats)
+        if (pos >= 0) and (len(ion_stats) > 0):
+            get_ion_stats(query_frag, query_int, db_frag, frag_types[db_indices[db_idx]:db_indices[db_idx + 1]], frag_tol, ppm, losses, ion_stats[query_idx, pos])
+
+    if len(counters) > 0:
+        counters[query_idx, 0] = idx_high - idx_low
+        counters[query_idx, 1] = n_compared
+        counters[query_idx, 2] = n_comparisons
+
+
+def get_delta_mass_histogram(delta_masses:np.ndarray, bin_width:float, max_delta:float)->pd.DataFrame:
+    """Histogram of the precursor mass differences of an open search.
+
+    Args:
+        delta_masses (np.ndarray): Mass differences between query and database precursor in Dalton.
+        bin_width (float): Width of a histogram bin in Dalton.
+        max_delta (float): Largest absolute mass difference of the histogram.
+
+    Returns:
+        pd.DataFrame: Center (delta_mass) and count of all bins that are not empty.
+    """
+    n_bins = int(np.ceil(max_delta / bin_width))
+    bin_edges = np.arange(-n_bins, n_bins + 1) * bin_width
+    counts, _ = np.histogram(delta_masses, bins=bin_edges)
+
+    non_empty = counts > 0
+    delta_mass = (bin_edges[:-1] + bin_width / 2)[non_empty]
+
+    return pd.DataFrame({'delta_mass': delta_mass, 'count': counts[non_empty]})
+
+# Cell
+@njit
+def frag_delta(query_frag:np.ndarray, db_frag:np.ndarray, hits:np.ndarray)-> (float, float):
+    """Calculates the mass difference for a given array of hits in Dalton and ppm.
+
+    Args:
+        query_frag (np.ndarray): Array with query fragments.
+        db_frag (np.ndarray): Array with database fragments.
+        hits (np.ndarray): Array with reported hits.
+
+    Returns:
+        float: Fragment deltas in Dalton.
+        float: Fragment deltas in ppm.
+    """
+    delta_m = db_frag[hits > 0] - query_frag[hits[hits > 0] - 1]
+    delta_m_ppm = (
+        2 * delta_m / (db_frag[hits > 0] + query_frag[hits[hits > 0] - 1]) * 1e6
+    )
+
+    return delta_m, delta_m_ppm
+
+# Cell
+@njit
+def intensity_fraction(query_int:np.ndarray, hits:np.ndarray)->float:
+    """Calculate the fraction of matched intensity
+
+    Args:
+        query_int (np.ndarray): Array with query intensities.
+        hits (np.ndarray): Array with reported hits.
+
+    Returns:
+        float: Fraction of the matched intensity to the total intensity.
+    """
+
+    total_intensity = np.sum(query_int)
+    if total_intensity != 0:
+        matched_intensity = np.sum(query_int[hits[hits > 0] - 1])
+        i_frac = matched_intensity / total_intensity
+    else:
+        i_frac = 0
+
+    return i_frac
+
+# Cell
+from numpy.lib.recfunctions import append_fields, drop_fields
+
+
+def add_column(recarray:np.ndarray, column:np.ndarray, name:str)->np.ndarray:
+    """Function to add a column with given name to recarray
+
+    Args:
+        recarray (np.ndarray): NumPy record array.
+        column (np.ndarray): Data column that should be added to the record array.
+        name (str): Name of the column in the new recordarray.
+
+    Returns:
+        np.ndarray: NumPy recordarray with new field.
+    """
+    if hasattr(recarray, name):
+        recarray = drop_fields(recarray, name, usemask=False, asrecarray=True)
+    recarray = append_fields(
+        recarray, name, column, dtypes=column.dtype, usemask=False, asrecarray=True
+    )
+    return recarray
 
 
 def remove_column(recarray:np.ndarray, name:str)->np.ndarray:
@@ -436,6 +1731,68 @@ def remove_column(recarray:np.ndarray, name:str)->np.ndarray:
         recarray = drop_fields(recarray, name, usemask=False, asrecarray=True)
     return recarray
 
+# Cell
+from typing import Union
+
+class PSMContainer():
+    """Columnar container for PSMs.
+    Every column is stored as a separate array, so that adding or removing a column does not copy the other columns.
+
+    Args:
+        psms (Union[np.ndarray, pd.DataFrame, dict], optional): Initial PSMs as record array, DataFrame or dictionary with arrays. Columns of a DataFrame are copied. Defaults to None.
+    """
+
+    def __init__(self, psms:Union[np.ndarray, pd.DataFrame, dict] = None):
+        self.columns = {}
+
+        if isinstance(psms, pd.DataFrame):
+            for name in psms.columns:
+                self[name] = psms[name].values.copy()
+        elif isinstance(psms, np.ndarray):
+            for name in psms.dtype.names:
+                self[name] = psms[name]
+        elif psms is not None:
+            for name in psms.keys():
+                self[name] = psms[name]
+
+    def __len__(self)->int:
+        if len(self.columns) == 0:
+            return 0
+        return len(next(iter(self.columns.values())))
+
+    def __contains__(self, name:str)->bool:
+        return name in self.columns
+
+    def __getitem__(self, name:str)->np.ndarray:
+        return self.columns[name]
+
+    def __setitem__(self, name:str, column:np.ndarray):
+        column = np.asarray(column)
+        if (len(self.columns) > 0) and (name not in self.columns) and (len(column) != len(self)):
+            raise ValueError(f"Column {name} has length {len(column)}, expected {len(self)}.")
+        self.columns[name] = column
+
+    def keys(self)->list:
+        """Names of the columns."""
+        return list(self.columns.keys())
+
+    def remove(self, name:str):
+        """Remove a column if it exists."""
+        self.columns.pop(name, None)
+
+    def to_records(self)->np.recarray:
+        """Create a record array with all columns."""
+        dtype = [(name, column.dtype) for name, column in self.columns.items()]
+        records = np.recarray(len(self), dtype=dtype)
+        for name, column in self.columns.items():
+            records[name] = column
+
+        return records
+
+    def to_df(self)->pd.DataFrame:
+        """Create a DataFrame with all columns."""
+        return pd.DataFrame(self.columns)
+
 # Cell
 from numba.typed import List
 @njit
@@ -454,60 +1811,286 @@ def get_hits(query_frag:np.ndarray, query_int:np.ndarray, db_frag:np.ndarray, db
     Column 7: Index to the database_frag of the ion.
 
     Args:
-        query_frag (np.ndarray): Array with query fragments.
-        query_int (np.ndarray): Array with query intensities.
-        db_frag (np.ndarray): Array with database fragments.
-        db_int (np.ndarray): Array with database intensities.
-        frag_type (np.ndarray): Array with fragment types.
+        query_frag (np.ndarray): Array with query fragments.
+        query_int (np.ndarray): Array with query intensities.
+        db_frag (np.ndarray): Array with database fragments.
+        db_int (np.ndarray): Array with database intensities.
+        frag_type (np.ndarray): Array with fragment types.
+        mtol (float): Mass tolerance.
+        ppm (bool): Flag to use ppm instead of Dalton.
+        losses (list): List of losses.
+
+    Returns:
+        np.ndarray: NumPy array that stores ion information.
+    """
+    max_array_size = len(db_frag)*len(losses)
+
+    ions = np.zeros((max_array_size, 8))
+
+    pointer = 0
+
+    query_range = np.arange(len(query_frag))
+    db_range = np.arange(len(db_frag))
+
+    for idx, off in enumerate(losses):
+        hits = compare_frags(query_frag, db_frag-off, mtol, ppm)
+        n_hits = np.sum(hits>0)
+
+        hitpos = hits[hits > 0] - 1
+        hit = hits > 0
+
+        ions[pointer:pointer+n_hits,0] = frag_type[hits>0] #type
+        ions[pointer:pointer+n_hits,1] = idx #ion-index
+
+        ions[pointer:pointer+n_hits,2] = query_int[hitpos] #query int
+        ions[pointer:pointer+n_hits,3] = db_int[hit] #db int
+
+        ions[pointer:pointer+n_hits,4] = query_frag[hitpos] #query mass
+        ions[pointer:pointer+n_hits,5] = db_frag[hit]-off # db mass
+
+        ions[pointer:pointer+n_hits,6] = query_range[hitpos] # index to query entry
+        ions[pointer:pointer+n_hits,7] = db_range[hit] # index to db entry
+
+        pointer += n_hits
+
+    ions = ions[:pointer,:]
+
+    return ions
+
+
+# Cell
+from alphapept import constants
+LOSS_DICT = constants.loss_dict
+LOSSES = np.array(list(LOSS_DICT.values()))
+
+@njit
+def count_hits(query_frag:np.ndarray, db_frag:np.ndarray, off:float, mtol:float, ppm:bool)->int:
+    """Count the hits of `compare_frags` for database fragments that are shifted by a loss.
+
+    Args:
+        query_frag (np.ndarray): Array with query fragments.
+        db_frag (np.ndarray): Array with database fragments.
+        off (float): Mass of the loss that is substracted from the database fragments.
+        mtol (float): Mass tolerance.
+        ppm (bool): Flag to use ppm instead of Dalton.
+
+    Returns:
+        int: Number of hits.
+    """
+    q_max = len(query_frag)
+    d_max = len(db_frag)
+    n_hits = 0
+    q, d = 0, 0
+    while q < q_max and d < d_max:
+        mass1 = query_frag[q]
+        mass2 = db_frag[d] - off
+        delta_mass = mass1 - mass2
+
+        if ppm:
+            sum_mass = mass1 + mass2
+            mass_difference = 2 * delta_mass / sum_mass * 1e6
+        else:
+            mass_difference = delta_mass
+
+        if abs(mass_difference) <= mtol:
+            n_hits += 1
+            d += 1
+            q += 1
+        elif delta_mass < 0:
+            q += 1
+        elif delta_mass > 0:
+            d += 1
+
+    return n_hits
+
+
+@njit
+def fill_hits(query_frag:np.ndarray, query_int:np.ndarray, db_frag:np.ndarray, db_int:np.ndarray, frag_type:np.ndarray, off:float, loss_idx:int, mtol:float, ppm:bool, ions:np.ndarray, pointer:int)->int:
+    """Write the hits of database fragments that are shifted by a loss to an ion array.
+    The rows are identical to the ones of `get_hits`.
+
+    Args:
+        query_frag (np.ndarray): Array with query fragments.
+        query_int (np.ndarray): Array with query intensities.
+        db_frag (np.ndarray): Array with database fragments.
+        db_int (np.ndarray): Array with database intensities. If empty, all database intensities are 1.
+        frag_type (np.ndarray): Array with fragment types.
+        off (float): Mass of the loss that is substracted from the database fragments.
+        loss_idx (int): Index of the loss.
+        mtol (float): Mass tolerance.
+        ppm (bool): Flag to use ppm instead of Dalton.
+        ions (np.ndarray): Array to store the ions.
+        pointer (int): First row of the ion array to write to.
+
+    Returns:
+        int: The row after the last written ion.
+    """
+    q_max = len(query_frag)
+    d_max = len(db_frag)
+    q, d = 0, 0
+    while q < q_max and d < d_max:
+        mass1 = query_frag[q]
+        mass2 = db_frag[d] - off
+        delta_mass = mass1 - mass2
+
+        if ppm:
+            sum_mass = mass1 + mass2
+            mass_difference = 2 * delta_mass / sum_mass * 1e6
+        else:
+            mass_difference = delta_mass
+
+        if abs(mass_difference) <= mtol:
+            ions[pointer, 0] = frag_type[d]
+            ions[pointer, 1] = loss_idx
+            ions[pointer, 2] = query_int[q]
+            ions[pointer, 3] = db_int[d] if len(db_int) > 0 else 1.0
+            ions[pointer, 4] = query_frag[q]
+            ions[pointer, 5] = mass2
+            ions[pointer, 6] = q
+            ions[pointer, 7] = d
+            pointer += 1
+            d += 1
+            q += 1
+        elif delta_mass < 0:
+            q += 1
+        elif delta_mass > 0:
+            d += 1
+
+    return pointer
+
+
+@alphapept.performance.performance_function(compilation_mode="numba-multithread")
+def count_ions(i:int, psms_query_idx:np.ndarray, psms_db_idx:np.ndarray, query_frags:np.ndarray, query_indices:np.ndarray, db_frags:np.ndarray, db_indices:np.ndarray, mtol:float, ppm:bool, losses:np.ndarray, n_ions:np.ndarray):
+    """Count the ions of a PSM. First pass of `score`.
+
+    Args:
+        i (int): Index of the PSM.
+        psms_query_idx (np.ndarray): query_idx of the PSMs.
+        psms_db_idx (np.ndarray): db_idx of the PSMs.
+        query_frags (np.ndarray): Array with query fragments.
+        query_indices (np.ndarray): Array with indices to the query data.
+        db_frags (np.ndarray): Array with database fragments.
+        db_indices (np.ndarray): Array with indices to the database array.
         mtol (float): Mass tolerance.
         ppm (bool): Flag to use ppm instead of Dalton.
-        losses (list): List of losses.
-
-    Returns:
-        np.ndarray: NumPy array that stores ion information.
+        losses (np.ndarray): Array with the masses of the losses.
+        n_ions (np.ndarray): Array to store the number of ions per PSM.
     """
-    max_array_size = len(db_frag)*len(losses)
-
-    ions = np.zeros((max_array_size, 8))
+    query_idx = psms_query_idx[i]
+    db_idx = psms_db_idx[i]
+    query_frag = query_frags[query_indices[query_idx]:query_indices[query_idx + 1]]
+    db_frag = db_frags[db_indices[db_idx]:db_indices[db_idx+1]]
 
-    pointer = 0
+    n = 0
+    for off in losses:
+        n += count_hits(query_frag, db_frag, off, mtol, ppm)
 
-    query_range = np.arange(len(query_frag))
-    db_range = np.arange(len(db_frag))
+    n_ions[i] = n
 
-    for idx, off in enumerate(losses):
-        hits = compare_frags(query_frag, db_frag-off, mtol, ppm)
-        n_hits = np.sum(hits>0)
 
-        hitpos = hits[hits > 0] - 1
-        hit = hits > 0
+@alphapept.performance.performance_function(compilation_mode="numba-multithread")
+def fill_score_columns(i:int, psms_query_idx:np.ndarray, psms_db_idx:np.ndarray, query_masses:np.ndarray, query_masses_raw:np.ndarray, query_frags:np.ndarray, query_ints:np.ndarray, query_indices:np.ndarray, db_masses:np.ndarray, db_frags:np.ndarray, frag_types:np.ndarray, db_ints:np.ndarray, db_indices:np.ndarray, mtol:float, ppm:bool, losses:np.ndarray, ion_stats:np.ndarray, ion_idx:np.ndarray, ions:np.ndarray, float_values:np.ndarray, int_values:np.ndarray):
+    """Write the ions and score columns of a PSM. Second pass of `score`.
 
-        ions[pointer:pointer+n_hits,0] = frag_type[hits>0] #type
-        ions[pointer:pointer+n_hits,1] = idx #ion-index
+    The columns of float_values are: prec_offset, prec_offset_ppm, prec_offset_raw, prec_offset_raw_ppm, delta_m, delta_m_ppm, matched_int_ratio, int_ratio.
+    The columns of int_values are: total_int, matched_int, n_ions, ion_idx and the b and y hits for each loss.
 
-        ions[pointer:pointer+n_hits,2] = query_int[hitpos] #query int
-        ions[pointer:pointer+n_hits,3] = db_int[hit] #db int
+    Args:
+        i (int): Index of the PSM.
+        psms_query_idx (np.ndarray): query_idx of the PSMs.
+        psms_db_idx (np.ndarray): db_idx of the PSMs.
+        query_masses (np.ndarray): Array with query masses.
+        query_masses_raw (np.ndarray): Array with raw query masses.
+        query_frags (np.ndarray): Array with query fragments.
+        query_ints (np.ndarray): Array with fragment intensities from the query.
+        query_indices (np.ndarray): Array with indices to the query data.
+        db_masses (np.ndarray): Array with database masses.
+        db_frags (np.ndarray): Array with database fragments.
+        frag_types (np.ndarray): Array with fragment types.
+        db_ints (np.ndarray): Array with database intensities. If empty, all database intensities are 1.
+        db_indices (np.ndarray): Array with indices to the database array.
+        mtol (float): Mass tolerance.
+        ppm (bool): Flag to use ppm instead of Dalton.
+        losses (np.ndarray): Array with the masses of the losses.
+        ion_stats (np.ndarray): 2D array with the ion statistics of the PSMs that were recorded during the search, see `get_ion_stats`. If empty, the statistics are computed from the ions.
+        ion_idx (np.ndarray): First row of the ions of each PSM.
+        ions (np.ndarray): Array to store the ions.
+        float_values (np.ndarray): 2D float32 array to store the float score columns.
+        int_values (np.ndarray): 2D int64 array to store the integer score columns.
+    """
+    query_idx = psms_query_idx[i]
+    db_idx = psms_db_idx[i]
+    query_idx_start = query_indices[query_idx]
+    query_idx_end = query_indices[query_idx + 1]
+    query_frag = query_frags[query_idx_start:query_idx_end]
+    query_int = query_ints[query_idx_start:query_idx_end]
+    db_frag = db_frags[db_indices[db_idx]:db_indices[db_idx+1]]
+    frag_type = frag_types[db_indices[db_idx]:db_indices[db_idx+1]]
 
-        ions[pointer:pointer+n_hits,4] = query_frag[hitpos] #query mass
-        ions[pointer:pointer+n_hits,5] = db_frag[hit]-off # db mass
+    if len(db_ints) > 0:
+        db_int = db_ints[db_indices[db_idx]:db_indices[db_idx+1]]
+    else:
+        db_int = db_ints
 
-        ions[pointer:pointer+n_hits,6] = query_range[hitpos] # index to query entry
-        ions[pointer:pointer+n_hits,7] = db_range[hit] # index to db entry
+    start = ion_idx[i]
+    end = start
+    for loss_idx in range(len(losses)):
+        end = fill_hits(query_frag, query_int, db_frag, db_int, frag_type, losses[loss_idx], loss_idx, mtol, ppm, ions, end)
 
-        pointer += n_hits
+    n_ions = end - start
 
-    ions = ions[:pointer,:]
+    float_values[i, 0] = query_masses[query_idx] - db_masses[db_idx]
+    float_values[i, 1] = 2 * float_values[i, 0] / (query_masses[query_idx]  + db_masses[db_idx] ) * 1e6
 
-    return ions
+    float_values[i, 2] = query_masses_raw[query_idx] - db_masses[db_idx]
+    float_values[i, 3] = 2 * float_values[i, 0] / (query_masses_raw[query_idx]  + db_masses[db_idx] ) * 1e6
 
+    if len(ion_stats) > 0:
+        delta_m = ion_stats[i, 2]
+    else:
+        delta_m = 0.0
+        for j in range(start, end):
+            delta_m += ions[j, 4] - ions[j, 5]
+    float_values[i, 4] = delta_m / n_ions if n_ions > 0 else np.nan
+
+    delta_m_ppm = 0.0
+    for j in range(start, end):
+        delta_m_ppm += 2 * float_values[i, 4] / (ions[j, 4]  + ions[j, 5] ) * 1e6
+    float_values[i, 5] = delta_m_ppm / n_ions if n_ions > 0 else np.nan
+
+    int_ratio = 0.0
+    for j in range(start, end):
+        int_ratio += ions[j, 2] / ions[j, 3] #3 is db_int, 2 is query_int
+
+    if len(ion_stats) > 0:
+        matched_int = ion_stats[i, 1]
+    else:
+        matched_int = 0.0
+        for j in range(start, end):
+            matched_int += ions[j, 2]
+
+    int_values[i, 0] = np.sum(query_int)
+    int_values[i, 1] = matched_int
+    float_values[i, 6] = int_values[i, 1] / int_values[i, 0]
+    float_values[i, 7] = int_ratio / n_ions if n_ions > 0 else np.nan
+
+    int_values[i, 2] = n_ions
+    int_values[i, 3] = start
+
+    if len(ion_stats) > 0:
+        for loss_idx in range(len(losses)):
+            int_values[i, 4 + 2 * loss_idx] = ion_stats[i, 3 + 2 * loss_idx]
+            int_values[i, 5 + 2 * loss_idx] = ion_stats[i, 4 + 2 * loss_idx]
+    else:
+        for j in range(start, end):
+            loss_idx = int(ions[j, 1])
+            if ions[j, 0] > 0:
+                int_values[i, 4 + 2 * loss_idx] += 1
+            elif ions[j, 0] < 0:
+                int_values[i, 5 + 2 * loss_idx] += 1
 
-# Cell
-from alphapept import constants
-LOSS_DICT = constants.loss_dict
-LOSSES = np.array(list(LOSS_DICT.values()))
 
 #This function is a wrapper and ist tested by the quick_test
-@njit
 def score(
     psms: np.recarray,
     query_masses: np.ndarray,
@@ -523,9 +2106,12 @@ def score(
     ppm: bool,
     psms_dtype: list,
     db_ints: np.ndarray = None,
-    parallel: bool = False
+    parallel: bool = False,
+    ion_stats: np.ndarray = None
 ) -> (np.ndarray, np.ndarray):
     """Function to extract score columns when giving a recordarray with PSMs.
+    The ions of all PSMs are counted first, so that they can be written in parallel to a single preallocated array.
+    If the ion statistics were recorded during the search, the ions are not counted again and only the ion array is filled.
 
     Args:
         psms (np.recarray): Recordarray containing PSMs.
@@ -541,69 +2127,51 @@ def score(
         db_indices (np.ndarray): Array with indices to the database array.
         ppm (bool): Flag to use ppm instead of Dalton.
         psms_dtype (list): List describing the dtype of the PSMs record array.
+            The float fields need to be followed by the int fields in the order of the columns of `fill_score_columns`.
         db_ints (np.ndarray, optional): Array with database intensities. Defaults to None.
         parallel (bool, optional): Flag to use parallel processing. Defaults to False.
+        ion_stats (np.ndarray, optional): 2D array with the ion statistics of the PSMs as recorded by `get_ion_stats` with `fused_search` in `get_psms`. Defaults to None.
 
     Returns:
         np.recarray: Recordarray containing PSMs with additional columns.
         np.ndarray: NumPy array containing ion information.
     """
+    n_psms = len(psms)
+    psms_query_idx = psms["query_idx"]
+    psms_db_idx = psms["db_idx"]
+
+    if ion_stats is None:
+        n_ions = np.zeros(n_psms, dtype=np.int64)
+        count_ions(range(n_psms), psms_query_idx, psms_db_idx, query_frags, query_indices, db_frags, db_indices, mtol, ppm, LOSSES, n_ions)
+        ion_stats = np.zeros((0, 0), dtype=np.float64)
+    else:
+        n_ions = ion_stats[:, 0].astype(np.int64)
 
-    psms_ = np.zeros(len(psms), dtype=psms_dtype)
-
-    ions_ = List()
-
-    ion_count = 0
-
-    for i in range(len(psms)):
-        query_idx = psms[i]["query_idx"]
-        db_idx = psms[i]["db_idx"]
-        query_idx_start = query_indices[query_idx]
-        query_idx_end = query_indices[query_idx + 1]
-        query_frag = query_frags[query_idx_start:query_idx_end]
-        query_int = query_ints[query_idx_start:query_idx_end]
-        db_frag = db_frags[db_indices[db_idx]:db_indices[db_idx+1]]
-        frag_type = frag_types[db_indices[db_idx]:db_indices[db_idx+1]]
-
-        if db_ints is None:
-            db_int = np.ones(len(db_frag))
-        else:
-            db_int = db_ints[i]
-
-        ions = get_hits(query_frag, query_int, db_frag, db_int, frag_type, mtol, ppm, LOSSES)
-
-        psms_['prec_offset'][i] = query_masses[query_idx] - db_masses[db_idx]
-        psms_['prec_offset_ppm'][i] = 2 * psms_['prec_offset'][i] / (query_masses[query_idx]  + db_masses[db_idx] ) * 1e6
-
-        psms_['prec_offset_raw '][i] = query_masses_raw[query_idx] - db_masses[db_idx]
-        psms_['prec_offset_raw_ppm '][i] = 2 * psms_['prec_offset'][i] / (query_masses_raw[query_idx]  + db_masses[db_idx] ) * 1e6
-
-        psms_['delta_m'][i] = np.mean(ions[:,4]-ions[:,5])
-        psms_['delta_m_ppm'][i] = np.mean(2 * psms_['delta_m'][i] / (ions[:,4]  + ions[:,5] ) * 1e6)
+    ion_idx = np.zeros(n_psms, dtype=np.int64)
+    ion_idx[1:] = np.cumsum(n_ions)[:-1]
 
-        psms_['total_int'][i] = np.sum(query_int)
-        psms_['matched_int'][i] = np.sum(ions[:,2])
-        psms_['matched_int_ratio'][i] = psms_['matched_int'][i] / psms_['total_int'][i]
-        psms_['int_ratio'][i] = np.mean(ions[:,2]/ions[:,3]) #3 is db_int, 2 is query_int
+    ions = np.zeros((np.sum(n_ions), 8))
 
-        psms_['b_hits'][i] = np.sum(ions[ions[:,1]==0][:,0]>0)
-        psms_['y_hits'][i] = np.sum(ions[ions[:,1]==0][:,0]<0)
+    psms_dtype = np.dtype(psms_dtype)
+    float_fields = [_ for _ in psms_dtype.names if psms_dtype[_] == np.float32]
+    int_fields = [_ for _ in psms_dtype.names if psms_dtype[_] == np.int64]
 
-        psms_['b-H2O_hits'][i] = np.sum(ions[ions[:,1]==1][:,0]>0)
-        psms_['y-H2O_hits'][i] = np.sum(ions[ions[:,1]==1][:,0]<0)
+    float_values = np.zeros((n_psms, len(float_fields)), dtype=np.float32)
+    int_values = np.zeros((n_psms, len(int_fields)), dtype=np.int64)
 
-        psms_['b-NH3_hits'][i] = np.sum(ions[ions[:,1]==2][:,0]>0)
-        psms_['y-NH3_hits'][i] = np.sum(ions[ions[:,1]==2][:,0]<0)
+    if db_ints is None:
+        db_ints = np.zeros(0)
 
-        n_ions = len(ions)
+    fill_score_columns(range(n_psms), psms_query_idx, psms_db_idx, query_masses, query_masses_raw, query_frags, query_ints, query_indices, db_masses, db_frags, frag_types, db_ints, db_indices, mtol, ppm, LOSSES, ion_stats, ion_idx, ions, float_values, int_values)
 
-        psms_['n_ions'][i] = n_ions
-        psms_['ion_idx'][i] = ion_count
+    psms_ = np.zeros(n_psms, dtype=psms_dtype)
+    for idx, _ in enumerate(float_fields):
+        psms_[_] = float_values[:, idx]
+    for idx, _ in enumerate(int_fields):
+        psms_[_] = int_values[:, idx]
 
-        ion_count += n_ions
-        ions_.append(ions)
+    return psms_, ions
 
-    return psms_, ions_
 
 # Cell
 
@@ -637,12 +2205,13 @@ def get_score_columns(
     ppm:bool,
     prec_tol_calibrated:Union[None, float]=None,
     frag_tol_calibrated:float = None,
+    query_spectra:tuple = None,
     **kwargs
-) -> (np.ndarray, np.ndarray):
+) -> (PSMContainer, np.ndarray):
     """Wrapper function to extract score columns.
 
     Args:
-        psms (np.recarray): Recordarray containing PSMs.
+        psms (np.recarray): Recordarray containing PSMs. If it has the field ion_stats from `get_psms` with `fused_search`, the ions are not counted again.
         query_data (dict): Data structure containing the query data.
         db_data: Union[dict, str]: Data structure containing the database data or path to database.
         features (pd.DataFrame): Pandas dataframe containing feature data.
@@ -652,16 +2221,17 @@ def get_score_columns(
         ppm (bool): Flag to use ppm instead of Dalton.
         prec_tol_calibrated (Union[None, float], optional): Calibrated offset mass. Defaults to None.
         frag_tol_calibrated (float, optional): Fragment tolerance if calibration exists. Defaults to None.
+        query_spectra (tuple, optional): The spectra of the features as returned by `get_query_spectra`. If None, they are extracted from the query data. Defaults to None.
 
     Returns:
-        np.recarray: Recordarray containing PSMs with additional columns.
+        PSMContainer: Container with the PSMs and additional columns.
         np.ndarray: NumPy array containing ion information.
     """
     logging.info('Extracting columns for scoring.')
-    query_indices = query_data["indices_ms2"]
+    if query_spectra is None:
+        query_spectra = get_query_spectra(query_data, features)
+    query_indices, query_frags, query_ints = query_spectra
     query_charges = query_data['charge2']
-    query_frags = query_data['mass_list_ms2']
-    query_ints = query_data['int_list_ms2']
     query_scans = query_data['scan_list_ms2']
 
     if frag_tol_calibrated:
@@ -710,26 +2280,6 @@ def get_score_columns(
 
         if bruker:
             query_prec_id = query_prec_id[features['query_idx'].values]
-
-        query_selection = features['query_idx'].values
-        indices = np.zeros(len(query_selection) + 1, np.int64)
-        indices[1:] = np.diff(query_indices)[query_selection]
-        indices = np.cumsum(indices)
-        query_frags = np.concatenate(
-            [
-                query_frags[s: e] for s, e in zip(
-                    query_indices[query_selection], query_indices[query_selection + 1]
-                )
-            ]
-        )
-        query_ints = np.concatenate(
-            [
-                query_ints[s: e] for s, e in zip(
-                    query_indices[query_selection], query_indices[query_selection + 1]
-                )
-            ]
-        )
-        query_indices = indices
     else:
         #TODO: This code is outdated, callin with features = None will crash.
         query_masses = query_data['prec_mass_list2']
@@ -742,7 +2292,12 @@ def get_score_columns(
 
     psms_dtype = np.dtype([(_,np.float32) for _ in float_fields] + [(_,np.int64) for _ in int_fields])
 
-    psms_, ions,  = score(
+    if 'ion_stats' in psms.dtype.names:
+        ion_stats = np.ascontiguousarray(psms['ion_stats'])
+    else:
+        ion_stats = None
+
+    psms_, ions_ = score(
         psms,
         query_masses,
         query_masses_raw,
@@ -755,15 +2310,17 @@ def get_score_columns(
         frag_tol,
         db_indices,
         ppm,
-        psms_dtype)
+        psms_dtype,
+        ion_stats=ion_stats)
 
-    ions_ = np.vstack(ions)
+    psms = PSMContainer(psms)
+    psms.remove('ion_stats')
 
     for _ in psms_.dtype.names:
-        psms = add_column(psms, psms_[_], _)
+        psms[_] = psms_[_]
 
     rts = np.array(query_rt)[psms["query_idx"]]
-    psms = add_column(psms, rts, 'rt')
+    psms['rt'] = rts
 
     if isinstance(db_data, str):
         db_seqs = read_database(db_data, array_name = 'seqs').astype(str)
@@ -774,33 +2331,33 @@ def get_score_columns(
 
     del db_seqs
 
-    psms = add_column(psms, seqs, "sequence")
+    psms['sequence'] = seqs
 
     mass = np.array(query_masses)[psms["query_idx"]]
     mz = np.array(query_mz)[psms["query_idx"]]
     charge = np.array(query_charges)[psms["query_idx"]]
 
-    psms = add_column(psms, mass, "mass")
-    psms = add_column(psms, mz, "mz")
-    psms = add_column(psms, charge, "charge")
+    psms['mass'] = mass
+    psms['mz'] = mz
+    psms['charge'] = charge
 
-    psms = add_column(psms, np.char.add(np.char.add(psms['sequence'],"_"), psms['charge'].astype(int).astype(str)), 'precursor')
+    psms['precursor'] = np.char.add(np.char.add(psms['sequence'],"_"), psms['charge'].astype(int).astype(str))
 
     if features is not None:
-        psms = add_column(psms, features.loc[psms['query_idx']]['feature_idx'].values, 'feature_idx')
-        psms = add_column(psms, features.loc[psms['query_idx']]['query_idx'].values, 'raw_idx')
+        psms['feature_idx'] = features.loc[psms['query_idx']]['feature_idx'].values
+        psms['raw_idx'] = features.loc[psms['query_idx']]['query_idx'].values
 
         for key in ['int_sum','int_apex','rt_start','rt_apex','rt_end','fwhm','dist','mobility']:
             if key in features.keys():
-                psms = add_column(psms, features.loc[psms['query_idx']][key].values, key)
+                psms[key] = features.loc[psms['query_idx']][key].values
 
     scan_no = np.array(query_scans)[psms["query_idx"]]
     if bruker:
-        psms = add_column(psms, scan_no, "parent")
-        psms = add_column(psms, np.array(query_prec_id)[psms["query_idx"]], 'precursor_idx')
-        psms = add_column(psms, psms['feature_idx']+1, 'feature_id') #Bruker
+        psms['parent'] = scan_no
+        psms['precursor_idx'] = np.array(query_prec_id)[psms["query_idx"]]
+        psms['feature_id'] = psms['feature_idx']+1 #Bruker
     else:
-        psms = add_column(psms, scan_no, "scan_no")
+        psms['scan_no'] = scan_no
 
     logging.info(f'Extracted columns from {len(psms):,} spectra.')
 
@@ -865,6 +2422,92 @@ def plot_psms(index, ms_file):
     plt.title(figure_title)
     plt.show()
 
+# Cell
+import alphapept.performance
+from typing import Tuple
+
+SHARED_DATABASE_ARRAYS = ['precursors', 'fragmasses', 'indices', 'fragtypes', 'seqs']
+
+def load_database(database_path:str, fragment_index:bool = False) -> dict:
+    """Load the arrays of a database that are needed for searching and scoring into memory.
+
+    Args:
+        database_path (str): Path to the database file.
+        fragment_index (bool, optional): Flag to also load the fragment index if the database contains a search index. Only needed to search with `fragment_index` or `open_search`. Defaults to False.
+
+    Returns:
+        dict: Database data that can be passed to `get_psms` and `get_score_columns`.
+    """
+    db_data = {}
+    for array_name in SHARED_DATABASE_ARRAYS:
+        db_data[array_name] = read_database(database_path, array_name = array_name)
+
+    db_data['seqs'] = db_data['seqs'].astype(str)
+
+    try:
+        db_data['db_ints'] = read_database(database_path, array_name = 'db_ints')
+    except KeyError:
+        pass
+
+    search_index = read_search_index(database_path, fragment_index = fragment_index)
+    if search_index is not None:
+        db_data['search_index'] = search_index
+
+    return db_data
+
+
+def share_database(database_path:str, fragment_index:bool = False) -> Tuple[dict, list]:
+    """Load the arrays of a database that are needed for searching into shared memory.
+
+    Args:
+        database_path (str): Path to the database file.
+        fragment_index (bool, optional): Flag to also share the fragment index, see `load_database`. Defaults to False.
+
+    Returns:
+        dict: Description of the shared database that can be passed to `attach_database`.
+        list: The SharedMemory objects. These need to be released by the calling process with `alphapept.performance.release_shared_arrays(handles, unlink=True)`.
+    """
+    arrays = load_database(database_path, fragment_index = fragment_index)
+
+    search_index = arrays.pop('search_index', None)
+    bin_widths = None
+    if search_index is not None:
+        bin_widths = {}
+        for key, value in search_index.items():
+            if isinstance(value, np.ndarray):
+                arrays['search_index/'+key] = value
+            else:
+                bin_widths[key] = value
+
+    shared_info, handles = alphapept.performance.create_shared_arrays(arrays)
+    shared_db = {'arrays': shared_info, 'search_index': bin_widths}
+
+    return shared_db, handles
+
+
+def attach_database(shared_db:dict) -> Tuple[dict, list]:
+    """Attach to a database that was loaded into shared memory with `share_database`.
+
+    Args:
+        shared_db (dict): Description of the shared database.
+
+    Returns:
+        dict: Database data that can be passed to `get_psms` and `get_score_columns`.
+        list: The SharedMemory objects. These need to be released with `alphapept.performance.release_shared_arrays` after all arrays were deleted.
+    """
+    arrays, handles = alphapept.performance.attach_shared_arrays(shared_db['arrays'])
+
+    db_data = {key: value for key, value in arrays.items() if not key.startswith('search_index/')}
+
+    if shared_db['search_index'] is not None:
+        search_index = dict(shared_db['search_index'])
+        for key, value in arrays.items():
+            if key.startswith('search_index/'):
+                search_index[key[len('search_index/'):]] = value
+        db_data['search_index'] = search_index
+
+    return db_data, handles
+
 # Cell
 import os
 import pandas as pd
@@ -874,16 +2517,19 @@ import alphapept.fasta
 from typing import Callable
 
 #This function is a wrapper and ist tested by the quick_test
-def store_hdf(df: pd.DataFrame, path: str, key:str, replace:bool=False, swmr:bool = False):
+def store_hdf(df: Union[pd.DataFrame, PSMContainer], path: str, key:str, replace:bool=False, swmr:bool = False):
     """Wrapper function to store a DataFrame in an hdf.
 
     Args:
-        df (pd.DataFrame): DataFrame to be stored.
+        df (Union[pd.DataFrame, PSMContainer]): DataFrame or PSMContainer to be stored.
         path (str): Target path of the hdf file.
         key (str): Name of the field to be saved.
         replace (bool, optional): Flag whether the field should be replaced.. Defaults to False.
         swmr (bool, optional): Flag to use swmr(single write multiple read)-mode. Defaults to False.
     """
+    if isinstance(df, PSMContainer):
+        df = df.to_df()
+
     ms_file = alphapept.io.MS_Data_File(path.file_name, is_overwritable=True)
 
     if replace:
@@ -900,8 +2546,21 @@ def store_hdf(df: pd.DataFrame, path: str, key:str, replace:bool=False, swmr:boo
             except KeyError: # File is created new
                 ms_file.write(df, dataset_name=key, swmr = swmr)
 
+def write_search_stats(search_stats:dict, path:str, key:str):
+    """Write search statistics as attributes of a stored DataFrame in an hdf.
+
+    Args:
+        search_stats (dict): Search statistics as returned by `get_search_stats`.
+        path (str): Target path of the hdf file.
+        key (str): Name of the field with the PSMs, e.g. first_search.
+    """
+    ms_file = alphapept.io.MS_Data_File(path.file_name, is_overwritable=True)
+
+    for name, value in search_stats.items():
+        ms_file.write(value, group_name=key, attr_name=name)
+
 #This function is a wrapper and ist tested by the quick_test
-def search_db(to_process:tuple, callback:Callable = None, parallel:bool=False, first_search:bool = True) -> Union[bool, str]:
+def search_db(to_process:tuple, callback:Callable = None, parallel:bool=False, first_search:bool = True, shared_db:dict = None) -> Union[bool, str]:
     """Wrapper function to perform database search to be used by a parallel pool.
 
     Args:
@@ -909,10 +2568,12 @@ def search_db(to_process:tuple, callback:Callable = None, parallel:bool=False, f
         callback (Callable, optional): Callback function to indicate progress. Defaults to None.
         parallel (bool, optional): Flag to use parallel processing. Defaults to False.
         first_search (bool, optional): Flag to indicate this is the first search. Defaults to True.
+        shared_db (dict, optional): Description of a database in shared memory as returned by `share_database`. If None, the database is read from the database_path in the settings, either once with `load_database` if `preload_database` or `fused_search` is set or separately for searching and scoring. Defaults to None.
 
     Returns:
         Union[bool, str]: Returns True if the search was successfull, otherwise returns a string containing the Exception.
     """
+    shm_handles = []
 
     try:
         index, settings = to_process
@@ -950,7 +2611,12 @@ def search_db(to_process:tuple, callback:Callable = None, parallel:bool=False, f
                 logging.info(f'{e}')
 
         if not skip:
-            db_data_path = settings['experiment']['database_path']
+            if shared_db is not None:
+                db_data, shm_handles = attach_database(shared_db)
+            elif settings['search']['preload_database'] or settings['search']['fused_search']:
+                db_data = load_database(settings['experiment']['database_path'], fragment_index = settings['search']['fragment_index'] or settings['search']['open_search'])
+            else:
+                db_data = settings['experiment']['database_path']
 
     #         TODO calibrated_fragments should be included in settings
             query_data = ms_file_.read_DDA_query_data(
@@ -960,9 +2626,11 @@ def search_db(to_process:tuple, callback:Callable = None, parallel:bool=False, f
 
             features = ms_file_.read(dataset_name="features")
 
-            psms, num_specs_compared = get_psms(query_data, db_data_path, features, **settings["search"])
+            query_spectra = get_query_spectra(query_data, features)
+
+            psms, search_stats = get_psms(query_data, db_data, features, query_spectra=query_spectra, frag_bin_width=settings["fasta"]["frag_bin_width"], **settings["search"])
             if len(psms) > 0:
-                psms, ions = get_score_columns(psms, query_data, db_data_path, features, **settings["search"])
+                psms, ions = get_score_columns(psms, query_data, db_data, features, query_spectra=query_spectra, **settings["search"])
 
                 if first_search:
                     logging.info('Saving first_search results to {}'.format(ms_file))
@@ -971,9 +2639,17 @@ def search_db(to_process:tuple, callback:Callable = None, parallel:bool=False, f
                     logging.info('Saving second_search results to {}'.format(ms_file))
                     save_field = 'second_search'
 
-                store_hdf(pd.DataFrame(psms), ms_file_, save_field, replace=True)
+                store_hdf(psms, ms_file_, save_field, replace=True)
+                if search_stats is not None:
+                    write_search_stats(search_stats, ms_file_, save_field)
                 ion_columns = ['ion_index','ion_type','ion_int','db_int','ion_mass','db_mass','query_idx','db_idx']
                 store_hdf(pd.DataFrame(ions, columns = ion_columns), ms_file_, 'ions', replace=True)
+
+                if settings['search']['open_search']:
+                    best_psms = psms.to_df().sort_values('hits', ascending=False).drop_duplicates('query_idx')
+                    delta_mass_histogram = get_delta_mass_histogram(best_psms['prec_offset'].values, settings['search']['open_search_delta_bin'], settings['search']['open_search_prec_tol'])
+                    store_hdf(delta_mass_histogram, ms_file_, save_field+'_delta_masses', replace=True)
+                    logging.info(f'Saved delta mass histogram of {len(best_psms):,} queries to {save_field}_delta_masses.')
             else:
                 logging.info('No psms found.')
 
@@ -982,6 +2658,81 @@ def search_db(to_process:tuple, callback:Callable = None, parallel:bool=False, f
     except Exception as e:
         logging.error(f'Search of file {file_name} failed. Exception {e}.')
         return f"{e}" #Can't return exception object, cast as string
+    finally:
+        # Released after the exception was handled, the traceback would keep views of the shared arrays alive
+        db_data = None
+        alphapept.performance.release_shared_arrays(shm_handles)
+
+# Cell
+from collections import OrderedDict
+
+QUERY_DATA_CACHE = OrderedDict()
+QUERY_DATA_CACHE_MAX_MEMORY = 4.0
+
+def init_query_data_cache(ms_files:list = None, max_memory:float = 4.0):
+    """Reset the query data cache of this process and load the query data of the given files.
+    Intended to be used as initializer for a process pool.
+
+    Args:
+        ms_files (list, optional): List with paths to ms_data files that are loaded into the cache. Defaults to None.
+        max_memory (float, optional): Maximum memory of the cache in GB. Defaults to 4.0.
+    """
+    global QUERY_DATA_CACHE_MAX_MEMORY
+
+    QUERY_DATA_CACHE.clear()
+    QUERY_DATA_CACHE_MAX_MEMORY = max_memory
+
+    if ms_files is not None:
+        for ms_file in ms_files:
+            get_query_data(ms_file)
+
+
+def get_query_data(ms_file:str) -> (dict, pd.DataFrame, tuple):
+    """Get the query data, features and spectra of the features of a ms_data file from the cache of this process.
+    Files that are not cached yet are read and added to the cache.
+    If the cache exceeds QUERY_DATA_CACHE_MAX_MEMORY, the least recently used files are removed.
+    The returned data is shared with the cache and should not be modified.
+
+    Args:
+        ms_file (str): Path to the ms_data file.
+
+    Returns:
+        dict: The query data.
+        pd.DataFrame: The features. None if the file has no features.
+        tuple: The spectra of the features as returned by `get_query_spectra`.
+    """
+    if ms_file in QUERY_DATA_CACHE:
+        QUERY_DATA_CACHE.move_to_end(ms_file)
+        query_data, features, query_spectra, _ = QUERY_DATA_CACHE[ms_file]
+        return query_data, features, query_spectra
+
+    query_data = alphapept.io.MS_Data_File(
+        f"{ms_file}"
+    ).read_DDA_query_data(swmr=True)
+
+    try:
+        features = alphapept.io.MS_Data_File(
+            ms_file
+        ).read(dataset_name="features",swmr=True)
+    except FileNotFoundError:
+        features = None
+    except KeyError:
+        features = None
+
+    query_spectra = get_query_spectra(query_data, features)
+
+    memory = sum(_.nbytes for _ in query_data.values() if isinstance(_, np.ndarray))
+    if features is not None:
+        memory += features.memory_usage(deep=True).sum()
+        # Without features, the spectra are the arrays of the query data
+        memory += sum(_.nbytes for _ in query_spectra)
+
+    QUERY_DATA_CACHE[ms_file] = (query_data, features, query_spectra, memory/1024**3)
+
+    while len(QUERY_DATA_CACHE) > 1 and sum(_[3] for _ in QUERY_DATA_CACHE.values()) > QUERY_DATA_CACHE_MAX_MEMORY:
+        QUERY_DATA_CACHE.popitem(last=False)
+
+    return query_data, features, query_spectra
 
 # Cell
 
@@ -994,7 +2745,7 @@ import os
 import alphapept.performance
 
 #This function is a wrapper and ist tested by the quick_test
-def search_fasta_block(to_process:tuple) -> (list, int):
+def search_fasta_block(to_process:tuple) -> (int, list, int, list):
     """Search fasta block. This file digests per block and does not use a saved database.
     For searches with big fasta files or unspecific searches.
 
@@ -1002,8 +2753,10 @@ def search_fasta_block(to_process:tuple) -> (list, int):
         to_process (tuple): Tuple containing a fasta_index, fasta_block, a list of files and a list of experimental settings.
 
     Returns:
-        list: A list of dataframes when searching the respective file.
+        int: The fasta_index of the first entry of the block.
+        list: A list for each file with tuples of a dataframe with PSMs, the start positions (fasta_indptr) and values of the fasta indices of each PSM and the ions of the PSMs.
         int: Number of new peptides that were generated in this iteration.
+        list: A list for each file with the search statistics of each spectra block.
     """
 
 
@@ -1014,6 +2767,7 @@ def search_fasta_block(to_process:tuple) -> (list, int):
     to_add = List()
 
     psms_container = [list() for _ in ms_files]
+    search_stats_container = [list() for _ in ms_files]
 
     f_index = 0
 
@@ -1038,8 +2792,9 @@ def search_fasta_block(to_process:tuple) -> (list, int):
             precmasses, seqs, fragmasses, fragtypes = zip(*spectra)
             sortindex = np.argsort(precmasses)
 
-            fragmasses = np.array(fragmasses, dtype=object)[sortindex]
-            fragtypes = np.array(fragtypes, dtype=object)[sortindex]
+            # Lists instead of object arrays, which become 2D if all spectra have the same length
+            fragmasses = [fragmasses[_] for _ in sortindex]
+            fragtypes = [fragtypes[_] for _ in sortindex]
 
             lens = [len(_) for _ in fragmasses]
 
@@ -1070,128 +2825,505 @@ def search_fasta_block(to_process:tuple) -> (list, int):
             db_data["indices"] = indices
 
             for file_idx, ms_file in enumerate(ms_files):
-                query_data = alphapept.io.MS_Data_File(
-                    f"{ms_file}"
-                ).read_DDA_query_data(swmr=True)
-
-                try:
-                    features = alphapept.io.MS_Data_File(
-                        ms_file
-                    ).read(dataset_name="features",swmr=True)
-                except FileNotFoundError:
-                    features = None
-                except KeyError:
-                    features = None
+                query_data, features, query_spectra = get_query_data(ms_file)
 
-                psms, num_specs_compared = get_psms(query_data, db_data, features, **settings[file_idx]["search"])
+                psms, search_stats = get_psms(query_data, db_data, features, query_spectra=query_spectra, frag_bin_width=settings[file_idx]["fasta"]["frag_bin_width"], **settings[file_idx]["search"])
+                if search_stats is not None:
+                    search_stats_container[file_idx].append(search_stats)
 
                 if len(psms) > 0:
                     #This could be speed up..
-                    psms, ions = get_score_columns(psms, query_data, db_data, features, **settings[file_idx]["search"])
+                    psms, ions = get_score_columns(psms, query_data, db_data, features, query_spectra=query_spectra, **settings[file_idx]["search"])
 
-                    fasta_indices = [set(x for x in pept_dict[_]) for _ in psms['sequence']]
+                    fasta_indices = [pept_dict[_] for _ in psms['sequence']]
+                    fasta_indptr = np.zeros(len(fasta_indices) + 1, dtype=np.int64)
+                    fasta_indptr[1:] = np.cumsum([len(_) for _ in fasta_indices])
+                    fasta_indices = np.array([i for _ in fasta_indices for i in _], dtype=np.int64)
 
-                    psms_df = pd.DataFrame(psms)
-                    psms_df['fasta_index'] = fasta_indices
+                    psms_container[file_idx].append((psms.to_df(), fasta_indptr, fasta_indices, ions))
 
-                    psms_container[file_idx].append(psms_df)
-
-    return psms_container, len(to_add)
+    return fasta_index, psms_container, len(to_add), search_stats_container
 
 # Cell
+import alphapept.io
 
-def filter_top_n(temp:pd.DataFrame, top_n:int = 10)-> pd.DataFrame:
-    """Takes a dataframe and keeps only the top n entries (based on hits).
-    Combines fasta indices for sequences.
+@njit
+def merge_top_n(slot_rows:np.ndarray, slot_hits:np.ndarray, slot_features:np.ndarray, slot_seqs:np.ndarray, raw_idx:np.ndarray, hits:np.ndarray, feature_idx:np.ndarray, seq_ids:np.ndarray, row_offset:int)->int:
+    """Merge new PSMs into the top-n slots of their queries.
+    A PSM is only inserted if its query has an empty slot or if it has more hits than the worst PSM of the query.
+    Duplicates (same feature, sequence and hits) are skipped.
 
     Args:
-        temp (pd.DataFrame): Pandas DataFrame containing PSMs.
-        top_n (int, optional): Number of top-n entries to be kept. Defaults to 10.
+        slot_rows (np.ndarray): 2D array (n_queries x top_n) with the rows of the PSMs in the slots. Empty slots are -1.
+        slot_hits (np.ndarray): 2D array with the hits of the PSMs in the slots.
+        slot_features (np.ndarray): 2D array with the feature_idx of the PSMs in the slots.
+        slot_seqs (np.ndarray): 2D array with the sequence ids of the PSMs in the slots.
+        raw_idx (np.ndarray): Queries of the new PSMs.
+        hits (np.ndarray): Hits of the new PSMs.
+        feature_idx (np.ndarray): feature_idx of the new PSMs.
+        seq_ids (np.ndarray): Sequence ids of the new PSMs.
+        row_offset (int): Row of the first new PSM.
 
     Returns:
-        pd.DataFrame: Filtered DataFrame.
+        int: The change of the number of PSMs in the slots.
     """
-    pept_dict_ = {}
+    top_n = slot_rows.shape[1]
+    n_added = 0
+
+    for i in range(len(raw_idx)):
+        q = raw_idx[i]
+        empty = -1
+        lowest = -1
+        duplicate = False
+
+        for j in range(top_n):
+            if slot_rows[q, j] == -1:
+                if empty == -1:
+                    empty = j
+            else:
+                if (slot_features[q, j] == feature_idx[i]) and (slot_seqs[q, j] == seq_ids[i]) and (slot_hits[q, j] == hits[i]):
+                    duplicate = True
+                    break
+                if (lowest == -1) or (slot_hits[q, j] < slot_hits[q, lowest]):
+                    lowest = j
+
+        if duplicate:
+            continue
+
+        if empty != -1:
+            target = empty
+            n_added += 1
+        elif hits[i] > slot_hits[q, lowest]:
+            target = lowest
+        else:
+            continue
 
-    temp['temp_idx'] = np.arange(len(temp))
+        slot_rows[q, target] = row_offset + i
+        slot_hits[q, target] = hits[i]
+        slot_features[q, target] = feature_idx[i]
+        slot_seqs[q, target] = seq_ids[i]
 
-    for k, v in temp[['sequence','fasta_index']].values:
-        if k in pept_dict_:
-            new_set = pept_dict_[k]
-            if isinstance(v, set):
-                new_set.update(v)
-            else:
-                new_set.add(v)
-            pept_dict_[k] = new_set
+    return n_added
+
+
+def select_ions(ions:np.ndarray, ion_idx:np.ndarray, n_ions:np.ndarray)->(np.ndarray, np.ndarray):
+    """Gather the ions of a selection of PSMs into a new contiguous ion array.
+
+    Args:
+        ions (np.ndarray): Array with the ions of all PSMs.
+        ion_idx (np.ndarray): First row in ions of each selected PSM.
+        n_ions (np.ndarray): Number of ions of each selected PSM.
+
+    Returns:
+        np.ndarray: Array with the ions of the selected PSMs in the order of the selection.
+        np.ndarray: First row of each selected PSM in the new ion array.
+    """
+    new_ion_idx = np.zeros(len(n_ions), dtype=np.int64)
+    new_ion_idx[1:] = np.cumsum(n_ions)[:-1]
+
+    positions = np.repeat(ion_idx - new_ion_idx, n_ions) + np.arange(np.sum(n_ions))
+
+    return ions[positions], new_ion_idx
+
+
+class TopNAccumulator():
+    """Collect the top-n PSMs per query (raw_idx) of a file over multiple search blocks.
+    If ions are added with the PSMs, they are kept for the top-n PSMs only.
+
+    Args:
+        top_n (int, optional): Number of top-n PSMs to be kept per query. Defaults to 10.
+    """
+
+    def __init__(self, top_n:int = 10):
+        self.top_n = top_n
+
+        self.slot_rows = np.full((0, top_n), -1, dtype=np.int64)
+        self.slot_hits = np.zeros((0, top_n), dtype=np.float64)
+        self.slot_features = np.zeros((0, top_n), dtype=np.int64)
+        self.slot_seqs = np.zeros((0, top_n), dtype=np.int64)
+
+        self.chunks = []
+        self.ion_chunks = None
+        self.n_rows = 0
+        self.n_psms = 0
+
+        self.seq_ids = {}
+        self.fasta_seqs = []
+        self.fasta_indices = []
+        self.n_fasta = 0
+        self.n_fasta_unique = 0
+
+        self.spilled = None
+
+    def __len__(self):
+        return self.n_psms
+
+    def _grow(self, n_queries:int):
+        """Add empty slots so that there are slots for at least n_queries."""
+        n_old = len(self.slot_rows)
+        if n_queries <= n_old:
+            return
+        n_new = max(n_queries, 2 * n_old) - n_old
+
+        self.slot_rows = np.concatenate([self.slot_rows, np.full((n_new, self.top_n), -1, dtype=np.int64)])
+        self.slot_hits = np.concatenate([self.slot_hits, np.zeros((n_new, self.top_n), dtype=np.float64)])
+        self.slot_features = np.concatenate([self.slot_features, np.zeros((n_new, self.top_n), dtype=np.int64)])
+        self.slot_seqs = np.concatenate([self.slot_seqs, np.zeros((n_new, self.top_n), dtype=np.int64)])
+
+    def _compact(self):
+        """Remove all rows that are not in the top-n slots anymore."""
+        rows = np.sort(self.slot_rows[self.slot_rows >= 0])
+
+        if self.spilled is not None:
+            ms_file, group_name = self.spilled
+            columns = ms_file.read(group_name=group_name, dataset_name='columns')
+            self.chunks.insert(0, ms_file.read(group_name=group_name, dataset_name='psms')[columns])
+            if self.ion_chunks is not None:
+                self.ion_chunks.insert(0, ms_file.read(group_name=group_name, dataset_name='ions'))
+            self.spilled = None
+
+        if len(self.chunks) > 1:
+            df = pd.concat(self.chunks, ignore_index=True)
         else:
-            pept_dict_[k] = set(v)
+            df = self.chunks[0]
+
+        df = df.iloc[rows].reset_index(drop=True)
+
+        if self.ion_chunks is not None:
+            ion_offsets = np.cumsum([0] + [len(_) for _ in self.ion_chunks])
+            ion_idx = np.concatenate([chunk['ion_idx'].values + offset for chunk, offset in zip(self.chunks, ion_offsets)])
+            ions, df['ion_idx'] = select_ions(np.concatenate(self.ion_chunks), ion_idx[rows], df['n_ions'].values)
+            self.ion_chunks = [ions]
+
+        self.chunks = [df]
+        self.n_rows = len(rows)
+
+        valid = self.slot_rows >= 0
+        self.slot_rows[valid] = np.searchsorted(rows, self.slot_rows[valid])
+
+    def _unique_fasta_index(self):
+        """Remove duplicate sequence - fasta index pairs."""
+        seqs = np.concatenate(self.fasta_seqs)
+        indices = np.concatenate(self.fasta_indices)
+
+        order = np.lexsort((indices, seqs))
+        seqs = seqs[order]
+        indices = indices[order]
+
+        keep = np.ones(len(seqs), dtype=np.bool_)
+        keep[1:] = (seqs[1:] != seqs[:-1]) | (indices[1:] != indices[:-1])
+
+        self.fasta_seqs = [seqs[keep]]
+        self.fasta_indices = [indices[keep]]
+        self.n_fasta = self.n_fasta_unique = np.sum(keep)
+
+    def add(self, psms:pd.DataFrame, fasta_indptr:np.ndarray, fasta_indices:np.ndarray, ions:np.ndarray = None):
+        """Merge new PSMs.
+
+        Args:
+            psms (pd.DataFrame): DataFrame with PSMs. Needs to contain the columns raw_idx, hits, feature_idx and sequence.
+            fasta_indptr (np.ndarray): Start and end positions of the fasta indices of each PSM in fasta_indices.
+            fasta_indices (np.ndarray): The fasta indices of the PSMs.
+            ions (np.ndarray, optional): The ions of the PSMs as returned by `get_score_columns`. The PSMs need to contain the columns ion_idx and n_ions. Either all or no PSMs are added with ions. Defaults to None.
+
+        Raises:
+            ValueError: When PSMs are added with ions to an accumulator without ions or vice versa.
+        """
+        if len(psms) == 0:
+            return
+
+        if ions is not None:
+            if self.ion_chunks is None:
+                if self.n_rows > 0:
+                    raise ValueError('PSMs without ions were already added.')
+                self.ion_chunks = []
+            self.ion_chunks.append(np.asarray(ions))
+        elif self.ion_chunks is not None:
+            raise ValueError('PSMs need to be added with ions.')
+
+        seq_ids = np.array([self.seq_ids.setdefault(_, len(self.seq_ids)) for _ in psms['sequence'].values], dtype=np.int64)
+
+        self.fasta_seqs.append(np.repeat(seq_ids, np.diff(fasta_indptr)))
+        self.fasta_indices.append(np.asarray(fasta_indices, dtype=np.int64))
+        self.n_fasta += len(fasta_indices)
+        if self.n_fasta > 2 * self.n_fasta_unique + 10**6:
+            self._unique_fasta_index()
+
+        raw_idx = psms['raw_idx'].values.astype(np.int64)
+        self._grow(np.max(raw_idx) + 1)
+
+        self.n_psms += merge_top_n(
+            self.slot_rows,
+            self.slot_hits,
+            self.slot_features,
+            self.slot_seqs,
+            raw_idx,
+            psms['hits'].values.astype(np.float64),
+            psms['feature_idx'].values.astype(np.int64),
+            seq_ids,
+            self.n_rows
+        )
+
+        self.chunks.append(psms.reset_index(drop=True))
+        self.n_rows += len(psms)
+
+        if self.n_rows > 2 * self.n_psms:
+            self._compact()
+
+    def save(self, ms_file:alphapept.io.MS_Data_File, group_name:str):
+        """Write the state to a group of an hdf file and release the PSMs from memory.
+        Only the slots are kept in memory, the PSMs are read again from the group when rows are removed or the final DataFrame is created.
+
+        Args:
+            ms_file (alphapept.io.MS_Data_File): Writable hdf file.
+            group_name (str): Name of the group. An existing group is replaced.
+        """
+        if self.n_rows > 0:
+            self._compact()
+        if len(self.fasta_seqs) > 0:
+            self._unique_fasta_index()
+
+        ms_file.write(group_name)
+
+        if self.n_rows > 0:
+            ms_file.write(self.chunks[0], group_name=group_name, dataset_name='psms')
+            ms_file.write(np.array(self.chunks[0].columns, dtype=object), group_name=group_name, dataset_name='columns')
+            if self.ion_chunks is not None:
+                ms_file.write(self.ion_chunks[0], group_name=group_name, dataset_name='ions')
+
+        for name in ['slot_rows', 'slot_hits', 'slot_features', 'slot_seqs']:
+            ms_file.write(getattr(self, name), group_name=group_name, dataset_name=name)
+
+        seqs = np.empty(len(self.seq_ids), dtype=object)
+        for seq, seq_id in self.seq_ids.items():
+            seqs[seq_id] = seq
+        ms_file.write(seqs, group_name=group_name, dataset_name='sequences')
+
+        if len(self.fasta_seqs) > 0:
+            ms_file.write(self.fasta_seqs[0], group_name=group_name, dataset_name='fasta_seqs')
+            ms_file.write(self.fasta_indices[0], group_name=group_name, dataset_name='fasta_indices')
+
+        ms_file.write(self.top_n, group_name=group_name, attr_name='top_n')
+        ms_file.write(self.n_rows, group_name=group_name, attr_name='n_rows')
+        ms_file.write(self.n_psms, group_name=group_name, attr_name='n_psms')
+
+        self.chunks = []
+        if self.ion_chunks is not None:
+            self.ion_chunks = []
+        if self.n_rows > 0:
+            self.spilled = (ms_file, group_name)
+
+    @classmethod
+    def load(cls, ms_file:alphapept.io.MS_Data_File, group_name:str):
+        """Create an accumulator from a group that was written with `save`.
+        The PSMs stay on disk until they are needed.
+
+        Args:
+            ms_file (alphapept.io.MS_Data_File): Hdf file.
+            group_name (str): Name of the group.
+
+        Returns:
+            TopNAccumulator: The restored accumulator.
+        """
+        acc = cls(top_n = int(ms_file.read(group_name=group_name, attr_name='top_n')))
+
+        for name in ['slot_rows', 'slot_hits', 'slot_features', 'slot_seqs']:
+            setattr(acc, name, ms_file.read(group_name=group_name, dataset_name=name))
+
+        seqs = ms_file.read(group_name=group_name, dataset_name='sequences')
+        acc.seq_ids = {seq: seq_id for seq_id, seq in enumerate(seqs)}
 
-    temp['fasta_index'] = [pept_dict_[_] for _ in temp['sequence']]
-    temp = temp.drop_duplicates(subset = ['raw_idx','sequence','hits','feature_idx'])
-    temp = temp.sort_values('hits', ascending = False).groupby('raw_idx').head(top_n)
+        if 'ions' in ms_file.read(group_name=group_name):
+            acc.ion_chunks = []
 
-    return temp
+        if 'fasta_seqs' in ms_file.read(group_name=group_name):
+            acc.fasta_seqs = [ms_file.read(group_name=group_name, dataset_name='fasta_seqs')]
+            acc.fasta_indices = [ms_file.read(group_name=group_name, dataset_name='fasta_indices')]
+            acc.n_fasta = acc.n_fasta_unique = len(acc.fasta_seqs[0])
 
+        acc.n_rows = int(ms_file.read(group_name=group_name, attr_name='n_rows'))
+        acc.n_psms = int(ms_file.read(group_name=group_name, attr_name='n_psms'))
+
+        if acc.n_rows > 0:
+            acc.spilled = (ms_file, group_name)
+
+        return acc
+
+    def to_df(self, return_ions:bool = False)->pd.DataFrame:
+        """Get the top-n PSMs.
+
+        Args:
+            return_ions (bool, optional): Flag to additionally return the ions of the PSMs. Defaults to False.
+
+        Returns:
+            pd.DataFrame: DataFrame with the top-n PSMs sorted by hits. The fasta_index column contains the comma-separated fasta indices of the sequences.
+            np.ndarray: The ions of the PSMs in the order of the DataFrame, referenced by its ion_idx column. Only returned if return_ions is set.
+
+        Raises:
+            ValueError: When return_ions is set and the PSMs were added without ions.
+        """
+        if return_ions and (self.ion_chunks is None) and (self.n_psms > 0):
+            raise ValueError('The PSMs were added without ions.')
+
+        if self.n_psms == 0:
+            if return_ions:
+                return pd.DataFrame(), np.zeros((0, 8))
+            return pd.DataFrame()
+
+        self._compact()
+        self._unique_fasta_index()
+
+        df = self.chunks[0]
+        seq_ids = self.slot_seqs[self.slot_rows >= 0][np.argsort(self.slot_rows[self.slot_rows >= 0])]
+
+        seqs = self.fasta_seqs[0]
+        indices = self.fasta_indices[0]
+        indptr = np.zeros(len(self.seq_ids) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(seqs, minlength=len(self.seq_ids)))
+
+        fasta_index = {}
+        for _ in np.unique(seq_ids):
+            fasta_index[_] = ','.join(str(i) for i in indices[indptr[_]:indptr[_+1]])
+
+        df['fasta_index'] = [fasta_index[_] for _ in seq_ids]
+        df = df.sort_values('hits', ascending=False, kind='mergesort').reset_index(drop=True)
+
+        if return_ions:
+            ions, df['ion_idx'] = select_ions(self.ion_chunks[0], df['ion_idx'].values, df['n_ions'].values)
+            return df, ions
+
+        return df
 
 # Cell
 import psutil
-import alphapept.constants as constants
-from .fasta import get_fragmass, parse
+import hashlib
+import json
 
-def ion_extractor(df: pd.DataFrame, ms_file, frag_tol:float, ppm:bool)->(np.ndarray, np.ndarray):
-    """Extracts the matched hits (ions) from a dataframe.
+def get_search_fingerprint(settings:dict, ms_file_path:str)->str:
+    """Fingerprint of the settings and the search input of a file for `search_parallel`.
+    A checkpoint is only resumed if the fingerprint did not change.
+    The input is identified by the content of the features, the precursors and the fragment calibration and not by the modification time, as other steps (e.g. the recalibration) rewrite the ms_data file.
 
     Args:
-        df (pd.DataFrame): Pandas dataframe containing the results of the first search.
-        ms_file : MsFile
-        frag_tol (float): Fragment tolerance for search.
-        ppm (bool): Flag to use ppm instead of Dalton.
+        settings (dict): Settings of the file, including calibrated tolerances.
+        ms_file_path (str): Path to the ms_data file.
 
     Returns:
-        np.ndarray: Numpy recordarray storing the PSMs.
-        np.ndarray: Numpy recordarray storing the ions.
+        str: Hexadecimal fingerprint.
     """
+    ms_file = alphapept.io.MS_Data_File(ms_file_path)
 
-    query_data = ms_file.read_DDA_query_data()
-    query_indices = query_data["indices_ms2"]
-    query_frags = query_data['mass_list_ms2']
-    query_ints = query_data['int_list_ms2']
+    data = {}
+    for group_name, dataset_name in [(None, 'features'), ('Raw/MS2_scans', 'prec_mass_list2'), (None, 'corrected_fragment_mzs')]:
+        try:
+            values = ms_file.read(group_name=group_name, dataset_name=dataset_name)
+        except KeyError:
+            continue
+        if isinstance(values, pd.DataFrame):
+            values = pd.util.hash_pandas_object(values)
+        data[dataset_name] = hashlib.sha1(np.ascontiguousarray(values).tobytes()).hexdigest()
+
+    try:
+        data['n_fragments'] = int(ms_file.read(group_name='Raw/MS2_scans', dataset_name='mass_list_ms2', return_dataset_shape=True)[0])
+    except KeyError:
+        pass
 
-    psms = df.to_records()
+    content = {
+        'fasta': {key: value for key, value in settings['fasta'].items() if key != 'checkpoint_blocks'},
+        'search': settings['search'],
+        'fasta_paths': settings['experiment']['fasta_paths'],
+        'ms_file': os.path.abspath(ms_file_path),
+        'data': data,
+    }
 
-    ion_count = 0
+    return hashlib.sha1(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
 
-    ions_ = List()
 
-    for i in range(len(psms)):
-        query_idx = psms[i]["raw_idx"]
-        db_idx = psms[i]["db_idx"]
-        query_idx_start = query_indices[query_idx]
-        query_idx_end = query_indices[query_idx + 1]
-        query_frag = query_frags[query_idx_start:query_idx_end]
-        query_int = query_ints[query_idx_start:query_idx_end]
+def write_search_checkpoint(ms_file_path:str, search_pass:str, slot:int, accumulator:TopNAccumulator, completed_blocks:set, search_stats:dict, n_seqs:int, fingerprint:str):
+    """Save the state of `search_parallel` for a file to its temporary `.ms_data.hdf_` file.
+    Checkpoints alternate between two groups so that the previous checkpoint stays valid until the new one is written completely.
 
-        seq = psms[i]['sequence']
+    Args:
+        ms_file_path (str): Path to the ms_data file.
+        search_pass (str): Pass of the search, either 'first' or 'second'.
+        slot (int): Group of the checkpoint, either 0 or 1.
+        accumulator (TopNAccumulator): Top-n PSMs of the file. The PSMs are released from memory, see `TopNAccumulator.save`.
+        completed_blocks (set): fasta_index of the first entry of all completed FASTA blocks.
+        search_stats (dict): Merged search statistics of the completed blocks. None if no statistics were collected.
+        n_seqs (int): Number of peptides that were generated in the completed blocks.
+        fingerprint (str): Fingerprint as returned by `get_search_fingerprint`.
+    """
+    ms_file = alphapept.io.MS_Data_File(ms_file_path+'_', is_overwritable=True)
+    group_name = f'search_checkpoint_{search_pass}_{slot}'
 
-        db_frag, frag_type = get_fragmass(parse(seq), constants.mass_dict)
-        db_int = np.ones_like(db_frag)
+    accumulator.save(ms_file, group_name)
+    ms_file.write(np.array(sorted(completed_blocks), dtype=np.int64), group_name=group_name, dataset_name='completed_blocks')
 
-        ions = get_hits(query_frag, query_int, db_frag, db_int, frag_type, frag_tol, ppm, LOSSES)
+    if search_stats is not None:
+        ms_file.write('search_stats', group_name=group_name)
+        for name, value in search_stats.items():
+            ms_file.write(value, group_name=f'{group_name}/search_stats', attr_name=name)
 
-        n_ions = len(ions)
+    ms_file.write(n_seqs, group_name=group_name, attr_name='n_seqs')
+    # Written last, a checkpoint without fingerprint is incomplete
+    ms_file.write(fingerprint, group_name=group_name, attr_name='fingerprint')
 
-        psms['n_ions'][i] = n_ions
-        psms['ion_idx'][i] = ion_count
 
-        ion_count += n_ions
-        ions_.append(ions)
+def read_search_checkpoints(ms_file_path:str, search_pass:str, fingerprint:str)->dict:
+    """Find the valid checkpoints of a file and search pass that were written with `write_search_checkpoint`.
 
-    ions_ = np.vstack(ions_)
+    Args:
+        ms_file_path (str): Path to the ms_data file.
+        search_pass (str): Pass of the search, either 'first' or 'second'.
+        fingerprint (str): Fingerprint as returned by `get_search_fingerprint`.
 
-    return psms, ions_
+    Returns:
+        dict: The slot of each checkpoint with the completed blocks (as tuple) as key.
+    """
+    checkpoints = {}
+
+    if not os.path.isfile(ms_file_path+'_'):
+        return checkpoints
+
+    ms_file = alphapept.io.MS_Data_File(ms_file_path+'_')
+
+    for slot in range(2):
+        group_name = f'search_checkpoint_{search_pass}_{slot}'
+        try:
+            if ms_file.read(group_name=group_name, attr_name='fingerprint') != fingerprint:
+                continue
+            completed_blocks = ms_file.read(group_name=group_name, dataset_name='completed_blocks')
+        except KeyError:
+            continue
+        checkpoints[tuple(completed_blocks)] = slot
+
+    return checkpoints
+
+
+def remove_search_checkpoints(ms_file_path:str, search_pass:str):
+    """Remove the checkpoints of a search pass from the temporary `.ms_data.hdf_` file of a file.
+    The checkpoints of the other pass are kept, e.g. when the first search is repeated before an interrupted second search is resumed.
+    If there are none, an empty temporary file is created instead.
+
+    Args:
+        ms_file_path (str): Path to the ms_data file.
+        search_pass (str): Pass of the search, either 'first' or 'second'.
+    """
+    if os.path.isfile(ms_file_path+'_'):
+        ms_file = alphapept.io.MS_Data_File(ms_file_path+'_', is_overwritable=True)
+        groups = ms_file.read()
+        other_groups = [_ for _ in groups if _.startswith('search_checkpoint_') and not _.startswith(f'search_checkpoint_{search_pass}_')]
+
+        if len(other_groups) > 0:
+            for slot in range(2):
+                group_name = f'search_checkpoint_{search_pass}_{slot}'
+                if group_name in groups:
+                    ms_file.write(group_name) #Overwriting truncates the group
+            return
+
+    alphapept.io.MS_Data_File(ms_file_path+'_', is_new_file=True)
 
 
-#This function is a wrapper and ist tested by the quick_test
 def search_parallel(settings: dict, calibration:Union[list, None] = None, fragment_calibration:Union[list, None] = None, callback: Union[Callable, None] = None) -> dict:
     """Function to search multiple ms_data files in parallel.
     This function will additionally calculate fragments and precursor masses from a given FASTA file.
@@ -1229,8 +3361,50 @@ def search_parallel(settings: dict, calibration:Union[list, None] = None, fragme
             custom_settings[idx]["search"]["frag_tol_calibrated"] = _
 
 
+    search_pass = 'second' if (calibration or fragment_calibration) else 'first'
+    checkpoint_blocks = settings['fasta']['checkpoint_blocks']
+    fingerprints = [get_search_fingerprint(custom_settings[idx], _) for idx, _ in enumerate(ms_file_path)]
+
+    resume = None
+    if (checkpoint_blocks > 0) and (len(ms_file_path) > 0):
+        checkpoints = [read_search_checkpoints(_, search_pass, fingerprints[idx]) for idx, _ in enumerate(ms_file_path)]
+        # Only resume from blocks that were completed for all files
+        common = set(checkpoints[0]).intersection(*checkpoints[1:])
+        if len(common) > 0:
+            resume = max(common, key=len)
+
+    if resume is None:
+        for _ in ms_file_path:
+            remove_search_checkpoints(_, search_pass)
+
+        accumulators = [TopNAccumulator() for _ in ms_file_path]
+        search_stats_list = [list() for _ in ms_file_path]
+        completed_blocks = set()
+        slots = [0 for _ in ms_file_path]
+        n_seqs_ = 0
+    else:
+        accumulators = []
+        search_stats_list = []
+        slots = []
+
+        for idx, _ in enumerate(ms_file_path):
+            slot = checkpoints[idx][resume]
+            group_name = f'search_checkpoint_{search_pass}_{slot}'
+            ms_file = alphapept.io.MS_Data_File(_+'_', is_overwritable=True)
+
+            accumulators.append(TopNAccumulator.load(ms_file, group_name))
+            try:
+                search_stats_list.append([ms_file.read(group_name=f'{group_name}/search_stats', attr_name='')])
+            except KeyError:
+                search_stats_list.append([])
+            slots.append(1 - slot)
+            n_seqs_ = int(ms_file.read(group_name=group_name, attr_name='n_seqs'))
+
+        completed_blocks = set(resume)
+        logging.info(f'Resuming {search_pass} search from checkpoint with {len(completed_blocks):,} completed FASTA blocks.')
+
     logging.info(f"Number of FASTA entries: {len(fasta_list):,} - FASTA settings {settings['fasta']}")
-    to_process = [(idx_start, fasta_list[idx_start:idx_end], ms_file_path, custom_settings) for idx_start, idx_end in block_idx(len(fasta_list), fasta_block)]
+    to_process = [(idx_start, fasta_list[idx_start:idx_end], ms_file_path, custom_settings) for idx_start, idx_end in block_idx(len(fasta_list), fasta_block) if idx_start not in completed_blocks]
 
     memory_available = psutil.virtual_memory().available/1024**3
 
@@ -1243,61 +3417,59 @@ def search_parallel(settings: dict, calibration:Union[list, None] = None, fragme
         set_global=False
     )
 
-    n_seqs_ = 0
-
-    for _ in ms_file_path:
-        ms_file = alphapept.io.MS_Data_File(_+'_', is_new_file=True) #Create temporary files for writing
-
-    df_cache = {}
-    ion_cache = {}
+    # Half of the memory per process is used to cache the query data
+    cache_memory = memory_available / n_processes / 2
 
-    with alphapept.performance.AlphaPool(n_processes) as p:
+    with alphapept.performance.AlphaPool(n_processes, initializer=init_query_data_cache, initargs=(ms_file_path, cache_memory)) as p:
         max_ = len(to_process)
+        n_since_checkpoint = 0
 
-        for i, (psm_container, n_seqs) in enumerate(p.imap_unordered(search_fasta_block, to_process)):
+        for i, (fasta_index, psm_container, n_seqs, search_stats_container) in enumerate(p.imap_unordered(search_fasta_block, to_process)):
             n_seqs_ += n_seqs
 
             logging.info(f'Block {i+1} of {max_} complete - {((i+1)/max_*100):.2f} % - created peptides {n_seqs:,} ')
-            for j in range(len(psm_container)): #Temporary hdf files for avoiding saving issues
-                output = [_ for _ in psm_container[j]]
-                if len(output) > 0:
-                    psms = pd.concat(output)
-                    if ms_file_path[j] in df_cache:
-                        temp = filter_top_n(pd.concat([df_cache[ms_file_path[j]], psms]))
-                        selector = temp['temp_idx'].values
-                        df_cache[ms_file_path[j]] = temp
-                    else:
-                        df_cache[ms_file_path[j]] = psms
+            for j in range(len(psm_container)):
+                for psms, fasta_indptr, fasta_indices, ions in psm_container[j]:
+                    accumulators[j].add(psms, fasta_indptr, fasta_indices, ions)
+                search_stats_list[j].extend(search_stats_container[j])
+
+            completed_blocks.add(fasta_index)
+            n_since_checkpoint += 1
+
+            if (checkpoint_blocks > 0) and (n_since_checkpoint >= checkpoint_blocks) and (i + 1 < max_):
+                for j, _ in enumerate(ms_file_path):
+                    search_stats = merge_search_stats(search_stats_list[j])
+                    search_stats_list[j] = [search_stats] if search_stats is not None else []
+                    write_search_checkpoint(_, search_pass, slots[j], accumulators[j], completed_blocks, search_stats, n_seqs_, fingerprints[j])
+                    slots[j] = 1 - slots[j]
+                n_since_checkpoint = 0
+                logging.info(f'Saved checkpoint with {len(completed_blocks):,} completed FASTA blocks.')
 
             if callback:
                 callback((i+1)/max_)
 
     for idx, _ in enumerate(ms_file_path):
-        if _ in df_cache:
-            x = df_cache[_]
+        if len(accumulators[idx]) > 0:
+            x, ions = accumulators[idx].to_df(return_ions=True)
             ms_file = alphapept.io.MS_Data_File(_)
 
-            x['fasta_index'] = x['fasta_index'].apply(lambda x: ','.join(str(_) for _ in x))
-
-
-            if 'frag_tol_calibrated' in custom_settings[idx]['search']:
-                frag_tol = custom_settings[idx]['search']['frag_tol_calibrated']
-            else:
-                frag_tol = custom_settings[idx]['search']['frag_tol']
-
-            ppm = custom_settings[idx]['search']['ppm']
-
             if calibration:
                 save_field = 'first_search'
             else:
                 save_field = 'second_search'
 
-            psms, ions = ion_extractor(x, ms_file, frag_tol, ppm)
+            psms = PSMContainer(x.reset_index())
 
-            store_hdf(pd.DataFrame(psms), ms_file, save_field, replace=True)
+            store_hdf(psms, ms_file, save_field, replace=True)
+            search_stats = merge_search_stats(search_stats_list[idx])
+            if search_stats is not None:
+                write_search_stats(search_stats, ms_file, save_field)
             ion_columns = ['ion_index','ion_type','ion_int','db_int','ion_mass','db_mass','query_idx','db_idx']
             store_hdf(pd.DataFrame(ions, columns = ion_columns), ms_file, 'ions', replace=True)
 
+    for _ in ms_file_path:
+        remove_search_checkpoints(_, search_pass)
+
     #Todo? Callback
     logging.info(f'Complete. Created peptides {n_seqs_:,}')
 